@@ -0,0 +1,69 @@
+import hashlib
+import logging
+import os
+import shutil
+from pathlib import Path
+from typing import Optional
+import database
+
+# --- Armazém de documentos endereçado por conteúdo ---
+# Cada arquivo baixado é guardado uma única vez em documentos/_blobs/<hash[:2]>/<sha256> e aparece
+# na pasta do NPJ como hard link (ou cópia, se o sistema de arquivos não suportar links). A tabela
+# 'documentos_armazenados' indica, antes do clique, quais documentos (NPJ + nome + data) já estão em disco.
+DIRETORIO_BLOBS = Path(__file__).resolve().parent / "documentos" / "_blobs"
+TAMANHO_BLOCO_HASH = 1024 * 1024
+
+def calcular_hash(caminho: Path) -> str:
+    sha256 = hashlib.sha256()
+    with open(caminho, 'rb') as arquivo:
+        for bloco in iter(lambda: arquivo.read(TAMANHO_BLOCO_HASH), b''):
+            sha256.update(bloco)
+    return sha256.hexdigest()
+
+def _vincular(blob: Path, destino: Path):
+    """Faz o arquivo da pasta do NPJ apontar para o blob: hard link quando possível, cópia caso contrário."""
+    if destino.exists():
+        destino.unlink()
+    try:
+        os.link(blob, destino)
+    except OSError:
+        shutil.copy2(blob, destino)
+
+def _blob_do_hash(hash_conteudo: str) -> Path:
+    return DIRETORIO_BLOBS / hash_conteudo[:2] / hash_conteudo
+
+def documento_ja_armazenado(npj: str, nome: str, data_documento: str) -> Optional[str]:
+    """
+    Retorna o caminho do documento se ele já foi baixado para este NPJ e o arquivo em disco ainda tem o
+    conteúdo registrado. Outro documento com o mesmo nome de arquivo pode ter ocupado o caminho depois.
+    """
+    registro = database.buscar_documento_armazenado(npj, nome, data_documento)
+    if not registro or not Path(registro['caminho']).exists():
+        return None
+    caminho, blob = Path(registro['caminho']), _blob_do_hash(registro['hash'])
+    # Hard link para o blob dispensa recalcular o hash; cópias (sem suporte a links) são conferidas pelo conteúdo.
+    if (blob.exists() and os.path.samefile(caminho, blob)) or calcular_hash(caminho) == registro['hash']:
+        return str(caminho)
+    logging.info(f"         - '{caminho.name}' em disco não é mais o documento '{nome}' registrado; baixando novamente.")
+    return None
+
+def armazenar(caminho_baixado: Path, npj: str, nome: str, data_documento: str) -> Path:
+    """
+    Move o arquivo recém-baixado para o armazém (descartando-o se o conteúdo já existir) e o
+    recoloca no mesmo caminho como link para o blob. Retorna o caminho do documento na pasta do NPJ.
+    """
+    caminho_baixado = Path(caminho_baixado)
+    hash_conteudo = calcular_hash(caminho_baixado)
+    tamanho = caminho_baixado.stat().st_size
+    blob = _blob_do_hash(hash_conteudo)
+
+    if blob.exists():
+        logging.info(f"         - Conteúdo de '{nome}' já existe no armazém; reaproveitando o arquivo ({hash_conteudo[:12]}).")
+        caminho_baixado.unlink()
+    else:
+        blob.parent.mkdir(parents=True, exist_ok=True)
+        os.replace(caminho_baixado, blob)
+    _vincular(blob, caminho_baixado)
+
+    database.registrar_documento_armazenado(npj, nome, data_documento, hash_conteudo, tamanho, str(caminho_baixado))
+    return caminho_baixado
@@ -5,6 +5,7 @@ import time
 from tqdm import tqdm
 from autologin import realizar_login_automatico
 import database
+from conexao import obter_conexao, fechar_conexao
 from playwright.sync_api import sync_playwright, Page, Error as PlaywrightError, TimeoutError, Browser
 from session import SessionExpiredError # Importa a exceção de sessão
 
@@ -60,7 +61,7 @@ def extrair_polo(page: Page):
 
 def atualizar_polos_existentes():
     """
-    Script para percorrer as notificações no banco de dados que não possuem
+    Script para percorrer as tarefas no banco de dados que não possuem
     a informação de "polo", navegar para a página de detalhes e atualizar o banco,
     com capacidade de renovar a sessão automaticamente.
     """
@@ -69,7 +70,7 @@ def atualizar_polos_existentes():
     
     try:
         database.inicializar_banco()
-        conn = sqlite3.connect(database.DATABASE_PATH)
+        conn = obter_conexao()
         cursor = conn.cursor()
         logging.info("Conectado ao banco de dados.")
 
@@ -77,15 +78,15 @@ def atualizar_polos_existentes():
             ainda_existem_npjs = True
             while ainda_existem_npjs:
                 try:
-                    cursor.execute("SELECT id, NPJ FROM notificacoes WHERE (polo IS NULL OR polo = '' OR polo = 'N/A' OR polo = 'Erro_Atualizacao') AND NPJ IS NOT NULL AND NPJ != ''")
-                    notificacoes_a_processar = cursor.fetchall()
+                    cursor.execute("SELECT id, NPJ FROM tarefas WHERE (polo IS NULL OR polo = '' OR polo = 'N/A' OR polo = 'Erro_Atualizacao') AND NPJ IS NOT NULL AND NPJ != ''")
+                    tarefas_a_processar = cursor.fetchall()
 
-                    if not notificacoes_a_processar:
-                        logging.info("Nenhuma notificação com polo pendente encontrada. Tudo em dia!")
+                    if not tarefas_a_processar:
+                        logging.info("Nenhuma tarefa com polo pendente encontrada. Tudo em dia!")
                         ainda_existem_npjs = False
                         continue
 
-                    logging.info(f"Encontradas {len(notificacoes_a_processar)} notificações para atualizar o polo.")
+                    logging.info(f"Encontradas {len(tarefas_a_processar)} tarefas para atualizar o polo.")
 
                     logging.info("Iniciando o navegador e fazendo login no portal...")
                     browser, context, _, _ = realizar_login_automatico(p)
@@ -98,7 +99,7 @@ def atualizar_polos_existentes():
                     page = context.new_page()
                     logging.info("Login realizado com sucesso. Iniciando a atualização dos polos...")
 
-                    for notificacao_id, npj in tqdm(notificacoes_a_processar, desc="Atualizando Polos"):
+                    for tarefa_id, npj in tqdm(tarefas_a_processar, desc="Atualizando Polos"):
                         # Verifica o tempo da sessão antes de cada iteração
                         if time.time() - login_time > (25 * 60): # 25 minutos
                             raise SessionExpiredError("Limite de 25 minutos atingido, forçando a renovação da sessão.")
@@ -108,20 +109,20 @@ def atualizar_polos_existentes():
                             polo = extrair_polo(page)
                             
                             if polo:
-                                cursor.execute("UPDATE notificacoes SET polo = ? WHERE id = ?", (polo, notificacao_id))
+                                cursor.execute("UPDATE tarefas SET polo = ? WHERE id = ?", (polo, tarefa_id))
                             else:
-                                cursor.execute("UPDATE notificacoes SET polo = ? WHERE id = ?", ('N/A', notificacao_id))
+                                cursor.execute("UPDATE tarefas SET polo = ? WHERE id = ?", ('N/A', tarefa_id))
                             
                             conn.commit()
 
                         except SessionExpiredError:
                             raise # Re-lança para ser capturada pelo loop principal e renovar a sessão
                         except (PlaywrightError, ValueError) as e:
-                            logging.error(f"Erro de automação ao processar NPJ {npj} (ID: {notificacao_id}): {e}")
-                            cursor.execute("UPDATE notificacoes SET polo = ? WHERE id = ?", ('Erro_Atualizacao', notificacao_id))
+                            logging.error(f"Erro de automação ao processar NPJ {npj} (ID: {tarefa_id}): {e}")
+                            cursor.execute("UPDATE tarefas SET polo = ? WHERE id = ?", ('Erro_Atualizacao', tarefa_id))
                             conn.commit()
                         except Exception as e:
-                            logging.critical(f"Erro inesperado ao processar o NPJ {npj} (ID: {notificacao_id}): {e}", exc_info=True)
+                            logging.critical(f"Erro inesperado ao processar o NPJ {npj} (ID: {tarefa_id}): {e}", exc_info=True)
                     
                     ainda_existem_npjs = False 
                     logging.info("\nAtualização de polos concluída!")
@@ -141,7 +142,7 @@ def atualizar_polos_existentes():
             browser.close()
         if conn:
             logging.info("Fechando a conexão com o banco de dados.")
-            conn.close()
+            fechar_conexao()
 
 if __name__ == '__main__':
     atualizar_polos_existentes()
@@ -4,6 +4,7 @@ import subprocess
 import sys
 from pathlib import Path
 from playwright.sync_api import Playwright, Browser, BrowserContext, Page, Error
+from politica_recursos import instalar_politica_de_recursos
 
 # --- CONFIGURAÇÕES DO MÓDULO ---
 BAT_FILE_NAME = "abrir_chrome.sh" if sys.platform != "win32" else "abrir_chrome.bat"
@@ -45,6 +46,8 @@ def realizar_login_automatico(playwright: Playwright) -> tuple[Browser, BrowserC
     for page in context.pages:
         if not page.is_closed():
             page.close()
+    # Imagens, fontes e analytics do portal não são usados pelo robô (ver BLOQUEIO_RECURSOS em config.py)
+    instalar_politica_de_recursos(context)
     
     browser_process_ref = {'process': browser_process}
 
@@ -0,0 +1,119 @@
+import logging
+from datetime import datetime
+from typing import Any, Dict, List, Optional
+from config import CAPTURA_XHR
+
+# --- Captura das respostas JSON do portal (modo opcional da FASE 3) ---
+# A página de consulta do processo é uma SPA que carrega cabeçalho, andamentos e documentos por XHR.
+# Com CAPTURA_XHR['ativa'], essas respostas são registradas durante a navegação e lidas direto do JSON;
+# qualquer parte sem payload reconhecido volta para a extração pelo DOM.
+
+def _valor(dado: Any, caminho: Optional[str]) -> Any:
+    """Lê um campo por caminho pontuado ('polo.descricao', 'itens.0.texto'); None se não existir."""
+    if not caminho:
+        return None
+    for parte in caminho.split('.'):
+        if isinstance(dado, dict):
+            dado = dado.get(parte)
+        elif isinstance(dado, list) and parte.isdigit() and int(parte) < len(dado):
+            dado = dado[int(parte)]
+        else:
+            return None
+    return dado
+
+def _normalizar_data(valor: Any) -> str:
+    """Converte datas do JSON ('YYYY-MM-DD...', 'dd/mm/YYYY...' ou epoch em ms) para 'dd/mm/YYYY'."""
+    if isinstance(valor, (int, float)):
+        return datetime.fromtimestamp(valor / 1000).strftime('%d/%m/%Y')
+    texto = str(valor or '').strip()
+    if len(texto) >= 10 and texto[4] == '-' and texto[7] == '-':
+        return f"{texto[8:10]}/{texto[5:7]}/{texto[0:4]}"
+    return texto[:10]
+
+class CapturaXHR:
+    """Registra, em uma página, a última resposta JSON de cada tipo configurado em CAPTURA_XHR['endpoints']."""
+
+    def __init__(self, page):
+        self.page = page
+        self.respostas: Dict[str, Any] = {}
+        self.page.on("response", self._ao_receber)
+
+    def _ao_receber(self, response):
+        if response.request.resource_type not in ('xhr', 'fetch'):
+            return
+        if CAPTURA_XHR.get('registrar_urls'):
+            # Modo de descoberta: ajuda a preencher os padrões de URL e os caminhos dos campos na configuração
+            logging.info(f"         - [XHR] {response.status} {response.url}")
+        for chave, mapa in CAPTURA_XHR['endpoints'].items():
+            if mapa.get('url_contem') and mapa['url_contem'] in response.url and response.ok:
+                self.respostas[chave] = response
+
+    def encerrar(self):
+        self.page.remove_listener("response", self._ao_receber)
+
+    def json(self, chave: str) -> Any:
+        """Corpo JSON da resposta capturada para a chave (API síncrona); None se ausente ou inválido."""
+        resposta = self.respostas.get(chave)
+        if resposta is None:
+            return None
+        try:
+            return resposta.json()
+        except Exception as e:
+            logging.warning(f"         - Resposta XHR de '{chave}' não pôde ser lida como JSON: {e}")
+            return None
+
+    async def json_async(self, chave: str) -> Any:
+        """Equivalente a 'json' para páginas da playwright.async_api."""
+        resposta = self.respostas.get(chave)
+        if resposta is None:
+            return None
+        try:
+            return await resposta.json()
+        except Exception as e:
+            logging.warning(f"         - Resposta XHR de '{chave}' não pôde ser lida como JSON: {e}")
+            return None
+
+def processo_do_json(payload: Any) -> tuple[Optional[str], Optional[str]]:
+    """Retorna (numero_processo, polo) a partir do payload do cabeçalho do processo."""
+    mapa = CAPTURA_XHR['endpoints']['processo']
+    if payload is None:
+        return None, None
+    numero_processo = _valor(payload, mapa.get('numero_processo'))
+    polo = _valor(payload, mapa.get('polo'))
+    return (str(numero_processo).strip() if numero_processo else None), (str(polo).strip() if polo else None)
+
+def andamentos_do_json(payload: Any) -> Optional[List[Dict[str, Any]]]:
+    """
+    Converte o payload de andamentos em linhas {data, descricao, detalhes, tem_publicacao}.
+    Retorna None se os caminhos não estiverem configurados ou o formato não for o esperado, para que o chamador use o DOM.
+    """
+    mapa = CAPTURA_XHR['endpoints']['andamentos']
+    if not (mapa.get('data') and mapa.get('descricao')):
+        return None
+    itens = _valor(payload, mapa.get('lista')) if mapa.get('lista') else payload
+    if not isinstance(itens, list):
+        return None
+    linhas = []
+    for item in itens:
+        descricao = str(_valor(item, mapa.get('descricao')) or '').strip()
+        detalhes = _valor(item, mapa.get('detalhes'))
+        linhas.append({
+            "data": _normalizar_data(_valor(item, mapa.get('data'))),
+            "descricao": descricao,
+            "detalhes": str(detalhes).strip() if detalhes else None,
+            "tem_publicacao": "PUBLICACAO DJ/DO" in descricao.upper(),
+        })
+    return linhas
+
+def documentos_do_json(payload: Any) -> Optional[List[Dict[str, Any]]]:
+    """Converte o payload de documentos em linhas {data, nome}; None se não configurado ou fora do formato esperado."""
+    mapa = CAPTURA_XHR['endpoints']['documentos']
+    if not (mapa.get('data') and mapa.get('nome')):
+        return None
+    itens = _valor(payload, mapa.get('lista')) if mapa.get('lista') else payload
+    if not isinstance(itens, list):
+        return None
+    return [
+        {"data": _normalizar_data(_valor(item, mapa.get('data'))), "nome": str(_valor(item, mapa.get('nome')) or '').strip()}
+        for item in itens
+    ]
@@ -0,0 +1,45 @@
+import os
+import sqlite3
+import logging
+import threading
+
+# --- Configuração ---
+DATABASE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), 'rpa_refatorado.db'))
+BUSY_TIMEOUT_MS = 30000     # Tempo que uma escrita aguarda o lock antes de falhar
+CACHE_SIZE_KIB = 20000      # Cache de páginas por conexão (~20 MB)
+
+_local = threading.local()
+
+def _configurar_conexao(conn: sqlite3.Connection):
+    """Aplica os PRAGMAs de desempenho e concorrência a uma conexão recém-aberta."""
+    conn.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
+    # WAL permite que o painel leia enquanto a RPA escreve; a configuração é persistida no arquivo.
+    conn.execute("PRAGMA journal_mode = WAL")
+    # Em WAL, NORMAL só sincroniza no checkpoint: seguro contra corrupção e sem fsync por commit.
+    conn.execute("PRAGMA synchronous = NORMAL")
+    conn.execute(f"PRAGMA cache_size = -{CACHE_SIZE_KIB}")
+    conn.execute("PRAGMA temp_store = MEMORY")
+
+def obter_conexao() -> sqlite3.Connection:
+    """
+    Retorna a conexão da thread atual, abrindo-a na primeira chamada.
+    A conexão é reutilizada por todas as funções do módulo 'database' executadas na mesma thread.
+    """
+    conn = getattr(_local, 'conn', None)
+    if conn is None:
+        conn = sqlite3.connect(DATABASE_PATH, timeout=BUSY_TIMEOUT_MS / 1000)
+        conn.row_factory = sqlite3.Row
+        _configurar_conexao(conn)
+        _local.conn = conn
+        logging.debug(f"Nova conexão SQLite aberta para a thread '{threading.current_thread().name}'.")
+    return conn
+
+def fechar_conexao():
+    """Fecha a conexão da thread atual, se houver uma aberta."""
+    conn = getattr(_local, 'conn', None)
+    if conn is not None:
+        try:
+            conn.close()
+        except sqlite3.Error as e:
+            logging.warning(f"Erro ao fechar a conexão com o banco de dados: {e}")
+        _local.conn = None
@@ -4,10 +4,80 @@ import logging
 TAMANHO_LOTE = 50
 # NOVO: Limite de tempo em segundos para cada ciclo de extração na FASE 2. (25 minutos)
 TEMPO_LIMITE_EXTRACAO = 25 * 60 
+# Quantidade de abas que processam, em paralelo, as tarefas de um lote na FASE 3 (1 = sequencial; aumente aos poucos, ex.: 4).
+PAGINAS_PARALELAS = 1
+
+# --- DOWNLOADS DIRETOS DE DOCUMENTOS NA FASE 3 ---
+# Documentos com URL própria são baixados pela API HTTP do Playwright (com os cookies da sessão),
+# em paralelo e fora da aba, em vez de clique + expect_download.
+DOWNLOADS_DIRETOS = False
+DOWNLOADS_PARALELOS = 3
+DOWNLOAD_TENTATIVAS = 3
+DOWNLOAD_TIMEOUT_MS = 60000
+
+# --- CIÊNCIA NA FASE 2 ---
+# Marca as caixas "dar ciência" de todas as linhas capturadas de uma página em uma única operação na
+# página (False = uma chamada .check() por linha). Nos dois modos a contagem é conferida antes de confirmar.
+MARCAR_CIENCIA_EM_LOTE = True
+# Planejamento dos ciclos: os tipos são ordenados pelo tempo previsto (contagem pendente x segundos por
+# linha medidos nas últimas execuções); tipos que não cabem no tempo restante do ciclo ficam para o próximo.
+SEGUNDOS_POR_LINHA_PADRAO = 2.0 # usado enquanto não há histórico para o tipo
+HISTORICO_VAZAO_EXECUCOES = 10
+# Extrai cada tipo de TAREFAS_CONFIG em uma aba própria, em paralelo. Se o portal não aceitar
+# confirmações de ciência simultâneas do mesmo usuário, mantenha 'ciencia_concorrente' em False:
+# as leituras continuam em paralelo e as confirmações são feitas uma de cada vez.
+EXTRACAO_PARALELA = {
+    "ativa": False,
+    "ciencia_concorrente": False,
+}
+
+# --- ORÇAMENTO DE TEMPO POR ETAPA NA FASE 3 (ms) ---
+# Tempo esperado de cada etapa do detalhamento de um NPJ. As esperas aguardam seletores/eventos
+# (não pausas fixas); etapas que passam do orçamento são registradas no log e resumidas ao fim do lote.
+# 'expandir_secao' e 'loader' também limitam a espera: ao estourar, a execução segue sem aguardar mais.
+ORCAMENTO_ETAPAS_MS = {
+    "navegacao": 8000,
+    "expandir_secao": 2000,
+    "andamentos": 10000,
+    "modal_publicacao": 3000,
+    "documentos": 15000,
+    "loader": 3000,
+}
+
+# --- BLOQUEIO DE RECURSOS NÃO ESSENCIAIS ---
+# Política instalada via context.route no login e nos contextos da FASE 3. Domínios em
+# 'dominios_permitidos' nunca são bloqueados; se 'tipos_permitidos' for preenchida, só esses tipos
+# passam (allowlist) e 'tipos_bloqueados' é ignorada. Com 'medir', nada é bloqueado e o log mostra,
+# por navegação, os bytes e o tempo de rede que a política economizaria. Desativada por padrão: os botões
+# da FASE 2 (btConfirmar.gif/btVoltar.gif) são imagens; valide com 'medir' antes de bloquear 'image'.
+BLOQUEIO_RECURSOS = {
+    "ativo": False,
+    "medir": False,
+    "tipos_bloqueados": ["image", "font", "media"],
+    "tipos_permitidos": [],
+    "dominios_bloqueados": ["google-analytics.com", "googletagmanager.com", "doubleclick.net", "hotjar.com"],
+    "dominios_permitidos": [],
+}
+
+# --- CAPTURA DE XHR NA FASE 3 ---
+# Lê número do processo, polo, andamentos e documentos das respostas JSON da página de consulta
+# em vez de raspar o DOM. 'url_contem' identifica cada chamada; os demais campos são caminhos
+# pontuados dentro do JSON. Todos vêm vazios e devem ser preenchidos a partir das respostas reais
+# do portal (ative 'registrar_urls' para listar no log as chamadas feitas pela página); endpoints
+# sem 'url_contem' ou sem os caminhos obrigatórios continuam sendo lidos pelo DOM.
+CAPTURA_XHR = {
+    "ativa": False,
+    "registrar_urls": False,
+    "endpoints": {
+        "processo": {"url_contem": "", "numero_processo": "", "polo": ""},
+        "andamentos": {"url_contem": "", "lista": "", "data": "", "descricao": "", "detalhes": ""},
+        "documentos": {"url_contem": "", "lista": "", "data": "", "nome": ""},
+    },
+}
 
 # --- CONFIGURAÇÕES DE LOG ---
 LOG_LEVEL = logging.INFO
-LOG_FORMAT = '%(asctime)s [%(levelname)s] - %(message)s'
+LOG_FORMAT = '%(asctime)s [%(levelname)s] [%(threadName)s] - %(message)s'
 
 # --- CONFIGURAÇÕES DE TAREFAS ---
 TAREFAS_CONFIG = [
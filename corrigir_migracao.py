@@ -10,6 +10,30 @@ logging.basicConfig(level=logging.INFO, format='%(asctime)s - %(levelname)s - %(
 # --- Configuração do Banco de Dados ---
 DATABASE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), 'rpa_refatorado.db'))
 
+def _corrigir_tarefa_vinculada(cursor, notificacao_id, tarefa_id, novo_npj, nova_data):
+    """Aplica a correção à tarefa da notificação; se a tarefa correta já existir, move o vínculo para ela."""
+    if tarefa_id is None:
+        return
+    try:
+        cursor.execute(
+            "UPDATE tarefas SET NPJ = ?, data_notificacao = ?, status = 'Pendente' WHERE id = ?",
+            (novo_npj, nova_data, tarefa_id)
+        )
+    except sqlite3.IntegrityError:
+        cursor.execute(
+            "UPDATE notificacoes SET tarefa_id = (SELECT id FROM tarefas WHERE NPJ = ? AND data_notificacao = ?) WHERE id = ?",
+            (novo_npj, nova_data, notificacao_id)
+        )
+        _remover_tarefa_orfa(cursor, tarefa_id)
+
+def _remover_tarefa_orfa(cursor, tarefa_id):
+    """Apaga a tarefa invertida quando nenhuma notificação aponta mais para ela."""
+    if tarefa_id is not None:
+        cursor.execute(
+            "DELETE FROM tarefas WHERE id = ? AND NOT EXISTS (SELECT 1 FROM notificacoes WHERE tarefa_id = ?)",
+            (tarefa_id, tarefa_id)
+        )
+
 def corrigir_dados_migrados_invertidos():
     """
     Identifica notificações da origem 'migracao' onde os campos NPJ e data_notificacao
@@ -29,7 +53,7 @@ def corrigir_dados_migrados_invertidos():
 
         logging.info("Buscando por notificações de migração com possíveis dados invertidos...")
         
-        cursor.execute("SELECT id, NPJ, data_notificacao FROM notificacoes WHERE origem = 'migracao'")
+        cursor.execute("SELECT id, NPJ, data_notificacao, tarefa_id FROM notificacoes WHERE origem = 'migracao'")
         notificacoes_migradas = cursor.fetchall()
 
         if not notificacoes_migradas:
@@ -38,7 +62,7 @@ def corrigir_dados_migrados_invertidos():
 
         logging.info(f"Verificando {len(notificacoes_migradas)} registros de migração...")
 
-        for notificacao_id, npj, data_notificacao in tqdm(notificacoes_migradas, desc="Corrigindo migração"):
+        for notificacao_id, npj, data_notificacao, tarefa_id in tqdm(notificacoes_migradas, desc="Corrigindo migração"):
             # Verifica se o campo NPJ parece uma data E o campo data_notificacao parece um NPJ
             if npj and data_notificacao and regex_data.match(npj) and regex_npj.match(data_notificacao):
                 
@@ -51,12 +75,14 @@ def corrigir_dados_migrados_invertidos():
                         "UPDATE notificacoes SET NPJ = ?, data_notificacao = ?, status = 'Pendente' WHERE id = ?",
                         (novo_npj, nova_data, notificacao_id)
                     )
+                    _corrigir_tarefa_vinculada(cursor, notificacao_id, tarefa_id, novo_npj, nova_data)
                     corrigidos += 1
                 except sqlite3.IntegrityError:
                     # Se der erro de duplicidade, é porque o registro correto já existe. Então, apaga o errado.
                     logging.warning(f"\n  - Duplicata encontrada ao tentar corrigir ID {notificacao_id}. NPJ='{novo_npj}', Data='{nova_data}'.")
                     logging.info(f"    - Apagando o registro invertido (ID: {notificacao_id})...")
                     cursor.execute("DELETE FROM notificacoes WHERE id = ?", (notificacao_id,))
+                    _remover_tarefa_orfa(cursor, tarefa_id)
                     apagados += 1
 
         if corrigidos > 0 or apagados > 0:
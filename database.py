@@ -1,15 +1,262 @@
+import hashlib
 import os
+import socket
 import sqlite3
 import json
+import zlib
 import logging
 from typing import List, Dict, Optional
 from datetime import datetime, timedelta
+from conexao import DATABASE_PATH, obter_conexao
 
 # --- Configuração ---
-DATABASE_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), 'rpa_refatorado.db'))
 MAX_TENTATIVAS_PORTAL = 3 # Define o limite de tentativas para erros de portal
+BACKOFF_BASE_MINUTOS = 5 # Espera antes da 1ª nova tentativa de um erro de portal; dobra a cada falha
+BACKOFF_MAXIMO_MINUTOS = 240 # Teto da espera entre tentativas
+DURACAO_LEASE_MINUTOS = 15 # Tempo que uma tarefa reivindicada fica reservada ao worker sem renovação
+WORKER_ID = f"{socket.gethostname()}-{os.getpid()}" # Identifica este processo da RPA nas reservas
+LIMITE_COMPRESSAO_BYTES = 1024 # Textos de 'detalhes' de andamentos acima deste tamanho são gravados com zlib
+
+# Tarefa disponível: pendente, com erro de portal cuja nova tentativa já venceu,
+# ou reservada por um worker cuja reserva expirou (ex: processo interrompido).
+_SQL_DISPONIVEL = """(status = 'Pendente'
+    OR (status = 'Erro_Portal' AND proxima_tentativa_em <= :agora)
+    OR (status = 'Em Processamento' AND (lease_expira_em IS NULL OR lease_expira_em < :agora)))"""
+
+# Pools de atribuição (round-robin) e os perfis de usuário que compõem cada um.
+POOLS_ATRIBUICAO = {
+    'Geral': ('Geral',),
+    'Polo Ativo': ('Geral', 'Polo Ativo'),
+}
+
+# Cache do cadastro de usuários: (versão, {pool: [nomes]}), recarregado quando 'versao_cadastros' muda.
+_cache_usuarios: tuple[Optional[int], Dict[str, List[str]]] = (None, {})
+
+def _agora_iso(delta: timedelta = timedelta()) -> str:
+    return (datetime.now() + delta).strftime('%Y-%m-%d %H:%M:%S')
+
+# Converte 'dd/mm/YYYY[ HH:MM:SS]' em 'YYYY-mm-dd[ HH:MM:SS]'; valores já em ISO são mantidos.
+_SQL_DATA_BR_PARA_ISO = """CASE
+    WHEN {col} GLOB '[0-9][0-9]/[0-9][0-9]/[0-9][0-9][0-9][0-9]*'
+        THEN substr({col}, 7, 4) || '-' || substr({col}, 4, 2) || '-' || substr({col}, 1, 2) || substr({col}, 11)
+    WHEN {col} GLOB '[0-9][0-9][0-9][0-9]-[0-9][0-9]-[0-9][0-9]*' THEN {col}
+END"""
+
+def _sql_iso(col: str, somente_data: bool = False) -> str:
+    expr = _SQL_DATA_BR_PARA_ISO.format(col=col)
+    return f"substr({expr}, 1, 10)" if somente_data else expr
 
 # --- Funções Auxiliares de Migração ---
+def _executar_migracoes_datas_iso(cursor, tabela: str):
+    """Cria as colunas de data em ISO-8601 (ordenáveis), preenche-as uma única vez e as mantém por triggers."""
+    cursor.execute(f"PRAGMA table_info({tabela})")
+    colunas = [desc[1] for desc in cursor.fetchall()]
+    if 'data_notificacao_iso' not in colunas:
+        logging.info(f"Aplicando migração: Adicionando colunas de data em formato ISO à tabela '{tabela}' e preenchendo-as...")
+        cursor.execute(f"ALTER TABLE {tabela} ADD COLUMN data_notificacao_iso TEXT")
+        cursor.execute(f"ALTER TABLE {tabela} ADD COLUMN data_processamento_iso TEXT")
+        cursor.execute(f"""
+            UPDATE {tabela} SET
+                data_notificacao_iso = {_sql_iso('data_notificacao', somente_data=True)},
+                data_processamento_iso = {_sql_iso('data_processamento')}
+        """)
+        logging.info(f"{cursor.rowcount} registro(s) de '{tabela}' convertido(s) para datas ISO.")
+
+    # Os triggers cobrem todos os escritores (RPA, painel e scripts avulsos) sem duplicar a conversão.
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{tabela}_datas_iso_insert AFTER INSERT ON {tabela}
+        BEGIN
+            UPDATE {tabela} SET
+                data_notificacao_iso = {_sql_iso('NEW.data_notificacao', somente_data=True)},
+                data_processamento_iso = {_sql_iso('NEW.data_processamento')}
+            WHERE id = NEW.id;
+        END
+    """)
+    cursor.execute(f"""
+        CREATE TRIGGER IF NOT EXISTS trg_{tabela}_datas_iso_update
+        AFTER UPDATE OF data_notificacao, data_processamento ON {tabela}
+        BEGIN
+            UPDATE {tabela} SET
+                data_notificacao_iso = {_sql_iso('NEW.data_notificacao', somente_data=True)},
+                data_processamento_iso = {_sql_iso('NEW.data_processamento')}
+            WHERE id = NEW.id;
+        END
+    """)
+
+def _executar_migracao_tarefas(cursor):
+    """
+    Vincula cada notificação à sua tarefa (NPJ + data). As tarefas são criadas a partir das
+    notificações ainda sem vínculo e, dali em diante, por trigger a cada nova notificação.
+    """
+    cursor.execute("SELECT 1 FROM notificacoes WHERE tarefa_id IS NULL LIMIT 1")
+    if cursor.fetchone():
+        logging.info("Aplicando migração: Criando tarefas a partir das notificações existentes...")
+        # O estado de cada grupo vem da notificação mais recente; reservas antigas não são copiadas.
+        cursor.execute("""
+            INSERT OR IGNORE INTO tarefas (
+                NPJ, data_notificacao, origem, status, adverso_principal, numero_processo, polo, responsavel,
+                andamentos, documentos, data_processamento, detalhes_erro, tentativas, gerou_tarefa
+            )
+            SELECT
+                n.NPJ, n.data_notificacao, COALESCE(MAX(n.origem), 'onenotify'),
+                (SELECT r.status FROM notificacoes r
+                 WHERE r.NPJ = n.NPJ AND r.data_notificacao = n.data_notificacao ORDER BY r.id DESC LIMIT 1),
+                MAX(n.adverso_principal), MAX(n.numero_processo), MAX(n.polo), MAX(n.responsavel),
+                MAX(n.andamentos), MAX(n.documentos),
+                (SELECT r.data_processamento FROM notificacoes r
+                 WHERE r.NPJ = n.NPJ AND r.data_notificacao = n.data_notificacao
+                 ORDER BY r.data_processamento_iso DESC LIMIT 1),
+                MAX(n.detalhes_erro), COALESCE(MAX(n.tentativas), 0), COALESCE(MAX(n.gerou_tarefa), 0)
+            FROM notificacoes n
+            WHERE n.tarefa_id IS NULL
+            GROUP BY n.NPJ, n.data_notificacao
+        """)
+        logging.info(f"{cursor.rowcount} tarefa(s) criada(s).")
+        cursor.execute("""
+            UPDATE notificacoes SET tarefa_id = (
+                SELECT t.id FROM tarefas t WHERE t.NPJ = notificacoes.NPJ AND t.data_notificacao = notificacoes.data_notificacao
+            ) WHERE tarefa_id IS NULL
+        """)
+
+    # Nova notificação: cria a tarefa ou, se ela já foi concluída pela RPA, reabre-a para nova coleta.
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_notificacoes_tarefa AFTER INSERT ON notificacoes
+        BEGIN
+            INSERT INTO tarefas (NPJ, data_notificacao, origem, adverso_principal)
+            VALUES (NEW.NPJ, NEW.data_notificacao, COALESCE(NEW.origem, 'onenotify'), NEW.adverso_principal)
+            ON CONFLICT (NPJ, data_notificacao) DO UPDATE SET
+                origem = MAX(origem, excluded.origem),
+                adverso_principal = COALESCE(adverso_principal, excluded.adverso_principal),
+                status = CASE WHEN status IN ('Processado', 'Migrado') THEN 'Pendente' ELSE status END;
+            UPDATE notificacoes SET tarefa_id = (
+                SELECT id FROM tarefas WHERE NPJ = NEW.NPJ AND data_notificacao = NEW.data_notificacao
+            ) WHERE id = NEW.id;
+        END
+    """)
+    cursor.execute("PRAGMA table_info(tarefas)")
+    if 'proxima_tentativa_em' not in [desc[1] for desc in cursor.fetchall()]:
+        logging.info("Aplicando migração: Adicionando coluna 'proxima_tentativa_em' à tabela 'tarefas'...")
+        cursor.execute("ALTER TABLE tarefas ADD COLUMN proxima_tentativa_em TEXT")
+    # Erros de portal sem agendamento (anteriores ao backoff, ou vindos da migração de 'notificacoes') voltam
+    # à fila após a espera base. Roda sempre: a coluna já pode ter sido criada pelo CREATE TABLE.
+    cursor.execute("""
+        UPDATE tarefas SET proxima_tentativa_em = COALESCE(datetime(data_processamento_iso, ?), ?)
+        WHERE status = 'Erro_Portal' AND proxima_tentativa_em IS NULL
+    """, (f"+{BACKOFF_BASE_MINUTOS} minutes", _agora_iso()))
+    # Índice parcial: atende só a fila de novas tentativas e não concorre com os índices do painel nos filtros de status.
+    cursor.execute("DROP INDEX IF EXISTS idx_tarefas_status_proxima_tentativa")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tarefas_erro_proxima_tentativa ON tarefas (proxima_tentativa_em) WHERE status = 'Erro_Portal'")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_notificacoes_tarefa ON notificacoes (tarefa_id)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tarefas_status_data_iso ON tarefas (status, data_notificacao_iso)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tarefas_processamento_iso ON tarefas (data_processamento_iso)")
+    # Filtros do painel (/api/notificacoes): status + responsável/polo, já na ordem de exibição por data.
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tarefas_status_responsavel ON tarefas (status, responsavel, data_notificacao_iso)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_tarefas_status_polo ON tarefas (status, polo, data_notificacao_iso)")
+    # As consultas de fila e painel passaram para 'tarefas'; estes índices só custariam escrita.
+    cursor.execute("DROP INDEX IF EXISTS idx_notificacoes_status_data_iso")
+    cursor.execute("DROP INDEX IF EXISTS idx_notificacoes_processamento_iso")
+
+def _compactar_texto(texto: Optional[str]) -> tuple:
+    """Retorna (valor, comprimido): textos longos viram BLOB zlib, os curtos ficam como TEXT."""
+    if texto is None:
+        return None, 0
+    dados = texto.encode('utf-8')
+    if len(dados) < LIMITE_COMPRESSAO_BYTES:
+        return texto, 0
+    return zlib.compress(dados), 1
+
+def _gravar_detalhes_tarefa(conn, tarefa_id: int, andamentos: List[Dict], documentos: List[Dict]):
+    """Substitui os andamentos e documentos da tarefa. Deve rodar dentro da transação do chamador."""
+    conn.execute("DELETE FROM andamentos WHERE tarefa_id = ?", (tarefa_id,))
+    conn.execute("DELETE FROM documentos WHERE tarefa_id = ?", (tarefa_id,))
+    conn.executemany(
+        "INSERT INTO andamentos (tarefa_id, ordem, data, descricao, detalhes, comprimido) VALUES (?, ?, ?, ?, ?, ?)",
+        [(tarefa_id, ordem, a.get('data'), a.get('descricao'), *_compactar_texto(a.get('detalhes')))
+         for ordem, a in enumerate(andamentos or [])]
+    )
+    conn.executemany(
+        "INSERT INTO documentos (tarefa_id, ordem, nome, caminho) VALUES (?, ?, ?, ?)",
+        [(tarefa_id, ordem, d.get('nome'), d.get('caminho')) for ordem, d in enumerate(documentos or [])]
+    )
+
+def _executar_migracao_detalhes(cursor):
+    """Move o JSON de andamentos/documentos das colunas de 'tarefas' para as tabelas filhas e limpa as colunas antigas."""
+    cursor.execute("SELECT id, andamentos, documentos FROM tarefas WHERE andamentos IS NOT NULL OR documentos IS NOT NULL")
+    tarefas_com_json = cursor.fetchall()
+    if tarefas_com_json:
+        logging.info(f"Aplicando migração: Movendo andamentos e documentos de {len(tarefas_com_json)} tarefa(s) para tabelas próprias...")
+        for tarefa in tarefas_com_json:
+            try:
+                andamentos = json.loads(tarefa['andamentos'] or '[]')
+                documentos = json.loads(tarefa['documentos'] or '[]')
+            except json.JSONDecodeError as e:
+                logging.warning(f"JSON inválido na tarefa {tarefa['id']}; detalhes descartados. Erro: {e}")
+                andamentos, documentos = [], []
+            _gravar_detalhes_tarefa(cursor.connection, tarefa['id'], andamentos, documentos)
+        cursor.execute("UPDATE tarefas SET andamentos = NULL, documentos = NULL WHERE andamentos IS NOT NULL OR documentos IS NOT NULL")
+
+    # Cópias por notificação do modelo antigo; o conteúdo já foi levado para a tarefa na migração de 'tarefas'.
+    cursor.execute("UPDATE notificacoes SET andamentos = NULL, documentos = NULL WHERE andamentos IS NOT NULL OR documentos IS NOT NULL")
+    if cursor.rowcount > 0:
+        logging.info(f"{cursor.rowcount} notificação(ões) tiveram o JSON duplicado de detalhes removido. Execute VACUUM para devolver o espaço ao disco.")
+
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_andamentos_tarefa ON andamentos (tarefa_id, ordem)")
+    cursor.execute("CREATE INDEX IF NOT EXISTS idx_documentos_tarefa ON documentos (tarefa_id, ordem)")
+    cursor.execute("""
+        CREATE TRIGGER IF NOT EXISTS trg_tarefas_detalhes_delete AFTER DELETE ON tarefas
+        BEGIN
+            DELETE FROM andamentos WHERE tarefa_id = OLD.id;
+            DELETE FROM documentos WHERE tarefa_id = OLD.id;
+        END
+    """)
+
+def _executar_migracao_atribuicao(cursor):
+    """Cria o cursor persistente do round-robin e o contador de versão do cadastro de usuários."""
+    cursor.execute("SELECT 1 FROM atribuicao_estado LIMIT 1")
+    if not cursor.fetchone():
+        # Continua a rotação de onde o histórico parou, usando uma única vez a busca antiga por pool.
+        for pool, perfis in POOLS_ATRIBUICAO.items():
+            placeholders = ', '.join(['?'] * len(perfis))
+            cursor.execute(f"""
+                INSERT OR IGNORE INTO atribuicao_estado (pool, ultimo_usuario)
+                SELECT ?, responsavel FROM tarefas
+                WHERE responsavel IN (SELECT nome FROM usuarios WHERE perfil IN ({placeholders}))
+                ORDER BY data_processamento_iso DESC LIMIT 1
+            """, (pool, *perfis))
+
+    cursor.execute("INSERT OR IGNORE INTO versao_cadastros (nome, versao) VALUES ('usuarios', 0)")
+    # Qualquer escritor do cadastro (painel, CLI 'add-user') invalida o cache de usuários da RPA.
+    for evento in ('INSERT', 'UPDATE', 'DELETE'):
+        cursor.execute(f"""
+            CREATE TRIGGER IF NOT EXISTS trg_usuarios_versao_{evento.lower()} AFTER {evento} ON usuarios
+            BEGIN
+                UPDATE versao_cadastros SET versao = versao + 1 WHERE nome = 'usuarios';
+            END
+        """)
+
+# 'ordem' distingue publicações idênticas (mesma data e descrição) do mesmo NPJ: é a posição delas no dia.
+_SQL_TABELA_CACHE_ANDAMENTOS = """
+    CREATE TABLE IF NOT EXISTS cache_andamentos (
+        NPJ TEXT NOT NULL, data TEXT NOT NULL, hash_descricao TEXT NOT NULL, ordem INTEGER NOT NULL DEFAULT 0,
+        descricao TEXT, detalhes BLOB, comprimido INTEGER NOT NULL DEFAULT 0, data_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        PRIMARY KEY (NPJ, data, hash_descricao, ordem)
+    )
+"""
+
+def _executar_migracao_cache_andamentos(cursor):
+    """Recria 'cache_andamentos' com a coluna 'ordem' na chave primária, preservando as entradas já gravadas."""
+    cursor.execute("PRAGMA table_info(cache_andamentos)")
+    if 'ordem' in [desc[1] for desc in cursor.fetchall()]:
+        return
+    logging.info("Aplicando migração: Adicionando 'ordem' à chave da tabela 'cache_andamentos'...")
+    cursor.execute("ALTER TABLE cache_andamentos RENAME TO cache_andamentos_antigo")
+    cursor.execute(_SQL_TABELA_CACHE_ANDAMENTOS)
+    cursor.execute("""
+        INSERT INTO cache_andamentos (NPJ, data, hash_descricao, ordem, descricao, detalhes, comprimido, data_registro)
+        SELECT NPJ, data, hash_descricao, 0, descricao, detalhes, comprimido, data_registro FROM cache_andamentos_antigo
+    """)
+    cursor.execute("DROP TABLE cache_andamentos_antigo")
+
 def _executar_migracoes(conn):
     """Aplica migrações de schema no banco de dados de forma segura."""
     cursor = conn.cursor()
@@ -24,7 +271,8 @@ def _executar_migracoes(conn):
         'origem': 'TEXT DEFAULT "onenotify"',
         'gerou_tarefa': 'INTEGER DEFAULT 0',
         'tentativas': 'INTEGER DEFAULT 0',
-        'polo': 'TEXT'
+        'polo': 'TEXT',
+        'tarefa_id': 'INTEGER REFERENCES tarefas(id)'
     }
     for col, tipo in colunas_para_adicionar_notif.items():
         if col not in tabela_notificacoes_cols:
@@ -38,13 +286,45 @@ def _executar_migracoes(conn):
         logging.info("Aplicando migração: Adicionando coluna 'perfil' à tabela 'usuarios'...")
         cursor.execute("ALTER TABLE usuarios ADD COLUMN perfil TEXT DEFAULT 'Geral'")
 
+    # Índice único que dá efeito ao 'INSERT OR IGNORE' da ingestão
+    cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'index' AND name = 'idx_notificacoes_unica'")
+    if not cursor.fetchone():
+        logging.info("Aplicando migração: Removendo notificações duplicadas antes de criar o índice único...")
+        # Mantém uma linha por (NPJ, tipo, data), priorizando a que já saiu de 'Pendente' (e carrega os detalhes).
+        cursor.execute("""
+            DELETE FROM notificacoes WHERE id IN (
+                SELECT id FROM (
+                    SELECT id, ROW_NUMBER() OVER (
+                        PARTITION BY NPJ, tipo_notificacao, data_notificacao
+                        ORDER BY status = 'Pendente', id
+                    ) AS ordem
+                    FROM notificacoes
+                ) WHERE ordem > 1
+            )
+        """)
+        logging.info(f"{cursor.rowcount} notificação(ões) duplicada(s) removida(s).")
+        cursor.execute("CREATE UNIQUE INDEX idx_notificacoes_unica ON notificacoes (NPJ, tipo_notificacao, data_notificacao)")
+
+    _executar_migracoes_datas_iso(cursor, 'notificacoes')
+    _executar_migracoes_datas_iso(cursor, 'tarefas')
+    _executar_migracao_tarefas(cursor)
+    _executar_migracao_detalhes(cursor)
+    _executar_migracao_atribuicao(cursor)
+    _executar_migracao_cache_andamentos(cursor)
+
+    # Migração para a tabela 'checkpoint_extracao'
+    cursor.execute("PRAGMA table_info(checkpoint_extracao)")
+    if 'ciencia_confirmada' not in [desc[1] for desc in cursor.fetchall()]:
+        logging.info("Aplicando migração: Adicionando coluna 'ciencia_confirmada' à tabela 'checkpoint_extracao'...")
+        cursor.execute("ALTER TABLE checkpoint_extracao ADD COLUMN ciencia_confirmada INTEGER NOT NULL DEFAULT 0")
+
     conn.commit()
 
 # --- Funções Principais do Banco de Dados ---
 def inicializar_banco():
     """Garante que o banco de dados e as tabelas necessárias existam e estejam atualizados."""
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
+        with obter_conexao() as conn:
             conn.execute("""
             CREATE TABLE IF NOT EXISTS notificacoes (
                 id INTEGER PRIMARY KEY AUTOINCREMENT, NPJ TEXT NOT NULL, tipo_notificacao TEXT NOT NULL,
@@ -54,6 +334,17 @@ def inicializar_banco():
             )
             """)
             conn.execute("""
+            CREATE TABLE IF NOT EXISTS tarefas (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, NPJ TEXT NOT NULL, data_notificacao TEXT NOT NULL,
+                data_notificacao_iso TEXT, origem TEXT DEFAULT 'onenotify', status TEXT NOT NULL DEFAULT 'Pendente',
+                adverso_principal TEXT, numero_processo TEXT, polo TEXT, responsavel TEXT, andamentos TEXT,
+                documentos TEXT, data_processamento TEXT, data_processamento_iso TEXT, detalhes_erro TEXT,
+                tentativas INTEGER DEFAULT 0, gerou_tarefa INTEGER DEFAULT 0, worker_id TEXT, lease_expira_em TEXT,
+                proxima_tentativa_em TEXT, data_criacao TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (NPJ, data_notificacao)
+            )
+            """)
+            conn.execute("""
             CREATE TABLE IF NOT EXISTS logs_execucao (
                 id INTEGER PRIMARY KEY AUTOINCREMENT, timestamp TEXT, duracao_total REAL, 
                 notificacoes_salvas INTEGER, ciencias_registradas INTEGER, andamentos INTEGER, 
@@ -66,6 +357,63 @@ def inicializar_banco():
                     nome TEXT NOT NULL UNIQUE
                 )
             """)
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS andamentos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, tarefa_id INTEGER NOT NULL REFERENCES tarefas(id),
+                ordem INTEGER NOT NULL, data TEXT, descricao TEXT, detalhes BLOB, comprimido INTEGER NOT NULL DEFAULT 0
+            )
+            """)
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS documentos (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, tarefa_id INTEGER NOT NULL REFERENCES tarefas(id),
+                ordem INTEGER NOT NULL, nome TEXT, caminho TEXT
+            )
+            """)
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS downloads (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, NPJ TEXT NOT NULL, data_notificacao TEXT, nome TEXT, url TEXT,
+                caminho TEXT, status TEXT NOT NULL, status_http INTEGER, tamanho_bytes INTEGER, duracao_ms INTEGER,
+                tentativas INTEGER, erro TEXT, data_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """)
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS blobs (
+                hash TEXT PRIMARY KEY, tamanho_bytes INTEGER, data_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """)
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS documentos_armazenados (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, NPJ TEXT NOT NULL, nome TEXT NOT NULL, data_documento TEXT NOT NULL,
+                hash TEXT NOT NULL REFERENCES blobs(hash), caminho TEXT NOT NULL, data_registro TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+                UNIQUE (NPJ, nome, data_documento)
+            )
+            """)
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS checkpoint_extracao (
+                tipo_notificacao TEXT PRIMARY KEY, pagina INTEGER NOT NULL DEFAULT 0, npjs_capturados INTEGER NOT NULL DEFAULT 0,
+                ultimo_npj TEXT, npjs_ultima_pagina TEXT, status TEXT NOT NULL, iniciado_em TEXT, atualizado_em TEXT,
+                ciencia_confirmada INTEGER NOT NULL DEFAULT 0
+            )
+            """)
+            conn.execute("""
+            CREATE TABLE IF NOT EXISTS vazao_extracao (
+                id INTEGER PRIMARY KEY AUTOINCREMENT, tipo_notificacao TEXT NOT NULL, linhas INTEGER NOT NULL,
+                segundos REAL NOT NULL, registrado_em TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+            )
+            """)
+            conn.execute(_SQL_TABELA_CACHE_ANDAMENTOS)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS atribuicao_estado (
+                    pool TEXT PRIMARY KEY,
+                    ultimo_usuario TEXT
+                )
+            """)
+            conn.execute("""
+                CREATE TABLE IF NOT EXISTS versao_cadastros (
+                    nome TEXT PRIMARY KEY,
+                    versao INTEGER NOT NULL DEFAULT 0
+                )
+            """)
             _executar_migracoes(conn)
             logging.info(f"Banco de dados '{DATABASE_PATH}' verificado e atualizado com sucesso.")
     except sqlite3.Error as e:
@@ -73,211 +421,433 @@ def inicializar_banco():
         raise
 
 def resetar_notificacoes_em_processamento():
-    """Reseta o status de notificações que foram interrompidas durante o processamento."""
+    """Devolve à fila as tarefas cuja reserva expirou (worker interrompido), preservando as reservas ativas de outros workers."""
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
-            cursor = conn.cursor()
-            cursor.execute("UPDATE notificacoes SET status = 'Pendente' WHERE status = 'Em Processamento'")
+        with obter_conexao() as conn:
+            cursor = conn.execute("""
+                UPDATE tarefas SET status = 'Pendente', worker_id = NULL, lease_expira_em = NULL
+                WHERE status = 'Em Processamento' AND (lease_expira_em IS NULL OR lease_expira_em < :agora)
+            """, {"agora": _agora_iso()})
             if cursor.rowcount > 0:
-                logging.info(f"{cursor.rowcount} notificações 'Em Processamento' foram resetadas para 'Pendente'.")
+                logging.info(f"{cursor.rowcount} tarefa(s) 'Em Processamento' com reserva expirada foram resetadas para 'Pendente'.")
     except sqlite3.Error as e:
-        logging.error(f"ERRO ao resetar status de notificações: {e}", exc_info=True)
+        logging.error(f"ERRO ao resetar status de tarefas: {e}", exc_info=True)
 
-def resetar_erros_de_portal_antigos():
-    """Verifica notificações com 'Erro_Portal' e as libera para nova tentativa se tiverem mais de 24 horas."""
-    try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute("SELECT id, data_processamento FROM notificacoes WHERE status = 'Erro_Portal'")
-            tarefas_com_erro = cursor.fetchall()
+def _inserir_notificacoes(conn, lista_notificacoes: list[dict]) -> int:
+    """Insere as notificações na transação do chamador, ignorando duplicatas. Retorna quantas eram novas."""
+    lotes_por_colunas: dict[tuple, list] = {}
+    for n in lista_notificacoes:
+        if not n.get('data_notificacao'):
+            logging.warning(f"Notificação para o NPJ {n.get('NPJ')} ignorada por não ter data.")
+            continue
+        lotes_por_colunas.setdefault(tuple(n.keys()), []).append(tuple(n.values()))
 
-            if not tarefas_com_erro:
-                return
+    salvas = 0
+    for cols, valores in lotes_por_colunas.items():
+        placeholders = ', '.join(['?'] * len(cols))
+        query = f"INSERT OR IGNORE INTO notificacoes ({', '.join(cols)}) VALUES ({placeholders})"
+        # rowcount soma apenas as inserções diretas; as escritas feitas pelos triggers não entram.
+        salvas += conn.executemany(query, valores).rowcount
+    return salvas
 
-            logging.info(f"Verificando {len(tarefas_com_erro)} tarefa(s) com 'Erro_Portal' para possível reprocessamento...")
-            limite_tempo = datetime.now() - timedelta(hours=24)
-            ids_para_resetar = []
+def salvar_notificacoes(lista_notificacoes: list[dict]) -> int:
+    """Salva uma lista de notificações no banco em uma única transação, ignorando duplicatas."""
+    try:
+        with obter_conexao() as conn:
+            return _inserir_notificacoes(conn, lista_notificacoes)
+    except sqlite3.Error as e:
+        logging.error(f"ERRO ao salvar lote de {len(lista_notificacoes)} notificações: {e}", exc_info=True)
+        return 0
 
-            for tarefa in tarefas_com_erro:
-                try:
-                    data_proc = datetime.strptime(tarefa['data_processamento'], '%d/%m/%Y %H:%M:%S')
-                    if data_proc < limite_tempo:
-                        ids_para_resetar.append((tarefa['id'],))
-                except (ValueError, TypeError):
-                    ids_para_resetar.append((tarefa['id'],))
+# --- Checkpoint da extração (FASE 2) ---
+# Cada página da tabela de notificações é gravada assim que lida, na mesma transação que avança o
+# checkpoint do tipo de tarefa: uma queda no meio da paginação perde no máximo a página em curso.
 
-            if ids_para_resetar:
-                cursor.executemany("UPDATE notificacoes SET status = 'Pendente' WHERE id = ?", ids_para_resetar)
-                conn.commit()
-                logging.info(f"{len(ids_para_resetar)} tarefa(s) com erro de portal foram liberadas para nova tentativa.")
+def buscar_checkpoint_extracao(tipo_notificacao: str) -> Optional[Dict]:
+    """Retorna o checkpoint da última paginação do tipo de tarefa, se houver."""
+    try:
+        with obter_conexao() as conn:
+            linha = conn.execute("SELECT * FROM checkpoint_extracao WHERE tipo_notificacao = ?", (tipo_notificacao,)).fetchone()
+            return dict(linha) if linha else None
+    except sqlite3.Error as e:
+        logging.error(f"ERRO ao consultar o checkpoint da extração de '{tipo_notificacao}': {e}")
+        return None
 
+def iniciar_checkpoint_extracao(tipo_notificacao: str, retomar: bool = False):
+    """Marca o início da paginação de um tipo de tarefa. Com 'retomar', mantém a página e os contadores anteriores."""
+    agora = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    try:
+        with obter_conexao() as conn:
+            if retomar:
+                conn.execute(
+                    "UPDATE checkpoint_extracao SET status = 'Em Andamento', atualizado_em = ? WHERE tipo_notificacao = ?",
+                    (agora, tipo_notificacao)
+                )
+                return
+            conn.execute("""
+                INSERT INTO checkpoint_extracao (tipo_notificacao, pagina, npjs_capturados, ultimo_npj, npjs_ultima_pagina, status, iniciado_em, atualizado_em)
+                VALUES (?, 0, 0, NULL, NULL, 'Em Andamento', ?, ?)
+                ON CONFLICT (tipo_notificacao) DO UPDATE SET
+                    pagina = 0, npjs_capturados = 0, ultimo_npj = NULL, npjs_ultima_pagina = NULL, ciencia_confirmada = 0,
+                    status = 'Em Andamento', iniciado_em = excluded.iniciado_em, atualizado_em = excluded.atualizado_em
+            """, (tipo_notificacao, agora, agora))
     except sqlite3.Error as e:
-        logging.error(f"ERRO ao reprocessar erros de portal antigos: {e}", exc_info=True)
+        logging.error(f"ERRO ao iniciar o checkpoint da extração de '{tipo_notificacao}': {e}")
 
-def salvar_notificacoes(lista_notificacoes: list[dict]) -> int:
-    """Salva uma lista de notificações no banco, ignorando duplicatas."""
-    salvas = 0
-    for n in lista_notificacoes:
-        if not n.get('data_notificacao'):
-            logging.warning(f"Notificação para o NPJ {n.get('NPJ')} ignorada por não ter data.")
-            continue
-        try:
-            with sqlite3.connect(DATABASE_PATH) as conn:
-                cursor = conn.cursor()
-                cols = ', '.join(n.keys())
-                placeholders = ', '.join(['?'] * len(n))
-                query = f"INSERT OR IGNORE INTO notificacoes ({cols}) VALUES ({placeholders})"
-                cursor.execute(query, list(n.values()))
-                if cursor.rowcount > 0:
-                    salvas += 1
-        except sqlite3.Error as e:
-            logging.error(f"ERRO ao salvar notificação para o NPJ {n.get('NPJ')}: {e}")
-    return salvas
+def salvar_pagina_extracao(tipo_notificacao: str, pagina: int, notificacoes: list[dict]) -> Optional[int]:
+    """
+    Grava as notificações de uma página e avança o checkpoint na mesma transação. Retorna quantas eram novas,
+    ou None se a gravação falhou (nada é gravado e o checkpoint fica na última página salva).
+    """
+    npjs = [n['NPJ'] for n in notificacoes]
+    try:
+        with obter_conexao() as conn:
+            salvas = _inserir_notificacoes(conn, notificacoes)
+            conn.execute("""
+                UPDATE checkpoint_extracao
+                SET pagina = ?, npjs_capturados = npjs_capturados + ?, ultimo_npj = COALESCE(?, ultimo_npj),
+                    npjs_ultima_pagina = ?, atualizado_em = ?
+                WHERE tipo_notificacao = ?
+            """, (pagina, len(npjs), npjs[-1] if npjs else None, json.dumps(npjs),
+                  datetime.now().strftime('%Y-%m-%d %H:%M:%S'), tipo_notificacao))
+        return salvas
+    except sqlite3.Error as e:
+        logging.error(f"ERRO ao salvar a página {pagina} da extração de '{tipo_notificacao}': {e}", exc_info=True)
+        return None
 
-def buscar_lote_para_processamento(tamanho_lote: int) -> List[Dict]:
-    """Obtém um lote de tarefas (NPJ + data) únicas e marca-as como 'Em Processamento'."""
+def finalizar_checkpoint_extracao(tipo_notificacao: str, status: str, ciencia_confirmada: bool = False):
+    """
+    Registra como a paginação do tipo de tarefa terminou ('Concluída' ou 'Interrompida') e se a ciência
+    das páginas lidas foi confirmada (nesse caso as linhas saem da tabela de não lidas).
+    """
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
-            conn.row_factory = sqlite3.Row
-            cursor = conn.cursor()
-            cursor.execute("""
-                SELECT NPJ, data_notificacao, MAX(origem) as origem
-                FROM notificacoes 
-                WHERE status = 'Pendente' AND data_notificacao IS NOT NULL
-                GROUP BY NPJ, data_notificacao
-                ORDER BY data_notificacao, NPJ 
-                LIMIT ?
-            """, (tamanho_lote,))
-            tarefas = [dict(row) for row in cursor.fetchall()]
-            if not tarefas:
-                return []
-            for tarefa in tarefas:
-                conn.execute(
-                    "UPDATE notificacoes SET status = 'Em Processamento' WHERE NPJ = ? AND data_notificacao = ? AND status = 'Pendente'",
-                    (tarefa['NPJ'], tarefa['data_notificacao'])
+        with obter_conexao() as conn:
+            conn.execute(
+                "UPDATE checkpoint_extracao SET status = ?, ciencia_confirmada = ?, atualizado_em = ? WHERE tipo_notificacao = ?",
+                (status, int(ciencia_confirmada), datetime.now().strftime('%Y-%m-%d %H:%M:%S'), tipo_notificacao)
+            )
+    except sqlite3.Error as e:
+        logging.error(f"ERRO ao finalizar o checkpoint da extração de '{tipo_notificacao}': {e}")
+
+def buscar_lote_para_processamento(tamanho_lote: int, worker_id: str = WORKER_ID) -> List[Dict]:
+    """
+    Reivindica atomicamente um lote de tarefas (NPJ + data) para este worker.
+    Um único UPDATE ... RETURNING marca as tarefas como 'Em Processamento' com o id do worker
+    e a expiração da reserva; NPJs reservados por outro worker ficam de fora do lote.
+    """
+    try:
+        with obter_conexao() as conn:
+            cursor = conn.execute(f"""
+                UPDATE tarefas
+                SET status = 'Em Processamento', worker_id = :worker_id, lease_expira_em = :expira_em
+                WHERE id IN (
+                    SELECT id FROM tarefas
+                    WHERE {_SQL_DISPONIVEL}
+                      AND NPJ NOT IN (
+                        SELECT NPJ FROM tarefas
+                        WHERE status = 'Em Processamento' AND lease_expira_em >= :agora
+                      )
+                    ORDER BY data_notificacao_iso, NPJ
+                    LIMIT :limite
                 )
-            conn.commit()
-            return tarefas
+                RETURNING id, NPJ, data_notificacao, data_notificacao_iso, origem
+            """, {
+                "worker_id": worker_id, "agora": _agora_iso(),
+                "expira_em": _agora_iso(timedelta(minutes=DURACAO_LEASE_MINUTOS)), "limite": tamanho_lote,
+            })
+            linhas = cursor.fetchall()
+
+        # A ordem das linhas do RETURNING não é garantida: restaura a ordem cronológica.
+        linhas.sort(key=lambda l: (l['data_notificacao_iso'] or '', l['NPJ']))
+        lote = [
+            {"id": l['id'], "NPJ": l['NPJ'], "data_notificacao": l['data_notificacao'], "origem": l['origem']}
+            for l in linhas
+        ]
+        if lote:
+            logging.info(f"{len(lote)} tarefa(s) reservada(s) para o worker '{worker_id}' por {DURACAO_LEASE_MINUTOS} minutos.")
+        return lote
     except sqlite3.Error as e:
         logging.error(f"ERRO ao obter lote de tarefas pendentes: {e}", exc_info=True)
         return []
 
+def renovar_lease(worker_id: str = WORKER_ID):
+    """Estende a reserva das tarefas ainda em processamento por este worker."""
+    try:
+        with obter_conexao() as conn:
+            conn.execute(
+                "UPDATE tarefas SET lease_expira_em = ? WHERE status = 'Em Processamento' AND worker_id = ?",
+                (_agora_iso(timedelta(minutes=DURACAO_LEASE_MINUTOS)), worker_id)
+            )
+    except sqlite3.Error as e:
+        logging.error(f"ERRO ao renovar a reserva do worker '{worker_id}': {e}", exc_info=True)
+
+def liberar_tarefas(ids_tarefas: List[int], worker_id: str = WORKER_ID):
+    """Devolve à fila as tarefas reservadas por este worker que não chegaram a ser processadas."""
+    if not ids_tarefas:
+        return
+    try:
+        placeholders = ', '.join(['?'] * len(ids_tarefas))
+        with obter_conexao() as conn:
+            cursor = conn.execute(f"""
+                UPDATE tarefas SET status = 'Pendente', worker_id = NULL, lease_expira_em = NULL
+                WHERE id IN ({placeholders}) AND status = 'Em Processamento' AND worker_id = ?
+            """, (*ids_tarefas, worker_id))
+            logging.info(f"{cursor.rowcount} tarefa(s) não processada(s) devolvida(s) à fila.")
+    except sqlite3.Error as e:
+        logging.error(f"ERRO ao liberar tarefas reservadas: {e}", exc_info=True)
+
 def contar_pendentes() -> int:
-    """Conta quantas tarefas (grupos NPJ + data) únicas ainda estão pendentes."""
+    """Conta quantas tarefas (NPJ + data) ainda estão disponíveis para processamento."""
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
+        with obter_conexao() as conn:
             cursor = conn.cursor()
-            cursor.execute("SELECT COUNT(DISTINCT NPJ || data_notificacao) FROM notificacoes WHERE status = 'Pendente' AND data_notificacao IS NOT NULL")
+            cursor.execute(f"SELECT COUNT(*) FROM tarefas WHERE {_SQL_DISPONIVEL}", {"agora": _agora_iso()})
             return cursor.fetchone()[0]
     except sqlite3.Error as e:
         logging.error(f"ERRO ao contar tarefas pendentes: {e}", exc_info=True)
         return 0
 
+def _pools_de_usuarios(conn) -> Dict[str, List[str]]:
+    """Retorna os pools de usuários do cache, recarregando-os apenas se o cadastro mudou."""
+    global _cache_usuarios
+    versao_atual = conn.execute("SELECT versao FROM versao_cadastros WHERE nome = 'usuarios'").fetchone()
+    versao_atual = versao_atual[0] if versao_atual else None
+    versao_cache, pools = _cache_usuarios
+    if versao_cache is not None and versao_cache == versao_atual:
+        return pools
+
+    usuarios = conn.execute("SELECT nome, perfil FROM usuarios ORDER BY nome").fetchall()
+    por_perfil: Dict[str, List[str]] = {}
+    for usuario in usuarios:
+        por_perfil.setdefault(usuario['perfil'], []).append(usuario['nome'])
+    pools = {
+        pool: [nome for perfil in perfis for nome in por_perfil.get(perfil, [])]
+        for pool, perfis in POOLS_ATRIBUICAO.items()
+    }
+    _cache_usuarios = (versao_atual, pools)
+    logging.info(f"Cadastro de usuários carregado (versão {versao_atual}): {len(usuarios)} usuário(s).")
+    return pools
+
+def _avancar_round_robin(conn, polo_da_tarefa: Optional[str]) -> str | None:
+    """
+    Escolhe o próximo usuário do pool da tarefa e avança o cursor persistente do pool.
+    Deve rodar dentro da transação do chamador, para que escolha e gravação sejam atômicas.
+    """
+    # Tarefas de polo Passivo, Nulo ou outros só podem ser atribuídas a usuários Gerais
+    pool_nome = 'Polo Ativo' if polo_da_tarefa == 'Ativo' else 'Geral'
+    pools = _pools_de_usuarios(conn)
+    user_pool = pools.get(pool_nome, [])
+
+    if not user_pool:
+        if not any(pools.values()):
+            logging.warning("Nenhum usuário cadastrado para atribuição de tarefas.")
+        else:
+            logging.error(f"Nenhum usuário elegível encontrado para uma tarefa com polo '{polo_da_tarefa}'. Verifique os perfis.")
+        return None
+
+    ultimo = conn.execute("SELECT ultimo_usuario FROM atribuicao_estado WHERE pool = ?", (pool_nome,)).fetchone()
+    ultimo = ultimo[0] if ultimo else None
+    try:
+        proximo = user_pool[(user_pool.index(ultimo) + 1) % len(user_pool)]
+    except ValueError:
+        # Sem histórico ou o último usuário saiu do pool (ex: perfil mudou): começa do início do pool
+        proximo = user_pool[0]
+
+    conn.execute("""
+        INSERT INTO atribuicao_estado (pool, ultimo_usuario) VALUES (?, ?)
+        ON CONFLICT (pool) DO UPDATE SET ultimo_usuario = excluded.ultimo_usuario
+    """, (pool_nome, proximo))
+    return proximo
+
 def get_next_user(polo_da_tarefa: Optional[str]) -> str | None:
     """
     Busca o próximo usuário para atribuição (round-robin), considerando o perfil
-    e o polo da tarefa.
+    e o polo da tarefa, e avança o cursor do pool correspondente.
     """
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
-            conn.row_factory = sqlite3.Row
-            
-            # 1. Obter todos os usuários e seus perfis
-            all_users_raw = conn.execute("SELECT nome, perfil FROM usuarios ORDER BY nome").fetchall()
-            if not all_users_raw:
-                logging.warning("Nenhum usuário cadastrado para atribuição de tarefas.")
+        with obter_conexao() as conn:
+            return _avancar_round_robin(conn, polo_da_tarefa)
+    except sqlite3.Error as e:
+        logging.error(f"ERRO ao buscar próximo usuário: {e}", exc_info=True)
+        return None
+
+def atualizar_notificacoes_processadas(npj, data, numero_processo, andamentos, documentos, data_processamento, responsavel=None, status='Processado', polo=None, worker_id: str = WORKER_ID) -> str | None:
+    """
+    Atualiza a tarefa (NPJ + data) como 'Processado' ou 'Migrado' e adiciona o polo.
+    Sem 'responsavel' informado, atribui o próximo usuário do round-robin na mesma transação.
+    Retorna o responsável gravado.
+    """
+    try:
+        with obter_conexao() as conn:
+            # O UPDATE vem primeiro para obter o lock de escrita antes de ler o cursor do round-robin.
+            tarefa = conn.execute("""
+                UPDATE tarefas
+                SET status = ?, numero_processo = ?, data_processamento = ?, detalhes_erro = NULL, tentativas = 0,
+                    polo = ?, worker_id = NULL, lease_expira_em = NULL, proxima_tentativa_em = NULL
+                WHERE NPJ = ? AND data_notificacao = ? AND status = 'Em Processamento' AND worker_id = ?
+                RETURNING id
+            """, (status, numero_processo, data_processamento, polo, npj, data, worker_id)).fetchone()
+            if not tarefa:
+                logging.warning(f"Tarefa {npj}-{data} não está mais reservada para este worker; resultado descartado.")
                 return None
-            
-            # 2. Definir o pool de usuários elegíveis com base no polo da tarefa
-            usuarios_gerais = [user['nome'] for user in all_users_raw if user['perfil'] == 'Geral']
-            
-            if polo_da_tarefa == 'Ativo':
-                usuarios_polo_ativo = [user['nome'] for user in all_users_raw if user['perfil'] == 'Polo Ativo']
-                user_pool = usuarios_gerais + usuarios_polo_ativo
-            else: # Tarefas de polo Passivo, Nulo ou outros só podem ser atribuídas a usuários Gerais
-                user_pool = usuarios_gerais
-
-            if not user_pool:
-                logging.error(f"Nenhum usuário elegível encontrado para uma tarefa com polo '{polo_da_tarefa}'. Verifique os perfis.")
-                # Fallback para qualquer usuário geral, se houver
-                return usuarios_gerais[0] if usuarios_gerais else None
-
-            # 3. Descobrir o último usuário atribuído DENTRO DO POOL ELEGÍVEL
-            placeholders = ', '.join(['?'] * len(user_pool))
-            last_assigned_raw = conn.execute(
-                f"SELECT responsavel FROM notificacoes WHERE responsavel IN ({placeholders}) ORDER BY data_processamento DESC LIMIT 1",
-                user_pool
-            ).fetchone()
-            
-            last_assigned = last_assigned_raw['responsavel'] if last_assigned_raw else None
 
-            # 4. Lógica de Round-Robin
-            if not last_assigned:
-                return user_pool[0]
-            
-            try:
-                last_index = user_pool.index(last_assigned)
-                next_index = (last_index + 1) % len(user_pool)
-                return user_pool[next_index]
-            except ValueError:
-                # O último usuário atribuído não está mais no pool (ex: perfil mudou), começa do início do pool
-                return user_pool[0]
-                
+            _gravar_detalhes_tarefa(conn, tarefa['id'], andamentos, documentos)
+            if responsavel is None:
+                responsavel = _avancar_round_robin(conn, polo)
+            conn.execute("UPDATE tarefas SET responsavel = ? WHERE id = ?", (responsavel, tarefa['id']))
+            return responsavel
     except sqlite3.Error as e:
-        logging.error(f"ERRO ao buscar próximo usuário: {e}", exc_info=True)
+        logging.error(f"ERRO ao atualizar tarefa {npj}-{data} como processada: {e}")
         return None
 
+def marcar_tarefa_como_erro(npj, data, motivo, data_processamento, tipo_erro: str, worker_id: str = WORKER_ID):
+    """
+    Marca a tarefa (NPJ + data) com um status de erro específico e controla as tentativas.
+    Erros de portal são reagendados com backoff exponencial (com jitter) calculado no próprio UPDATE.
+    """
+    try:
+        with obter_conexao() as conn:
+            # No SET, 'tentativas' ainda é o valor anterior à falha atual.
+            resultado = conn.execute("""
+                UPDATE tarefas SET
+                    status = CASE
+                        WHEN :tipo_erro = 'permanente' THEN 'Erro_Permanente'
+                        WHEN :tipo_erro = 'portal' AND COALESCE(tentativas, 0) + 1 >= :max_tentativas THEN 'Requer_Atencao'
+                        WHEN :tipo_erro = 'portal' THEN 'Erro_Portal'
+                        ELSE 'Erro'
+                    END,
+                    proxima_tentativa_em = CASE
+                        WHEN :tipo_erro = 'portal' AND COALESCE(tentativas, 0) + 1 < :max_tentativas THEN datetime(:agora,
+                            '+' || CAST(MIN(:base_segundos * (1 << COALESCE(tentativas, 0)), :maximo_segundos)
+                                        * (0.5 + (abs(random()) % 1000) / 1000.0) AS INTEGER) || ' seconds')
+                    END,
+                    tentativas = COALESCE(tentativas, 0) + (:tipo_erro IN ('permanente', 'portal')),
+                    detalhes_erro = :motivo, data_processamento = :data_processamento,
+                    worker_id = NULL, lease_expira_em = NULL
+                WHERE NPJ = :npj AND data_notificacao = :data AND status = 'Em Processamento' AND worker_id = :worker_id
+                RETURNING status, proxima_tentativa_em
+            """, {
+                "tipo_erro": tipo_erro, "max_tentativas": MAX_TENTATIVAS_PORTAL, "agora": _agora_iso(),
+                "base_segundos": BACKOFF_BASE_MINUTOS * 60, "maximo_segundos": BACKOFF_MAXIMO_MINUTOS * 60,
+                "motivo": motivo, "data_processamento": data_processamento,
+                "npj": npj, "data": data, "worker_id": worker_id,
+            }).fetchone()
+
+        if resultado and resultado['status'] == 'Requer_Atencao':
+            logging.warning(f"Tarefa {npj} atingiu o limite de {MAX_TENTATIVAS_PORTAL} tentativas. Status alterado para 'Requer_Atencao'.")
+        elif resultado and resultado['proxima_tentativa_em']:
+            logging.info(f"Tarefa {npj} reagendada para nova tentativa em {resultado['proxima_tentativa_em']}.")
+    except sqlite3.Error as e:
+        logging.error(f"ERRO ao marcar tarefa {npj}-{data} como erro: {e}")
 
-def atualizar_notificacoes_processadas(npj, data, numero_processo, andamentos, documentos, data_processamento, responsavel, status='Processado', polo=None):
-    """Atualiza as notificações de uma tarefa como 'Processado' ou 'Migrado' e adiciona o polo."""
+def registrar_download(npj: str, data_notificacao: str, nome: str, url: str, resultado: dict):
+    """Registra o resultado de um download direto de documento (tamanho, duração, HTTP e tentativas)."""
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
+        with obter_conexao() as conn:
             conn.execute("""
-                UPDATE notificacoes
-                SET status = ?, numero_processo = ?, andamentos = ?, documentos = ?,
-                    data_processamento = ?, responsavel = ?, detalhes_erro = NULL, tentativas = 0,
-                    polo = ?
-                WHERE NPJ = ? AND data_notificacao = ? AND status = 'Em Processamento'
-            """, (status, numero_processo, json.dumps(andamentos), json.dumps(documentos), data_processamento, responsavel, polo, npj, data))
+                INSERT INTO downloads (NPJ, data_notificacao, nome, url, caminho, status, status_http, tamanho_bytes, duracao_ms, tentativas, erro)
+                VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, ?, ?)
+            """, (npj, data_notificacao, nome, url, resultado.get('caminho'), resultado['status'], resultado.get('status_http'),
+                  resultado.get('tamanho_bytes'), resultado.get('duracao_ms'), resultado.get('tentativas'), resultado.get('erro')))
     except sqlite3.Error as e:
-        logging.error(f"ERRO ao atualizar tarefa {npj}-{data} como processada: {e}")
+        logging.error(f"ERRO ao registrar download de '{nome}' ({npj}): {e}")
 
-def marcar_tarefa_como_erro(npj, data, motivo, data_processamento, tipo_erro: str):
-    """Marca as notificações de uma tarefa com um status de erro específico e controla as tentativas."""
+def buscar_documento_armazenado(npj: str, nome: str, data_documento: str) -> Optional[Dict]:
+    """Retorna {caminho, hash} registrados para o documento (NPJ + nome + data), se ele já foi baixado."""
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
-            cursor = conn.cursor()
-            
-            cursor.execute("SELECT tentativas FROM notificacoes WHERE NPJ = ? AND data_notificacao = ? LIMIT 1", (npj, data))
-            resultado = cursor.fetchone()
-            tentativas_atuais = resultado[0] if resultado and resultado[0] is not None else 0
-
-            novo_status = "Erro" # Default
-            
-            if tipo_erro == 'permanente':
-                novo_status = 'Erro_Permanente'
-                tentativas_atuais += 1
-            
-            elif tipo_erro == 'portal':
-                tentativas_atuais += 1
-                if tentativas_atuais >= MAX_TENTATIVAS_PORTAL:
-                    novo_status = 'Requer_Atencao'
-                    logging.warning(f"Tarefa {npj} atingiu o limite de {MAX_TENTATIVAS_PORTAL} tentativas. Status alterado para 'Requer_Atencao'.")
-                else:
-                    novo_status = 'Erro_Portal'
-            
-            cursor.execute("""
-                UPDATE notificacoes SET status = ?, detalhes_erro = ?, data_processamento = ?, tentativas = ?
-                WHERE NPJ = ? AND data_notificacao = ? AND status = 'Em Processamento'
-            """, (novo_status, motivo, data_processamento, tentativas_atuais, npj, data))
+        with obter_conexao() as conn:
+            linha = conn.execute(
+                "SELECT caminho, hash FROM documentos_armazenados WHERE NPJ = ? AND nome = ? AND data_documento = ?",
+                (npj, nome, data_documento)
+            ).fetchone()
+            return dict(linha) if linha else None
     except sqlite3.Error as e:
-        logging.error(f"ERRO ao marcar tarefa {npj}-{data} como erro: {e}")
+        logging.error(f"ERRO ao consultar o armazém de documentos para '{nome}' ({npj}): {e}")
+        return None
+
+def registrar_documento_armazenado(npj: str, nome: str, data_documento: str, hash_conteudo: str, tamanho_bytes: int, caminho: str):
+    """Registra o blob (se novo) e o vínculo do documento do NPJ com ele."""
+    try:
+        with obter_conexao() as conn:
+            conn.execute("INSERT OR IGNORE INTO blobs (hash, tamanho_bytes) VALUES (?, ?)", (hash_conteudo, tamanho_bytes))
+            conn.execute("""
+                INSERT INTO documentos_armazenados (NPJ, nome, data_documento, hash, caminho) VALUES (?, ?, ?, ?, ?)
+                ON CONFLICT (NPJ, nome, data_documento) DO UPDATE SET hash = excluded.hash, caminho = excluded.caminho
+            """, (npj, nome, data_documento, hash_conteudo, caminho))
+    except sqlite3.Error as e:
+        logging.error(f"ERRO ao registrar o documento '{nome}' ({npj}) no armazém: {e}")
+
+def registrar_vazao_extracao(tipo_notificacao: str, linhas: int, segundos: float):
+    """Guarda quantas linhas um tipo de tarefa rendeu em quanto tempo, para o planejamento da FASE 2."""
+    try:
+        with obter_conexao() as conn:
+            conn.execute(
+                "INSERT INTO vazao_extracao (tipo_notificacao, linhas, segundos) VALUES (?, ?, ?)",
+                (tipo_notificacao, linhas, segundos)
+            )
+    except sqlite3.Error as e:
+        logging.error(f"ERRO ao registrar a vazão da extração de '{tipo_notificacao}': {e}")
+
+def buscar_segundos_por_linha(ultimas_execucoes: int) -> Dict[str, float]:
+    """Retorna, por tipo de tarefa, os segundos por linha medidos nas últimas execuções com linhas lidas."""
+    try:
+        with obter_conexao() as conn:
+            linhas = conn.execute("""
+                SELECT tipo_notificacao, SUM(segundos) / SUM(linhas) AS segundos_por_linha
+                FROM (
+                    SELECT tipo_notificacao, linhas, segundos,
+                           ROW_NUMBER() OVER (PARTITION BY tipo_notificacao ORDER BY id DESC) AS ordem
+                    FROM vazao_extracao WHERE linhas > 0
+                )
+                WHERE ordem <= ?
+                GROUP BY tipo_notificacao
+            """, (ultimas_execucoes,)).fetchall()
+            return {linha['tipo_notificacao']: linha['segundos_por_linha'] for linha in linhas}
+    except sqlite3.Error as e:
+        logging.error(f"ERRO ao consultar o histórico de vazão da extração: {e}")
+        return {}
+
+def _hash_descricao(descricao: str) -> str:
+    return hashlib.sha1(descricao.encode('utf-8')).hexdigest()
+
+def buscar_andamentos_em_cache(npj: str) -> Dict[tuple, str]:
+    """Retorna {(data, descricao, ordem): detalhes} dos andamentos de publicação já detalhados para o NPJ."""
+    try:
+        with obter_conexao() as conn:
+            linhas = conn.execute(
+                "SELECT data, descricao, ordem, detalhes, comprimido FROM cache_andamentos WHERE NPJ = ?", (npj,)
+            ).fetchall()
+    except sqlite3.Error as e:
+        logging.error(f"ERRO ao consultar o cache de andamentos do NPJ {npj}: {e}")
+        return {}
+    return {
+        (linha['data'], linha['descricao'], linha['ordem']): zlib.decompress(linha['detalhes']).decode('utf-8') if linha['comprimido'] else linha['detalhes']
+        for linha in linhas
+    }
+
+def salvar_andamentos_em_cache(npj: str, andamentos: List[Dict]):
+    """Guarda os detalhes de andamentos recém-extraídos para que as próximas visitas não reabram o modal."""
+    if not andamentos:
+        return
+    registros = []
+    for andamento in andamentos:
+        detalhes, comprimido = _compactar_texto(andamento.get('detalhes'))
+        registros.append((
+            npj, andamento['data'], _hash_descricao(andamento['descricao']), andamento['ordem'], andamento['descricao'], detalhes, comprimido
+        ))
+    try:
+        with obter_conexao() as conn:
+            conn.executemany("""
+                INSERT OR REPLACE INTO cache_andamentos (NPJ, data, hash_descricao, ordem, descricao, detalhes, comprimido)
+                VALUES (?, ?, ?, ?, ?, ?, ?)
+            """, registros)
+    except sqlite3.Error as e:
+        logging.error(f"ERRO ao gravar o cache de andamentos do NPJ {npj}: {e}")
 
 def salvar_log_execucao(log_data: dict):
     """Salva um registro de log no banco de dados."""
     try:
-        with sqlite3.connect(DATABASE_PATH) as conn:
+        with obter_conexao() as conn:
             cols = ', '.join(log_data.keys())
             placeholders = ', '.join(['?'] * len(log_data))
             conn.execute(f"INSERT INTO logs_execucao ({cols}) VALUES ({placeholders})", list(log_data.values()))
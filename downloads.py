@@ -0,0 +1,189 @@
+import logging
+import os
+import queue
+import re
+import threading
+import time
+from pathlib import Path
+from typing import Any, Callable, Dict, List
+from urllib.parse import unquote
+from playwright.sync_api import sync_playwright
+import database
+from armazem_documentos import armazenar
+from conexao import fechar_conexao
+from config import DOWNLOAD_TENTATIVAS, DOWNLOAD_TIMEOUT_MS, DOWNLOADS_PARALELOS
+
+# --- Downloads diretos de documentos (FASE 3) ---
+# Os arquivos cujo link tem URL própria são buscados por uma APIRequestContext com os cookies da
+# sessão, em vez de 'expect_download' + clique. A aba segue para o próximo NPJ enquanto os arquivos
+# são baixados; a tarefa só é finalizada no banco quando todos os seus downloads terminam.
+
+def nome_arquivo_da_resposta(headers: Dict[str, str], nome_padrao: str) -> str:
+    """Extrai o nome do arquivo do Content-Disposition; usa o nome exibido no portal se ausente."""
+    disposicao = headers.get('content-disposition', '')
+    match = re.search(r"filename\*=(?:UTF-8'')?([^;]+)", disposicao, re.IGNORECASE)
+    if match:
+        nome = unquote(match.group(1).strip().strip('"'))
+    else:
+        match = re.search(r'filename="?([^";]+)"?', disposicao, re.IGNORECASE)
+        nome = match.group(1).strip() if match else nome_padrao
+    return re.sub(r'[\\/*?:"<>|]', '_', nome) or 'documento'
+
+def resposta_indica_ged_indisponivel(status: int, headers: Dict[str, str], corpo: bytes) -> bool:
+    """O GED responde com uma página HTML de erro em vez do arquivo quando está fora do ar."""
+    if 'text/html' not in headers.get('content-type', ''):
+        return False
+    return b'GED indispon' in corpo
+
+def gravar_arquivo(diretorio: Path, nome: str, corpo: bytes) -> Path:
+    """Grava o arquivo via arquivo temporário + rename, para nunca deixar um documento pela metade na pasta."""
+    caminho = diretorio / nome
+    temporario = caminho.with_name(f".{caminho.name}.parcial")
+    temporario.write_bytes(corpo)
+    os.replace(temporario, caminho)
+    return caminho
+
+def registrar_resultado(npj: str, data_notificacao: str, documento: Dict[str, Any], resultado: Dict[str, Any]):
+    logging.info(
+        f"         - Download direto de '{documento['nome']}' ({npj}): {resultado['status']} "
+        f"em {resultado['duracao_ms']} ms, {resultado['tamanho_bytes'] or 0} bytes, {resultado['tentativas']} tentativa(s)."
+    )
+    database.registrar_download(npj, data_notificacao, documento['nome'], documento['url'], resultado)
+
+def baixar_com_tentativas(request_context, npj: str, documento: Dict[str, Any], diretorio: Path) -> Dict[str, Any]:
+    """
+    Baixa um documento com até DOWNLOAD_TENTATIVAS tentativas (API síncrona).
+    Retorna o registro do download: status ('ok', 'ged_indisponivel' ou 'falha'), caminho, tamanho, duração e HTTP.
+    """
+    inicio = time.monotonic()
+    resultado = {"status": "falha", "caminho": None, "tamanho_bytes": None, "status_http": None, "tentativas": 0, "erro": None}
+    for tentativa in range(1, DOWNLOAD_TENTATIVAS + 1):
+        resultado["tentativas"] = tentativa
+        try:
+            resposta = request_context.get(documento['url'], timeout=DOWNLOAD_TIMEOUT_MS)
+            corpo = resposta.body()
+            resultado["status_http"] = resposta.status
+            if resposta.ok and resposta_indica_ged_indisponivel(resposta.status, resposta.headers, corpo):
+                resultado.update(status="ged_indisponivel", erro="GED indisponível")
+            elif resposta.ok:
+                caminho = gravar_arquivo(diretorio, nome_arquivo_da_resposta(resposta.headers, documento['nome']), corpo)
+                caminho = armazenar(caminho, npj, documento['nome'], documento['data'])
+                resultado.update(status="ok", caminho=str(caminho), tamanho_bytes=len(corpo), erro=None)
+                break
+            else:
+                resultado["erro"] = f"HTTP {resposta.status}"
+        except Exception as e:
+            resultado["erro"] = str(e)
+        if tentativa < DOWNLOAD_TENTATIVAS:
+            time.sleep(2 * tentativa)
+    resultado["duracao_ms"] = int((time.monotonic() - inicio) * 1000)
+    return resultado
+
+class _GrupoDownloads:
+    """Downloads de uma tarefa; 'ao_concluir' é chamado uma única vez, quando o último arquivo termina."""
+
+    def __init__(self, npj: str, data_notificacao: str, diretorio: Path, documentos: List[Dict[str, Any]], ao_concluir: Callable):
+        self.npj = npj
+        self.data_notificacao = data_notificacao
+        self.diretorio = diretorio
+        self.pendentes = len(documentos)
+        self.resultados: List[tuple] = []
+        self.ao_concluir = ao_concluir
+        self.trava = threading.Lock()
+
+    def concluir_um(self, documento: Dict[str, Any], resultado: Dict[str, Any]) -> bool:
+        with self.trava:
+            self.resultados.append((documento, resultado))
+            self.pendentes -= 1
+            return self.pendentes == 0
+
+class GerenciadorDownloads:
+    """
+    Fila de downloads atendida por DOWNLOADS_PARALELOS threads. A API síncrona do Playwright não é
+    compartilhável entre threads, então cada uma cria sua própria APIRequestContext a partir do
+    storage_state da sessão logada.
+    """
+
+    def __init__(self, estado_sessao: dict):
+        self.estado_sessao = estado_sessao
+        self.fila: queue.Queue = queue.Queue()
+        self.threads: List[threading.Thread] = []
+        # Estatísticas das tarefas finalizadas pelas threads de download, somadas às do lote no final
+        self.stats = {"sucesso": 0, "falha": 0, "andamentos": 0, "documentos": 0}
+        self.trava_stats = threading.Lock()
+        self.trava_threads = threading.Lock() # 'enviar' é chamado pelas várias abas do lote
+
+    def contabilizar(self, **valores: int):
+        with self.trava_stats:
+            for chave, valor in valores.items():
+                self.stats[chave] += valor
+
+    def _garantir_threads(self):
+        with self.trava_threads:
+            self.threads = [thread for thread in self.threads if thread.is_alive()]
+            while len(self.threads) < DOWNLOADS_PARALELOS:
+                thread = threading.Thread(target=self._executar, name=f"Download-{len(self.threads) + 1}")
+                thread.start()
+                self.threads.append(thread)
+
+    def enviar(self, npj: str, data_notificacao: str, diretorio: Path, documentos: List[Dict[str, Any]], ao_concluir: Callable):
+        """Agenda os documentos de uma tarefa. 'ao_concluir(resultados)' recebe a lista de (documento, resultado)."""
+        grupo = _GrupoDownloads(npj, data_notificacao, diretorio, documentos, ao_concluir)
+        self._garantir_threads()
+        for documento in documentos:
+            self.fila.put((grupo, documento))
+
+    def _executar(self):
+        try:
+            with sync_playwright() as playwright:
+                request_context = playwright.request.new_context(storage_state=self.estado_sessao)
+                try:
+                    while True:
+                        item = self.fila.get()
+                        if item is None:
+                            break
+                        grupo, documento = item
+                        resultado = baixar_com_tentativas(request_context, grupo.npj, documento, grupo.diretorio)
+                        registrar_resultado(grupo.npj, grupo.data_notificacao, documento, resultado)
+                        if grupo.concluir_um(documento, resultado):
+                            self._finalizar_grupo(grupo)
+                finally:
+                    request_context.dispose()
+        except Exception as e:
+            logging.error(f"Thread de download encerrada por falha inesperada: {e}", exc_info=True)
+            # Drena os itens restantes como falha para que nenhuma tarefa fique sem finalização.
+            self._falhar_pendentes(str(e))
+        finally:
+            fechar_conexao()
+
+    def _finalizar_grupo(self, grupo: _GrupoDownloads):
+        try:
+            grupo.ao_concluir(grupo.resultados)
+        except Exception as e:
+            logging.error(f"Falha ao finalizar a tarefa {grupo.npj} após os downloads: {e}", exc_info=True)
+
+    def _falhar_pendentes(self, motivo: str):
+        sentinelas = 0
+        while True:
+            try:
+                item = self.fila.get_nowait()
+            except queue.Empty:
+                break
+            if item is None:
+                sentinelas += 1 # Pertence a outra thread: é devolvido à fila ao final, senão 'encerrar' não termina.
+                continue
+            grupo, documento = item
+            resultado = {"status": "falha", "caminho": None, "tamanho_bytes": None, "status_http": None,
+                         "tentativas": 0, "erro": motivo, "duracao_ms": 0}
+            if grupo.concluir_um(documento, resultado):
+                self._finalizar_grupo(grupo)
+        for _ in range(sentinelas):
+            self.fila.put(None)
+
+    def encerrar(self):
+        """Aguarda todos os downloads agendados (e as finalizações das tarefas) terminarem."""
+        for _ in self.threads:
+            self.fila.put(None)
+        for thread in self.threads:
+            thread.join()
+        self.threads = []
@@ -12,6 +12,7 @@ from config import LOG_FORMAT, LOG_LEVEL, TAMANHO_LOTE, TAREFAS_CONFIG, TEMPO_LI
 from autologin import realizar_login_automatico
 from modulo_notificacoes import executar_extracao_e_ciencia
 from processamento_detalhado import processar_detalhes_de_lote
+from processamento_detalhado_async import processar_detalhes_de_lote_async
 from session import SessionExpiredError, refresh_session_if_needed
 
 # --- Configuração de Log ---
@@ -20,6 +21,9 @@ LOG_DIR.mkdir(exist_ok=True)
 timestamp_log = datetime.now().strftime("%Y-%m-%d_%H-%M-%S")
 log_filename = LOG_DIR / f"log_{timestamp_log}.txt"
 
+# 'python main.py --async' executa a FASE 3 sobre a playwright.async_api
+MODO_ASYNC = "--async" in sys.argv[1:]
+
 logging.basicConfig(
     level=LOG_LEVEL,
     format=LOG_FORMAT,
@@ -46,8 +50,10 @@ def main():
 
     try:
         database.inicializar_banco()
+        logging.info(f"Identificador deste worker: {database.WORKER_ID}")
+        if MODO_ASYNC:
+            logging.info("Modo assíncrono ativado para o processamento detalhado (FASE 3).")
         database.resetar_notificacoes_em_processamento()
-        database.resetar_erros_de_portal_antigos()
 
 
         with sync_playwright() as playwright:
@@ -122,7 +128,10 @@ def main():
                             break
                         
                         logging.info(f"Iniciando processamento detalhado de {len(lote_para_processar)} tarefa(s).")
-                        stats_lote = processar_detalhes_de_lote(context, lote_para_processar)
+                        if MODO_ASYNC:
+                            stats_lote = processar_detalhes_de_lote_async(context, lote_para_processar)
+                        else:
+                            stats_lote = processar_detalhes_de_lote(context, lote_para_processar)
 
                         stats_processamento["sucesso"] += stats_lote["sucesso"]
                         stats_processamento["falha"] += stats_lote["falha"]
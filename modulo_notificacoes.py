@@ -1,19 +1,206 @@
 import logging
 import re
+import threading
 import time
-from playwright.sync_api import Page, TimeoutError
-from config import TAREFAS_CONFIG
+from contextlib import nullcontext
+from datetime import datetime, timedelta
+from typing import Optional
+from playwright.sync_api import sync_playwright, Page, TimeoutError
+from autologin import CDP_ENDPOINT
+from conexao import fechar_conexao
+from config import (
+    EXTRACAO_PARALELA, HISTORICO_VAZAO_EXECUCOES, MARCAR_CIENCIA_EM_LOTE, SEGUNDOS_POR_LINHA_PADRAO, TAREFAS_CONFIG
+)
+from politica_recursos import instalar_politica_de_recursos
 import database
-from datetime import datetime, timedelta 
 
-def extrair_dados_e_dar_ciencia_em_lote(page: Page, tarefa: dict, start_time_ciclo: float, limite_tempo: int) -> tuple[list[dict], int, bool]:
+# Lê, em uma única ida ao navegador, todas as linhas da página atual da tabela de notificações não lidas.
+JS_LINHAS_NOTIFICACOES = """
+linhas => linhas.map(tr => {
+    const celulas = tr.querySelectorAll('td');
+    const texto = i => celulas.length > i ? celulas[i].innerText.trim() : '';
+    const link = celulas.length > 0 ? celulas[0].querySelector('a') : null;
+    const checkbox = tr.querySelector('input[type="checkbox"][id*=":darCiencia"]');
+    return {
+        npj: link ? link.innerText.trim() : '',
+        adverso: texto(1),
+        coluna_data: texto(2),
+        dias_gerada: texto(4),
+        href: link ? (link.getAttribute('href') || '') : '',
+        tem_checkbox: checkbox !== null,
+        marcado: checkbox !== null && checkbox.checked
+    };
+})
+"""
+
+# Marca (se 'marcar') a ciência das linhas capturadas e conta as caixas marcadas: nas linhas capturadas e
+# na página inteira. O clique dispara os mesmos handlers do RichFaces que um clique do usuário.
+JS_MARCAR_CIENCIA = """
+(linhas, [indices, marcar]) => {
+    const alvo = new Set(indices);
+    let capturadas = 0, naPagina = 0;
+    linhas.forEach((tr, i) => {
+        const checkbox = tr.querySelector('input[type="checkbox"][id*=":darCiencia"]');
+        if (!checkbox) return;
+        if (marcar && alvo.has(i) && !checkbox.checked) checkbox.click();
+        if (checkbox.checked) {
+            naPagina++;
+            if (alvo.has(i)) capturadas++;
+        }
+    });
+    return {marcadas_capturadas: capturadas, marcadas_na_pagina: naPagina};
+}
+"""
+
+def _data_da_linha(linha: dict, nome_tarefa: str, hoje) -> str:
+    """Data da notificação: coluna de data, ou hoje menos 'Qtd Dias Gerada' em 'Inclusão de Documentos no NPJ'."""
+    if nome_tarefa != 'Inclusão de Documentos no NPJ':
+        return linha['coluna_data'].split(" ")[0]
+    try:
+        dias_gerada = int(linha['dias_gerada'])
+        return (hoje - timedelta(days=dias_gerada)).strftime('%d/%m/%Y')
+    except ValueError as e:
+        logging.warning(f"      - Não foi possível calcular a data para NPJ {linha['npj']}. Usando data de hoje. Erro: {e}")
+        return hoje.strftime('%d/%m/%Y')
+
+def montar_notificacoes(linhas: list[dict], nome_tarefa: str) -> list[tuple[int, dict, bool, bool]]:
+    """
+    Converte as linhas lidas em lote em (índice, notificação, tem_checkbox, precisa_marcar_ciencia).
+    Linhas sem NPJ são ignoradas.
+    """
+    hoje = datetime.now().date()
+    resultado = []
+    for indice, linha in enumerate(linhas):
+        if not linha['npj']:
+            continue
+        match = re.search(r'idProcesso=(\d+)', linha['href'])
+        notificacao = {
+            "NPJ": linha['npj'], "tipo_notificacao": nome_tarefa,
+            "adverso_principal": linha['adverso'], "data_notificacao": _data_da_linha(linha, nome_tarefa, hoje),
+            "id_processo_portal": match.group(1) if match else None
+        }
+        resultado.append((indice, notificacao, linha['tem_checkbox'], linha['tem_checkbox'] and not linha['marcado']))
+    return resultado
+
+def marcar_ciencia_da_pagina(linhas_locator, notificacoes_da_pagina: list[tuple[int, dict, bool, bool]]) -> bool:
+    """
+    Marca a ciência das linhas capturadas na página (em lote ou linha a linha, conforme MARCAR_CIENCIA_EM_LOTE)
+    e confere o resultado: todas as linhas capturadas marcadas e nenhuma outra linha da página marcada.
+    Retorna False se a contagem divergir.
+    """
+    indices = [indice for indice, _, tem_checkbox, _ in notificacoes_da_pagina if tem_checkbox]
+    for _, notificacao, tem_checkbox, _ in notificacoes_da_pagina:
+        if not tem_checkbox:
+            logging.warning(f"      - NPJ {notificacao['NPJ']} sem caixa de ciência na tabela.")
+
+    if not MARCAR_CIENCIA_EM_LOTE:
+        for indice, notificacao, _, precisa_marcar in notificacoes_da_pagina:
+            if precisa_marcar:
+                try:
+                    linhas_locator.nth(indice).locator('input[type="checkbox"][id*=":darCiencia"]').check()
+                except Exception as e:
+                    logging.warning(f"      - Erro ao marcar a ciência do NPJ {notificacao['NPJ']}: {e}")
+
+    contagem = linhas_locator.evaluate_all(JS_MARCAR_CIENCIA, [indices, MARCAR_CIENCIA_EM_LOTE])
+    if contagem['marcadas_capturadas'] != len(indices) or contagem['marcadas_na_pagina'] != len(indices):
+        logging.error(
+            f"      - DIVERGÊNCIA na ciência: {len(indices)} linha(s) capturada(s), {contagem['marcadas_capturadas']} marcada(s) "
+            f"entre elas e {contagem['marcadas_na_pagina']} marcada(s) na página."
+        )
+        return False
+    logging.info(f"      - Ciência marcada e conferida em {len(indices)} linha(s).")
+    return True
+
+# --- Paginação (datascroller do RichFaces) ---
+SELETOR_PROXIMA_PAGINA = 'td.rich-datascr-button:not(.dsbld)[onclick*="page\': \'next\'"]'
+
+# Página atual e números de página clicáveis exibidos no datascroller.
+JS_PAGINADOR = """
+paginador => {
+    const numero = td => parseInt(td.innerText.trim(), 10);
+    const ativa = paginador.querySelector('td.rich-datascr-act');
+    return {
+        atual: ativa ? numero(ativa) : null,
+        visiveis: Array.from(paginador.querySelectorAll('td.rich-datascr-inact')).map(numero).filter(n => !isNaN(n))
+    };
+}
+"""
+
+def _aguardar_carregamento(modal_carregando, aviso_sem_modal: str):
+    try:
+        modal_carregando.wait_for(state='visible', timeout=10000)
+    except TimeoutError:
+        logging.warning(aviso_sem_modal)
+    modal_carregando.wait_for(state='hidden', timeout=45000)
+
+def ir_para_pagina(paginador, modal_carregando, destino: int, start_time_ciclo: float, limite_tempo: int) -> int:
+    """
+    Salta pelo datascroller até a página 'destino', clicando a cada passo no número visível mais
+    próximo dela (uma requisição a cada janela de páginas, não a cada página). Para antes se um clique
+    não mudar a página ou se o tempo do ciclo esgotar. Retorna a página alcançada.
+    """
+    pagina_anterior = None
+    while True:
+        estado = paginador.evaluate(JS_PAGINADOR)
+        atual = estado['atual'] or 1
+        if atual == destino or not estado['visiveis']:
+            return atual
+        if atual == pagina_anterior:
+            logging.warning(f"    - O salto não mudou a página da tabela (continua na {atual}). Interrompendo o salto.")
+            return atual
+        if time.time() - start_time_ciclo > limite_tempo:
+            logging.warning("    - Limite de tempo de extração atingido durante o salto de páginas.")
+            return atual
+        alvo = min(estado['visiveis'], key=lambda numero: abs(numero - destino))
+        if abs(alvo - destino) >= abs(atual - destino):
+            return atual
+        logging.info(f"    - Saltando para a página {alvo} da tabela (destino: {destino})...")
+        paginador.locator(f'td.rich-datascr-inact:text-is("{alvo}")').click()
+        _aguardar_carregamento(modal_carregando, "    - Modal de carregamento não apareceu no salto de página, seguindo em frente.")
+        pagina_anterior = atual
+
+def _retomar_do_checkpoint(tabela_detalhes, corpo_da_tabela, modal_carregando, checkpoint: dict,
+                           start_time_ciclo: float, limite_tempo: int) -> Optional[int]:
+    """
+    Leva a tabela para logo depois da última página gravada de uma paginação interrompida (sem ciência
+    confirmada, então as linhas já lidas continuam na tabela). Confere o último NPJ visto antes de pular;
+    se a tabela mudou, volta para a página 1. Retorna a página em que a leitura deve continuar, ou None
+    se o tempo do ciclo esgotou durante o salto (o checkpoint deve ser mantido).
+    """
+    paginador = tabela_detalhes.locator("tfoot").first
+    logging.info(f"    - Retomando do checkpoint: página {checkpoint['pagina']}, último NPJ {checkpoint['ultimo_npj']}.")
+    alcancada = ir_para_pagina(paginador, modal_carregando, checkpoint['pagina'], start_time_ciclo, limite_tempo)
+    if time.time() - start_time_ciclo > limite_tempo:
+        return None
+    npjs_da_pagina = [linha['npj'] for linha in corpo_da_tabela.locator("tr").evaluate_all(JS_LINHAS_NOTIFICACOES)]
+
+    if alcancada == checkpoint['pagina'] and checkpoint['ultimo_npj'] in npjs_da_pagina:
+        botao_proxima = paginador.locator(SELETOR_PROXIMA_PAGINA)
+        if botao_proxima.count() == 0:
+            return alcancada # A tabela termina na página do checkpoint: ela é relida (duplicatas são ignoradas).
+        botao_proxima.click()
+        _aguardar_carregamento(modal_carregando, "    - Modal de carregamento não apareceu na paginação, seguindo em frente.")
+        return alcancada + 1
+
+    logging.warning("    - A tabela não confere com o checkpoint (página ou último NPJ). Recomeçando da página 1.")
+    return ir_para_pagina(paginador, modal_carregando, 1, start_time_ciclo, limite_tempo)
+
+def extrair_dados_e_dar_ciencia_em_lote(page: Page, tarefa: dict, start_time_ciclo: float, limite_tempo: int,
+                                        trava_ciencia: Optional[threading.Lock] = None) -> tuple[int, int, bool]:
     """
     Localiza uma tarefa, extrai dados página por página, e dá ciência, respeitando um limite de tempo.
-    Retorna a lista de notificações, a contagem de ciências e um booleano indicando se o tempo esgotou.
+    Cada página é gravada no banco assim que lida, junto com o checkpoint do tipo de tarefa.
+    'trava_ciencia' serializa a confirmação da ciência entre abas paralelas.
+    Retorna a quantidade de notificações novas, a contagem de ciências e um booleano indicando se a tarefa foi
+    interrompida (tempo esgotado, divergência na ciência ou falha) e deve ser retomada no próximo ciclo.
     """
-    notificacoes_para_salvar = []
-    npjs_marcados_para_ciencia = set()
+    notificacoes_salvas = 0
+    linhas_lidas = 0
+    inicio_extracao = time.time()
+    ciencias_marcadas = 0
     houve_marcacao = False
+    divergencia_na_ciencia = False
+    falha_na_gravacao = False
     tempo_esgotado = False
     
     try:
@@ -24,12 +211,12 @@ def extrair_dados_e_dar_ciencia_em_lote(page: Page, tarefa: dict, start_time_cic
         
         if linha_alvo.count() == 0:
             logging.warning(f"Tarefa '{tarefa['nome']}' não encontrada. Pulando.")
-            return [], 0, False
+            return 0, 0, False
         
         contagem_texto = linha_alvo.locator("td").nth(2).inner_text().strip()
-        if not contagem_texto.isdigit() or int(contagem_texto.replace('.', '')) == 0:
+        if not contagem_texto.replace('.', '').isdigit() or int(contagem_texto.replace('.', '')) == 0:
             logging.info(f"Tarefa '{tarefa['nome']}' sem notificações pendentes.")
-            return [], 0, False
+            return 0, 0, False
 
         logging.info(f"{contagem_texto} itens encontrados. Abrindo detalhes...")
         linha_alvo.locator('td').last.locator('input[type="button"]').click()
@@ -41,9 +228,22 @@ def extrair_dados_e_dar_ciencia_em_lote(page: Page, tarefa: dict, start_time_cic
         corpo_da_tabela = tabela_detalhes.locator('tbody[id$=":tb"]')
         corpo_da_tabela.locator("tr").first.wait_for(state="visible", timeout=20000)
 
-        pagina_atual = 1
         modal_carregando = page.locator('#notificacoesNaoLidasForm\\:ajaxLoadingModalBox').first
 
+        # Uma paginação interrompida sem confirmar a ciência continua de onde parou, em vez da página 1.
+        # As páginas puladas já estão no banco; a ciência delas fica para a próxima passagem completa.
+        pagina_atual = 1
+        retomar = False
+        checkpoint = database.buscar_checkpoint_extracao(tarefa['nome'])
+        if checkpoint and checkpoint['status'] != 'Concluída' and not checkpoint['ciencia_confirmada'] and checkpoint['pagina'] > 0:
+            retomada = _retomar_do_checkpoint(
+                tabela_detalhes, corpo_da_tabela, modal_carregando, checkpoint, start_time_ciclo, limite_tempo
+            )
+            # Sem retomada (tempo esgotado no salto), o checkpoint é mantido e o laço abaixo encerra pelo tempo.
+            retomar = retomada is None or retomada > 1
+            pagina_atual = retomada or checkpoint['pagina']
+        database.iniciar_checkpoint_extracao(tarefa['nome'], retomar=retomar)
+
         while True:
             # CHECAGEM DE TEMPO A CADA PÁGINA
             if time.time() - start_time_ciclo > limite_tempo:
@@ -53,130 +253,263 @@ def extrair_dados_e_dar_ciencia_em_lote(page: Page, tarefa: dict, start_time_cic
 
             logging.info(f"    - Verificando página {pagina_atual}...")
             
-            for linha in corpo_da_tabela.locator("tr").all():
-                try:
-                    link_detalhe_locator = linha.locator("td").nth(0).locator("a")
-                    npj = link_detalhe_locator.inner_text(timeout=5000).strip()
-                    adverso = linha.locator("td").nth(1).inner_text(timeout=5000).strip()
-                    
-                    # --- NOVA LÓGICA CONDICIONAL PARA DATA ---
-                    data_notificacao = ""
-                    if tarefa['nome'] == 'Inclusão de Documentos no NPJ':
-                        try:
-                            # Pega a coluna "Qtd Dias Gerada" (índice 4, ou 5ª coluna)
-                            dias_gerada_str = linha.locator("td").nth(4).inner_text(timeout=5000).strip()
-                            dias_gerada = int(dias_gerada_str)
-                            # Calcula a data
-                            data_calculada = datetime.now().date() - timedelta(days=dias_gerada)
-                            data_notificacao = data_calculada.strftime('%d/%m/%Y')
-                            logging.info(f"      - Data calculada para '{tarefa['nome']}': {data_notificacao} (baseado em {dias_gerada} dias)")
-                        except (ValueError, IndexError) as e:
-                            logging.warning(f"      - Não foi possível calcular a data para NPJ {npj}. Usando data de hoje. Erro: {e}")
-                            data_notificacao = datetime.now().strftime('%d/%m/%Y')
-                    else:
-                        # Mantém a lógica original para todas as outras tarefas
-                        data_notificacao = linha.locator("td").nth(2).inner_text(timeout=5000).strip().split(" ")[0]
-                    
-                    url_detalhe = link_detalhe_locator.get_attribute('href')
-                    id_processo_portal = None
-                    if url_detalhe:
-                        match = re.search(r'idProcesso=(\d+)', url_detalhe)
-                        if match: id_processo_portal = match.group(1)
-
-                    if npj:
-                        notificacoes_para_salvar.append({
-                            "NPJ": npj, "tipo_notificacao": tarefa["nome"],
-                            "adverso_principal": adverso, "data_notificacao": data_notificacao,
-                            "id_processo_portal": id_processo_portal
-                        })
-                        npjs_marcados_para_ciencia.add(npj)
-
-                        checkbox = linha.locator('input[type="checkbox"][id*=":darCiencia"]')
-                        if checkbox.count() > 0 and not checkbox.is_checked():
-                            checkbox.check()
-                            houve_marcacao = True
-                except Exception as e:
-                    logging.warning(f"      - Erro ao processar uma linha da tabela: {e}")
+            linhas_locator = corpo_da_tabela.locator("tr")
+            linhas = linhas_locator.evaluate_all(JS_LINHAS_NOTIFICACOES)
+            notificacoes_da_pagina = montar_notificacoes(linhas, tarefa['nome'])
+            linhas_lidas += len(notificacoes_da_pagina)
+            logging.info(f"      - {len(notificacoes_da_pagina)} notificação(ões) lida(s) na página {pagina_atual}.")
+
+            salvas_na_pagina = database.salvar_pagina_extracao(
+                tarefa['nome'], pagina_atual, [notificacao for _, notificacao, _, _ in notificacoes_da_pagina]
+            )
+            if salvas_na_pagina is None:
+                # Sem a página no banco, dar ciência perderia essas notificações. O checkpoint fica na última página gravada.
+                falha_na_gravacao = True
+                break
+            notificacoes_salvas += salvas_na_pagina
+            ciencias_marcadas += len({notificacao['NPJ'] for _, notificacao, _, _ in notificacoes_da_pagina})
+            houve_marcacao = houve_marcacao or any(precisa_marcar for *_, precisa_marcar in notificacoes_da_pagina)
+
+            if not marcar_ciencia_da_pagina(linhas_locator, notificacoes_da_pagina):
+                divergencia_na_ciencia = True
+                break
             
             paginador = tabela_detalhes.locator("tfoot")
-            botao_proxima = paginador.locator('td.rich-datascr-button:not(.dsbld)[onclick*="page\': \'next\'"]')
+            botao_proxima = paginador.locator(SELETOR_PROXIMA_PAGINA)
             if botao_proxima.count() == 0:
                 logging.info("    - Fim da paginação.")
                 break
             
             logging.info("    - Navegando para a próxima página de detalhes...")
             botao_proxima.click()
-            
-            try:
-                modal_carregando.wait_for(state='visible', timeout=10000)
-            except TimeoutError:
-                logging.warning("    - Modal de carregamento não apareceu na paginação, seguindo em frente.")
-            modal_carregando.wait_for(state='hidden', timeout=45000)
+            _aguardar_carregamento(modal_carregando, "    - Modal de carregamento não apareceu na paginação, seguindo em frente.")
             
             pagina_atual += 1
 
-        if houve_marcacao:
-            logging.info("    - Confirmando a ciência...")
-            page.locator('input[type="image"][src*="btConfirmar.gif"]').click()
-        else:
-            logging.info("    - Nenhuma ciência marcada. Voltando para a lista de tarefas.")
-            page.locator('input[type="image"][src*="btVoltar.gif"]').click()
-
-        try:
-            modal_carregando.wait_for(state='visible', timeout=10000)
-        except TimeoutError:
-            logging.warning("    - Modal de carregamento final não apareceu, seguindo em frente.")
+        # Só a confirmação da ciência precisa da trava entre abas paralelas.
+        confirmar = houve_marcacao and not divergencia_na_ciencia and not falha_na_gravacao
+        with (trava_ciencia if confirmar else None) or nullcontext():
+            if divergencia_na_ciencia or falha_na_gravacao:
+                # Confirmar daria ciência a notificações não capturadas/gravadas (ou deixaria capturadas sem ciência).
+                motivo = "divergência na contagem" if divergencia_na_ciencia else "falha ao gravar a página no banco"
+                logging.error(f"    - Confirmação da ciência cancelada por {motivo}. Voltando para a lista de tarefas.")
+                page.locator('input[type="image"][src*="btVoltar.gif"]').click()
+                ciencias_marcadas = 0
+            elif confirmar:
+                logging.info("    - Confirmando a ciência...")
+                page.locator('input[type="image"][src*="btConfirmar.gif"]').click()
+            else:
+                logging.info("    - Nenhuma ciência marcada. Voltando para a lista de tarefas.")
+                page.locator('input[type="image"][src*="btVoltar.gif"]').click()
 
-        modal_carregando.wait_for(state='hidden', timeout=45000)
+            _aguardar_carregamento(modal_carregando, "    - Modal de carregamento final não apareceu, seguindo em frente.")
         
+        # Sem a ciência confirmada, o tipo de tarefa não terminou: sinaliza como tempo esgotado para retomá-lo no próximo ciclo.
+        tempo_esgotado = tempo_esgotado or divergencia_na_ciencia or falha_na_gravacao
+        database.finalizar_checkpoint_extracao(
+            tarefa['nome'], 'Interrompida' if tempo_esgotado else 'Concluída', ciencia_confirmada=confirmar
+        )
         logging.info(f"Processamento da tarefa '{tarefa['nome']}' concluído.")
         
     except Exception as e:
         logging.error(f"Falha crítica ao processar a tarefa '{tarefa['nome']}': {e}", exc_info=True)
+        database.finalizar_checkpoint_extracao(tarefa['nome'], 'Interrompida')
         tempo_esgotado = True # Sinaliza erro como tempo esgotado para forçar reinício do ciclo
 
-    return notificacoes_para_salvar, len(npjs_marcados_para_ciencia), tempo_esgotado
+    if linhas_lidas:
+        database.registrar_vazao_extracao(tarefa['nome'], linhas_lidas, time.time() - inicio_extracao)
+
+    return notificacoes_salvas, ciencias_marcadas, tempo_esgotado
+
+# --- Planejamento dos ciclos de extração ---
+# Lê o texto e a coluna de contagem (3ª) de cada linha de 'tabelaTipoSubtipoGeral' em uma única chamada.
+JS_CONTAGENS_TAREFAS = """
+linhas => linhas.map(tr => {
+    const celulas = tr.querySelectorAll('td');
+    return {texto: tr.innerText, contagem: celulas.length > 2 ? celulas[2].innerText.trim() : ''};
+})
+"""
+
+def ler_contagens_pendentes(page: Page, tarefas: list[dict]) -> dict[str, int]:
+    """Retorna a contagem pendente de cada tipo de tarefa (0 se o tipo não estiver na tabela)."""
+    linhas = page.locator('table[id="tabelaTipoSubtipoGeral"] tr').evaluate_all(JS_CONTAGENS_TAREFAS)
+    contagens = {}
+    for tarefa in tarefas:
+        linha = next((linha for linha in linhas if tarefa['nome'] in linha['texto']), None)
+        texto = linha['contagem'].replace('.', '') if linha else ''
+        contagens[tarefa['nome']] = int(texto) if texto.isdigit() else 0
+    return contagens
+
+def planejar_tarefas(page: Page, tarefas: list[dict], start_time_ciclo: float, limite_tempo: int) -> tuple[list[dict], list[dict]]:
+    """
+    Ordena os tipos de tarefa pelo tempo previsto (menores primeiro) e separa os que cabem no tempo
+    restante do ciclo dos que ficam para o próximo. O menor tipo sempre é iniciado, mesmo que não caiba,
+    para que nenhum tipo fique parado indefinidamente (a paginação continua do checkpoint).
+    Tipos sem pendências são descartados. Retorna (planejadas, adiadas).
+    """
+    contagens = ler_contagens_pendentes(page, tarefas)
+    segundos_por_linha = database.buscar_segundos_por_linha(HISTORICO_VAZAO_EXECUCOES)
+    previsoes = sorted(
+        (
+            (contagens[tarefa['nome']] * segundos_por_linha.get(tarefa['nome'], SEGUNDOS_POR_LINHA_PADRAO), tarefa)
+            for tarefa in tarefas if contagens[tarefa['nome']] > 0
+        ),
+        key=lambda previsao: previsao[0]
+    )
+    restante = limite_tempo - (time.time() - start_time_ciclo)
+
+    planejadas, adiadas, acumulado = [], [], 0.0
+    for previsto, tarefa in previsoes:
+        cabe = acumulado + previsto <= restante
+        if (cabe or not planejadas) and not adiadas:
+            planejadas.append(tarefa)
+            acumulado += previsto
+        else:
+            adiadas.append(tarefa)
+        logging.info(
+            f"  - Plano: '{tarefa['nome']}' com {contagens[tarefa['nome']]} pendente(s), ~{previsto / 60:.1f} min previstos"
+            f"{'' if tarefa in planejadas else ' (adiado para o próximo ciclo)'}."
+        )
+
+    if planejadas:
+        conclusao = datetime.now() + timedelta(seconds=acumulado)
+        logging.info(
+            f"Plano do ciclo: {len(planejadas)} tipo(s) em ~{acumulado / 60:.1f} min (restam {restante / 60:.1f} min no ciclo). "
+            f"Conclusão prevista às {conclusao.strftime('%H:%M:%S')}."
+        )
+    sem_pendencias = len(tarefas) - len(previsoes)
+    if sem_pendencias:
+        logging.info(f"{sem_pendencias} tipo(s) de tarefa sem notificações pendentes.")
+    return planejadas, adiadas
+
+def abrir_visao_do_advogado(page: Page):
+    """Navega até a tabela de tipos de tarefa ('tabelaTipoSubtipoGeral') da Central de Notificações."""
+    logging.info("Navegando para a Central de Notificações...")
+    page.goto("https://juridico.bb.com.br/paj/app/paj-central-notificacoes/spas/central-notificacoes/central-notificacoes.app.html")
+    page.wait_for_load_state("networkidle", timeout=60000)
+    
+    logging.info("Acessando a 'Visão do Advogado'...")
+    card_processos = page.locator("div.pendencias-card", has_text="Processos - Visao Advogado")
+    card_processos.wait_for(state="visible", timeout=45000)
+    card_processos.locator("a.mi--forward").click()
+    
+    tabela_principal_selector = 'table[id="tabelaTipoSubtipoGeral"]'
+    page.wait_for_selector(tabela_principal_selector, state='visible', timeout=30000)
+
+def _extrair_tarefa_em_aba(page: Page, tarefa: dict, start_time_ciclo: float, limite_tempo: int,
+                           trava_ciencia: Optional[threading.Lock], resultados_por_tarefa: dict):
+    """Abre a Visão do Advogado na aba e extrai um tipo de tarefa, guardando o resultado em 'resultados_por_tarefa'."""
+    abrir_visao_do_advogado(page)
+    resultados_por_tarefa[tarefa['nome']] = extrair_dados_e_dar_ciencia_em_lote(
+        page, tarefa, start_time_ciclo, limite_tempo, trava_ciencia
+    )
+
+def _extrair_tarefa_em_thread(estado_sessao: dict, tarefa: dict, start_time_ciclo: float, limite_tempo: int,
+                              trava_ciencia: Optional[threading.Lock], resultados_por_tarefa: dict):
+    """Aba paralela com conexão CDP e contexto próprios (a API síncrona do Playwright não é compartilhável entre threads)."""
+    try:
+        with sync_playwright() as playwright:
+            browser = playwright.chromium.connect_over_cdp(CDP_ENDPOINT)
+            context = browser.new_context(storage_state=estado_sessao)
+            instalar_politica_de_recursos(context)
+            try:
+                _extrair_tarefa_em_aba(context.new_page(), tarefa, start_time_ciclo, limite_tempo, trava_ciencia, resultados_por_tarefa)
+            finally:
+                context.close()
+    except Exception as e:
+        logging.error(f"Aba de extração de '{tarefa['nome']}' encerrada por falha: {e}", exc_info=True)
+    finally:
+        fechar_conexao()
+
+def _executar_em_abas_paralelas(page: Page, tarefas_a_processar: list[dict], start_time_ciclo: float, limite_tempo: int) -> tuple[dict, bool, list[dict]]:
+    """
+    Extrai cada tipo de tarefa em uma aba própria, todas com a sessão já logada. Sem
+    EXTRACAO_PARALELA['ciencia_concorrente'], as leituras seguem em paralelo e só a confirmação da
+    ciência é feita por uma aba de cada vez.
+    """
+    logging.info(f"Extraindo {len(tarefas_a_processar)} tipo(s) de tarefa em abas paralelas.")
+    estado_sessao = page.context.storage_state()
+    trava_ciencia = None if EXTRACAO_PARALELA['ciencia_concorrente'] else threading.Lock()
+    resultados_por_tarefa: dict = {}
+
+    threads = []
+    for n, tarefa in enumerate(tarefas_a_processar[1:], start=2):
+        thread = threading.Thread(
+            target=_extrair_tarefa_em_thread, name=f"Extracao-{n}",
+            args=(estado_sessao, tarefa, start_time_ciclo, limite_tempo, trava_ciencia, resultados_por_tarefa)
+        )
+        thread.start()
+        threads.append(thread)
+
+    # O primeiro tipo usa a própria página logada, na thread principal.
+    try:
+        _extrair_tarefa_em_aba(page, tarefas_a_processar[0], start_time_ciclo, limite_tempo, trava_ciencia, resultados_por_tarefa)
+    except Exception as e:
+        logging.error(f"Falha ao extrair '{tarefas_a_processar[0]['nome']}' na aba principal: {e}", exc_info=True)
+    finally:
+        for thread in threads:
+            thread.join()
+
+    resultados = {"notificacoes_salvas": 0, "ciencias_registradas": 0}
+    tempo_esgotado = False
+    tarefas_restantes = []
+    for tarefa in tarefas_a_processar:
+        if tarefa['nome'] not in resultados_por_tarefa:
+            # A aba falhou antes de chegar à tabela: o tipo volta para o próximo ciclo.
+            tarefas_restantes.append(tarefa)
+            tempo_esgotado = True
+            continue
+        salvas, ciencias, tempo_esgotado_sub = resultados_por_tarefa[tarefa['nome']]
+        resultados["notificacoes_salvas"] += salvas
+        resultados["ciencias_registradas"] += ciencias
+        if tempo_esgotado_sub:
+            # Tipo interrompido (tempo, divergência ou falha): é retomado do checkpoint no próximo ciclo.
+            tarefas_restantes.append(tarefa)
+            tempo_esgotado = True
+        logging.info(f"Tarefa '{tarefa['nome']}' finalizada. {salvas} novas notificações salvas. {ciencias} ciências registradas.")
+
+    return resultados, tempo_esgotado, tarefas_restantes
 
 def executar_extracao_e_ciencia(page: Page, tarefas_a_processar: list[dict], start_time_ciclo: float, limite_tempo: int) -> tuple[dict, bool, list[dict]]:
     """
     Orquestra a extração e ciência para uma lista de tarefas, respeitando um limite de tempo.
     Retorna os resultados, se o tempo esgotou, e a lista de tarefas restantes.
     """
+    if EXTRACAO_PARALELA['ativa'] and len(tarefas_a_processar) > 1:
+        return _executar_em_abas_paralelas(page, tarefas_a_processar, start_time_ciclo, limite_tempo)
+
     resultados = {"notificacoes_salvas": 0, "ciencias_registradas": 0}
     tempo_esgotado = False
 
     try:
-        logging.info("Navegando para a Central de Notificações...")
-        page.goto("https://juridico.bb.com.br/paj/app/paj-central-notificacoes/spas/central-notificacoes/central-notificacoes.app.html")
-        page.wait_for_load_state("networkidle", timeout=60000)
+        abrir_visao_do_advogado(page)
+        planejadas, adiadas = planejar_tarefas(page, tarefas_a_processar, start_time_ciclo, limite_tempo)
         
-        logging.info("Acessando a 'Visão do Advogado'...")
-        card_processos = page.locator("div.pendencias-card", has_text="Processos - Visao Advogado")
-        card_processos.wait_for(state="visible", timeout=45000)
-        card_processos.locator("a.mi--forward").click()
-        
-        tabela_principal_selector = 'table[id="tabelaTipoSubtipoGeral"]'
-        page.wait_for_selector(tabela_principal_selector, state='visible', timeout=30000)
-        
-        tarefas_restantes = list(tarefas_a_processar)
-        for tarefa in tarefas_a_processar:
+        tarefas_restantes = planejadas + adiadas
+        for tarefa in planejadas:
             if time.time() - start_time_ciclo > limite_tempo:
                 logging.warning("Limite de tempo de extração atingido antes de iniciar nova tarefa. O ciclo será interrompido.")
                 tempo_esgotado = True
                 break
 
-            notificacoes, ciencias, tempo_esgotado_sub = extrair_dados_e_dar_ciencia_em_lote(page, tarefa, start_time_ciclo, limite_tempo)
-            if notificacoes:
-                salvas = database.salvar_notificacoes(notificacoes)
+            # As notificações já são gravadas página a página durante a extração.
+            salvas, ciencias, tempo_esgotado_sub = extrair_dados_e_dar_ciencia_em_lote(page, tarefa, start_time_ciclo, limite_tempo)
+            if salvas or ciencias:
                 resultados["notificacoes_salvas"] += salvas
                 resultados["ciencias_registradas"] += ciencias
                 logging.info(f"Tarefa '{tarefa['nome']}' finalizada. {salvas} novas notificações salvas. {ciencias} ciências registradas.")
             
-            tarefas_restantes.pop(0)
-
             if tempo_esgotado_sub:
+                # O tipo interrompido continua entre as restantes; o próximo ciclo o retoma do checkpoint.
                 tempo_esgotado = True
                 break
+
+            tarefas_restantes.pop(0)
+        else:
+            if adiadas:
+                # O tempo restante do ciclo não comporta os tipos adiados: renova a sessão e começa outro ciclo.
+                logging.info(f"{len(adiadas)} tipo(s) de tarefa adiado(s) para o próximo ciclo.")
+                tempo_esgotado = True
         
         return resultados, tempo_esgotado, tarefas_restantes
 
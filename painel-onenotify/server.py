@@ -1,6 +1,7 @@
 import os
 import sqlite3
 import json
+import zlib
 import click
 from flask import Flask, jsonify, request, g, send_from_directory
 from flask.cli import with_appcontext
@@ -20,6 +21,7 @@ CORS(app)
 DATABASE = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'rpa_refatorado.db'))
 LEGALONE_DATABASE = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'database.db'))
 TAREFAS_CRIADAS_PATH = os.path.abspath(os.path.join(os.path.dirname(__file__), '..', 'tarefas_criadas'))
+BUSY_TIMEOUT_MS = 10000
 
 
 def get_db():
@@ -27,6 +29,9 @@ def get_db():
     if db is None:
         db = g._database = sqlite3.connect(DATABASE)
         db.row_factory = sqlite3.Row
+        # O banco está em modo WAL (ativado pela RPA): o painel lê sem bloquear as escritas
+        # e, ao escrever, aguarda o lock em vez de falhar com 'database is locked'.
+        db.execute(f"PRAGMA busy_timeout = {BUSY_TIMEOUT_MS}")
     return db
 
 def get_legalone_db():
@@ -102,7 +107,101 @@ def add_user_command(nome):
 
 app.cli.add_command(add_user_command)
 
+@click.command('verificar-indices')
+@with_appcontext
+def verificar_indices_command():
+    """Confere com EXPLAIN QUERY PLAN que as consultas do painel usam os índices, sem varrer a tabela."""
+    db = get_db()
+    falhas = 0
+    casos = [(CONSULTA_STATS, [], ('idx_tarefas_status_data_iso',), '/api/stats')]
+    for filtros, indices in CASOS_PLANO_CONSULTA:
+        query, params = montar_consulta_notificacoes(
+            filtros['status'], filtros.get('responsavel'), filtros.get('polo'), filtros.get('data')
+        )
+        casos.append((query, params, indices, f"/api/notificacoes {filtros}"))
+
+    for query, params, indices, descricao in casos:
+        problemas = verificar_plano(db, query, params, indices)
+        if problemas:
+            falhas += 1
+            click.echo(f"FALHA {descricao}: " + "; ".join(problemas))
+        else:
+            click.echo(f"OK    {descricao}")
+
+    if falhas:
+        raise click.ClickException(f"{falhas} consulta(s) do painel sem uso adequado de índice.")
+    click.echo('Todas as consultas do painel usam índices.')
+
+app.cli.add_command(verificar_indices_command)
+
+# Contagem por status do /api/stats; percorre apenas o índice (status, data_notificacao_iso).
+CONSULTA_STATS = "SELECT status, COUNT(*) AS total FROM tarefas GROUP BY status"
+
+# Combinações de filtros do painel e os índices aceitos para cada uma, verificadas por 'flask verificar-indices'.
+CASOS_PLANO_CONSULTA = [
+    ({'status': 'Pendente'}, ('idx_tarefas_status_data_iso',)),
+    ({'status': 'Erro'}, ('idx_tarefas_status_data_iso', 'idx_tarefas_status_responsavel', 'idx_tarefas_status_polo')),
+    ({'status': 'Processado', 'responsavel': 'Fulano'}, ('idx_tarefas_status_responsavel',)),
+    ({'status': 'Processado', 'polo': 'Ativo'}, ('idx_tarefas_status_polo',)),
+    ({'status': 'Processado', 'data': '2025-01-31'}, ('idx_tarefas_status_data_iso',)),
+    ({'status': 'Processado', 'responsavel': 'Fulano', 'polo': 'Ativo', 'data': '2025-01-31'},
+     ('idx_tarefas_status_data_iso', 'idx_tarefas_status_responsavel', 'idx_tarefas_status_polo')),
+]
+
 # --- Funções Auxiliares ---
+def montar_consulta_notificacoes(status_filter, responsavel_filter=None, polo_filter=None, data_filter=None):
+    """Monta a consulta do /api/notificacoes para os filtros recebidos. Retorna (query, params)."""
+    params = []
+    
+    if status_filter == 'Erro':
+        # Intervalo equivalente a "LIKE 'Erro%'", mas que o SQLite resolve pelo índice de status
+        query_status = "WHERE t.status >= 'Erro' AND t.status < 'Errp'"
+    else:
+        query_status = "WHERE t.status = ?"
+        params.append(status_filter)
+
+    # Cada tarefa (NPJ + data) é uma linha; as notificações de origem vêm pelo índice em tarefa_id.
+    query = f"""
+        SELECT
+            t.NPJ, t.data_notificacao, t.adverso_principal, t.numero_processo, t.polo,
+            (SELECT GROUP_CONCAT(n.id, ';') FROM notificacoes n WHERE n.tarefa_id = t.id) as ids,
+            (SELECT GROUP_CONCAT(n.tipo_notificacao, '; ') FROM notificacoes n WHERE n.tarefa_id = t.id) as tipos_notificacao,
+            t.responsavel, t.data_processamento, t.detalhes_erro, t.gerou_tarefa, t.status
+        FROM tarefas t {query_status}
+    """
+    
+    if responsavel_filter and responsavel_filter != 'Todos':
+        query += " AND t.responsavel = ?"
+        params.append(responsavel_filter)
+    elif responsavel_filter == 'Sem Responsável':
+        query += " AND (t.responsavel IS NULL OR t.responsavel = '')"
+
+    if polo_filter and polo_filter != 'Todos':
+        query += " AND t.polo = ?"
+        params.append(polo_filter)
+    
+    if data_filter:
+        try:
+            # A coluna ISO já está no formato YYYY-MM-DD recebido; apenas valida a data
+            datetime.strptime(data_filter, '%Y-%m-%d')
+            query += " AND t.data_notificacao_iso = ?"
+            params.append(data_filter)
+        except ValueError:
+            # Ignora o filtro se a data for inválida
+            app.logger.warning(f"Formato de data inválido recebido no filtro: {data_filter}")
+
+
+    query += " ORDER BY t.data_notificacao_iso DESC, t.NPJ"
+    return query, params
+
+def verificar_plano(db, query, params, indices_aceitos):
+    """Retorna a lista de problemas do plano da consulta: varreduras completas ou índice fora do esperado."""
+    plano = [row['detail'] for row in db.execute(f"EXPLAIN QUERY PLAN {query}", params).fetchall()]
+    problemas = [f"varredura completa: {passo}" for passo in plano if passo.startswith('SCAN') and 'USING' not in passo]
+    if not any(indice in passo for passo in plano for indice in indices_aceitos):
+        problemas.append(f"nenhum dos índices {indices_aceitos} foi usado: {plano}")
+    return problemas
+
 def table_has_column(db, table_name, column_name):
     cursor = db.cursor()
     cursor.execute(f"PRAGMA table_info({table_name})")
@@ -185,7 +284,7 @@ def conciliar_planilha():
             
             # CORREÇÃO: Remove a restrição de status para conciliar qualquer notificação correspondente
             cursor.execute("""
-                UPDATE notificacoes 
+                UPDATE tarefas 
                 SET status = 'Tratada', 
                     responsavel = 'Conciliado', 
                     data_processamento = ?
@@ -196,7 +295,7 @@ def conciliar_planilha():
                 atualizados += 1
 
         db.commit()
-        return jsonify({'message': f'{atualizados} notificações correspondentes foram marcadas como "Tratada".'}), 200
+        return jsonify({'message': f'{atualizados} tarefas correspondentes foram marcadas como "Tratada".'}), 200
 
     except Exception as e:
         app.logger.error(f"Erro ao conciliar planilha: {e}")
@@ -274,18 +373,16 @@ def get_legalone_tasks():
 @app.route('/api/stats')
 def get_stats():
     db = get_db()
+    contagens = {
+        row['status']: row['total']
+        for row in db.execute(CONSULTA_STATS).fetchall()
+    }
     stats = {}
     statuses = {'pendente': 'Pendente', 'processado': 'Processado', 'arquivado': 'Arquivado', 'tratada': 'Tratada', 'migrado': 'Migrado'}
     for key, status_val in statuses.items():
-        count = db.execute(
-            "SELECT COUNT(DISTINCT NPJ || data_notificacao) FROM notificacoes WHERE status = ?", (status_val,)
-        ).fetchone()[0]
-        stats[key] = count
+        stats[key] = contagens.get(status_val, 0)
     
-    erro_count = db.execute(
-        "SELECT COUNT(DISTINCT NPJ || data_notificacao) FROM notificacoes WHERE status LIKE 'Erro%'"
-    ).fetchone()[0]
-    stats['erro'] = erro_count
+    stats['erro'] = sum(total for status, total in contagens.items() if status.startswith('Erro'))
     
     return jsonify(stats)
 
@@ -297,51 +394,7 @@ def get_notificacoes():
     data_filter = request.args.get('data') # Recebe a data no formato YYYY-MM-DD
     db = get_db()
     
-    params = []
-    
-    if status_filter == 'Erro':
-        query_status = "WHERE status LIKE 'Erro%'"
-    else:
-        query_status = "WHERE status = ?"
-        params.append(status_filter)
-
-    gerou_tarefa_select = "MAX(gerou_tarefa) as gerou_tarefa," if table_has_column(db, "notificacoes", "gerou_tarefa") else ""
-
-    query = f"""
-        SELECT
-            NPJ, data_notificacao, MAX(adverso_principal) as adverso_principal,
-            MAX(numero_processo) as numero_processo, MAX(polo) as polo,
-            GROUP_CONCAT(id, ';') as ids,
-            GROUP_CONCAT(tipo_notificacao, '; ') as tipos_notificacao, MAX(responsavel) as responsavel,
-            MAX(data_processamento) as data_processamento, MAX(detalhes_erro) as detalhes_erro,
-            {gerou_tarefa_select}
-            status
-        FROM notificacoes {query_status}
-    """
-    
-    if responsavel_filter and responsavel_filter != 'Todos':
-        query += " AND responsavel = ?"
-        params.append(responsavel_filter)
-    elif responsavel_filter == 'Sem Responsável':
-        query += " AND (responsavel IS NULL OR responsavel = '')"
-
-    if polo_filter and polo_filter != 'Todos':
-        query += " AND polo = ?"
-        params.append(polo_filter)
-    
-    if data_filter:
-        try:
-            # Converte YYYY-MM-DD para DD/MM/YYYY
-            formatted_date = datetime.strptime(data_filter, '%Y-%m-%d').strftime('%d/%m/%Y')
-            query += " AND data_notificacao = ?"
-            params.append(formatted_date)
-        except ValueError:
-            # Ignora o filtro se a data for inválida
-            app.logger.warning(f"Formato de data inválido recebido no filtro: {data_filter}")
-
-
-    query += " GROUP BY NPJ, data_notificacao ORDER BY data_notificacao DESC, NPJ"
-
+    query, params = montar_consulta_notificacoes(status_filter, responsavel_filter, polo_filter, data_filter)
     notificacoes_raw = db.execute(query, params).fetchall()
     notificacoes = [dict(row) for row in notificacoes_raw]
     return jsonify(notificacoes)
@@ -355,17 +408,32 @@ def get_detalhes():
         return jsonify({"error": "NPJ e data são obrigatórios"}), 400
 
     db = get_db()
-    detalhes = db.execute(
-        "SELECT MAX(andamentos) as andamentos, MAX(documentos) as documentos FROM notificacoes WHERE NPJ = ? AND data_notificacao = ?",
+    tarefa = db.execute(
+        "SELECT id FROM tarefas WHERE NPJ = ? AND data_notificacao = ?",
         (npj, data)
     ).fetchone()
-    
-    if detalhes and (detalhes['andamentos'] or detalhes['documentos']):
-        return jsonify({
-            'andamentos': json.loads(detalhes['andamentos'] or '[]'),
-            'documentos': json.loads(detalhes['documentos'] or '[]')
-        })
-    return jsonify({'andamentos': [], 'documentos': []})
+    if not tarefa:
+        return jsonify({'andamentos': [], 'documentos': []})
+
+    andamentos = db.execute(
+        "SELECT data, descricao, detalhes, comprimido FROM andamentos WHERE tarefa_id = ? ORDER BY ordem",
+        (tarefa['id'],)
+    ).fetchall()
+    documentos = db.execute(
+        "SELECT nome, caminho FROM documentos WHERE tarefa_id = ? ORDER BY ordem",
+        (tarefa['id'],)
+    ).fetchall()
+    return jsonify({
+        'andamentos': [
+            {
+                'data': a['data'], 'descricao': a['descricao'],
+                # Textos longos de publicação são gravados pela RPA comprimidos com zlib
+                'detalhes': zlib.decompress(a['detalhes']).decode('utf-8') if a['comprimido'] else a['detalhes']
+            }
+            for a in andamentos
+        ],
+        'documentos': [dict(d) for d in documentos]
+    })
 
 @app.route('/api/download')
 def download_file():
@@ -392,13 +460,15 @@ def update_status():
     
     db = get_db()
     placeholders = ', '.join(['?'] * len(ids))
+    # O painel envia os ids das notificações; o status pertence às tarefas a que elas estão vinculadas.
+    filtro_tarefas = f"id IN (SELECT tarefa_id FROM notificacoes WHERE id IN ({placeholders}))"
 
     if novo_status == 'Tratada' and gerou_tarefa is not None:
         params = [novo_status, gerou_tarefa] + ids
-        db.execute(f"UPDATE notificacoes SET status = ?, gerou_tarefa = ? WHERE id IN ({placeholders})", params)
+        db.execute(f"UPDATE tarefas SET status = ?, gerou_tarefa = ? WHERE {filtro_tarefas}", params)
     else:
         params = [novo_status] + ids
-        db.execute(f"UPDATE notificacoes SET status = ? WHERE id IN ({placeholders})", params)
+        db.execute(f"UPDATE tarefas SET status = ? WHERE {filtro_tarefas}", params)
         
     db.commit()
     return jsonify({'message': f'{len(ids)} notificações atualizadas para {novo_status}'})
@@ -0,0 +1,125 @@
+import logging
+import threading
+from typing import Dict
+from urllib.parse import urlsplit
+from config import BLOQUEIO_RECURSOS
+
+# --- Bloqueio de recursos não essenciais ---
+# Imagens, fontes, mídia e scripts de analytics das páginas do portal nunca são usados pelo robô, mas
+# atrasam cada navegação e aumentam a memória do Chrome em sessões longas. A política é instalada no
+# contexto via 'context.route' (login e contextos criados na FASE 3). Com BLOQUEIO_RECURSOS['medir'],
+# nada é bloqueado: o robô apenas registra, por navegação, quantos bytes e ms seriam economizados.
+# Obs.: com uma rota ativa o Playwright desliga o cache HTTP do contexto; avalie com o modo de medição.
+
+# Navegações e downloads nunca são bloqueados, independentemente da configuração.
+TIPOS_SEMPRE_PERMITIDOS = ('document',)
+
+def _dominio_na_lista(host: str, dominios) -> bool:
+    return any(host == dominio or host.endswith(f".{dominio}") for dominio in dominios)
+
+def deve_bloquear(url: str, tipo_recurso: str) -> bool:
+    """Aplica a política de BLOQUEIO_RECURSOS a uma requisição (URL + resource_type do Playwright)."""
+    if tipo_recurso in TIPOS_SEMPRE_PERMITIDOS:
+        return False
+    host = (urlsplit(url).hostname or '').lower()
+    if _dominio_na_lista(host, BLOQUEIO_RECURSOS['dominios_permitidos']):
+        return False
+    if _dominio_na_lista(host, BLOQUEIO_RECURSOS['dominios_bloqueados']):
+        return True
+    if BLOQUEIO_RECURSOS['tipos_permitidos']:
+        return tipo_recurso not in BLOQUEIO_RECURSOS['tipos_permitidos']
+    return tipo_recurso in BLOQUEIO_RECURSOS['tipos_bloqueados']
+
+class _MedicaoPorNavegacao:
+    """Soma, por aba, os bytes e o tempo de rede das requisições que a política bloquearia."""
+
+    def __init__(self):
+        self.totais: Dict[int, Dict] = {}
+        self.trava = threading.Lock()
+
+    def somar(self, page, tamanho_bytes: int, duracao_ms: float):
+        with self.trava:
+            total = self.totais.setdefault(id(page), {"url": page.url, "requisicoes": 0, "bytes": 0, "ms": 0.0})
+            total["requisicoes"] += 1
+            total["bytes"] += max(tamanho_bytes, 0)
+            total["ms"] += max(duracao_ms, 0)
+
+    def relatar(self, page):
+        """Registra o total da navegação anterior da aba e recomeça a contagem."""
+        with self.trava:
+            total = self.totais.pop(id(page), None)
+        if total and total["requisicoes"]:
+            logging.info(
+                f"      - [RECURSOS] {total['requisicoes']} requisição(ões) bloqueáveis em {total['url']}: "
+                f"{total['bytes'] / 1024:.0f} KB e {total['ms']:.0f} ms de rede economizáveis."
+            )
+
+def _duracao_ms(request) -> float:
+    """Tempo até o fim da resposta, em ms desde o início da requisição (-1 quando indisponível)."""
+    return max(request.timing.get('responseEnd', -1), 0)
+
+def instalar_politica_de_recursos(context):
+    """Instala a política de bloqueio (ou a medição) em um BrowserContext da API síncrona."""
+    if not BLOQUEIO_RECURSOS['ativo']:
+        return
+    if not BLOQUEIO_RECURSOS['medir']:
+        def rotear(route):
+            if deve_bloquear(route.request.url, route.request.resource_type):
+                route.abort()
+            else:
+                route.continue_()
+        context.route("**/*", rotear)
+        return
+
+    medicao = _MedicaoPorNavegacao()
+
+    def ao_finalizar(request):
+        if not deve_bloquear(request.url, request.resource_type):
+            return
+        try:
+            page = request.frame.page
+            medicao.somar(page, request.sizes()['responseBodySize'], _duracao_ms(request))
+        except Exception:
+            return # Requisições de service worker não têm frame/página
+
+    def ao_criar_pagina(page):
+        page.on("framenavigated", lambda frame: medicao.relatar(page) if frame == page.main_frame else None)
+        page.on("close", medicao.relatar)
+
+    context.on("requestfinished", ao_finalizar)
+    context.on("page", ao_criar_pagina)
+    for page in context.pages:
+        ao_criar_pagina(page)
+
+async def instalar_politica_de_recursos_async(context):
+    """Equivalente a 'instalar_politica_de_recursos' para contextos da playwright.async_api."""
+    if not BLOQUEIO_RECURSOS['ativo']:
+        return
+    if not BLOQUEIO_RECURSOS['medir']:
+        async def rotear(route):
+            if deve_bloquear(route.request.url, route.request.resource_type):
+                await route.abort()
+            else:
+                await route.continue_()
+        await context.route("**/*", rotear)
+        return
+
+    medicao = _MedicaoPorNavegacao()
+
+    async def ao_finalizar(request):
+        if not deve_bloquear(request.url, request.resource_type):
+            return
+        try:
+            page = request.frame.page
+            medicao.somar(page, (await request.sizes())['responseBodySize'], _duracao_ms(request))
+        except Exception:
+            return
+
+    def ao_criar_pagina(page):
+        page.on("framenavigated", lambda frame: medicao.relatar(page) if frame == page.main_frame else None)
+        page.on("close", medicao.relatar)
+
+    context.on("requestfinished", ao_finalizar)
+    context.on("page", ao_criar_pagina)
+    for page in context.pages:
+        ao_criar_pagina(page)
@@ -1,12 +1,132 @@
 import logging
+import queue
 import re
+import threading
+import time
+from collections import Counter
+from contextlib import contextmanager
 from typing import List, Dict, Any, Optional
-from playwright.sync_api import Page, BrowserContext, Error, TimeoutError
+from playwright.sync_api import sync_playwright, Page, BrowserContext, Error, TimeoutError
 from datetime import datetime, timedelta
 import database
 from pathlib import Path
+from autologin import CDP_ENDPOINT
+from conexao import fechar_conexao
+from armazem_documentos import armazenar, documento_ja_armazenado
+from captura_xhr import CapturaXHR, andamentos_do_json, documentos_do_json, processo_do_json
+from config import CAPTURA_XHR, DOWNLOADS_DIRETOS, ORCAMENTO_ETAPAS_MS, PAGINAS_PARALELAS
+from downloads import GerenciadorDownloads
+from politica_recursos import instalar_politica_de_recursos
 from session import SessionExpiredError
 
+def calcular_datas_permitidas(data_notificacao_recente: str, is_migracao: bool) -> set:
+    """Retorna as datas aceitas para andamentos e documentos: 3 dias até a notificação (7 em migração)."""
+    data_base = datetime.strptime(data_notificacao_recente, '%d/%m/%Y').date()
+    dias_a_buscar = 7 if is_migracao else 3
+    return {data_base - timedelta(days=i) for i in range(dias_a_buscar)}
+
+def montar_url_detalhe(npj: str) -> tuple[str, str]:
+    """Monta a URL da página de detalhes do NPJ. Retorna (url, NPJ no formato exibido no chip da página)."""
+    match = re.match(r"(\d+)/(\d+)-(\d+)", npj)
+    if not match:
+        raise ValueError(f"Formato de NPJ inválido: {npj}")
+    ano, numero, _ = match.groups()
+    id_processo_url = f"{ano}{numero.zfill(7)}"
+    
+    url_final = f"https://juridico.bb.com.br/paj/app/paj-cadastro/spas/processo/consulta/processo-consulta.app.html#/editar/{id_processo_url}/0/1"
+    return url_final, f"{ano}/{numero}-000"
+
+def diretorio_documentos_npj(npj: str) -> Path:
+    """Retorna (criando, se preciso) a pasta de documentos baixados do NPJ."""
+    nome_pasta_npj = re.sub(r'[\\/*?:"<>|]', '_', npj)
+    diretorio_download_npj = Path(__file__).resolve().parent / "documentos" / nome_pasta_npj
+    diretorio_download_npj.mkdir(parents=True, exist_ok=True)
+    return diretorio_download_npj
+
+def classificar_erro(e: Exception) -> str:
+    """Classifica um erro conhecido de automação/portal como 'permanente' ou 'portal' (retentável)."""
+    erro_str = str(e).lower()
+    if "processo nao localizado" in erro_str or "formato de npj inválido" in erro_str:
+        return 'permanente'
+    return 'portal'
+
+# Lê, em uma única ida ao navegador, data, descrição e presença do botão de publicação de cada linha de andamento.
+JS_LINHAS_ANDAMENTOS = """
+linhas => linhas.map(tr => {
+    const celulas = tr.querySelectorAll('td');
+    return {
+        data: celulas.length > 4 ? celulas[4].innerText.trim() : '',
+        descricao: celulas.length > 1 ? celulas[1].innerText.trim() : '',
+        tem_publicacao: tr.querySelector('a[bb-tooltip="Detalhar publicação"]') !== null
+    };
+})
+"""
+
+# Idem para a tabela de documentos (layouts "DOCUMENTOS" aninhado e "Documentos" simples): data, nome e link de cada linha.
+JS_LINHAS_DOCUMENTOS = """
+linhas => linhas.map(tr => {
+    const celulas = tr.querySelectorAll('td');
+    const link = celulas.length > 1 ? celulas[1].querySelector('a') : null;
+    const href = link ? (link.getAttribute('href') || '') : '';
+    return {
+        data: celulas.length > 4 ? celulas[4].innerText.trim() : '',
+        nome: link ? link.innerText.trim() : '',
+        tem_link: link !== null,
+        // URL própria do arquivo (para download direto); links acionados só por script não têm
+        url: href && href !== '#' && !href.startsWith('javascript:') ? link.href : null
+    };
+})
+"""
+
+def filtrar_linhas_por_data(linhas: List[Dict[str, Any]], datas_permitidas: set) -> List[tuple[int, Dict[str, Any]]]:
+    """Retorna (índice, linha) das linhas lidas em lote cuja 'data' (dd/mm/YYYY) está na janela permitida."""
+    na_janela = []
+    for indice, linha in enumerate(linhas):
+        try:
+            if datetime.strptime(linha['data'], '%d/%m/%Y').date() in datas_permitidas:
+                na_janela.append((indice, linha))
+        except ValueError:
+            logging.warning(f"      - Data inválida na linha {indice + 1} da tabela: '{linha['data']}'")
+    return na_janela
+
+# --- Orçamento de tempo por etapa ---
+_estouros_de_etapas: Counter = Counter()
+_trava_estouros = threading.Lock()
+
+@contextmanager
+def medir_etapa(nome: str, npj: str):
+    """Mede uma etapa do detalhamento e registra no log quando ela passa do orçamento em ORCAMENTO_ETAPAS_MS."""
+    inicio = time.monotonic()
+    try:
+        yield
+    finally:
+        decorrido_ms = int((time.monotonic() - inicio) * 1000)
+        orcamento_ms = ORCAMENTO_ETAPAS_MS.get(nome)
+        if orcamento_ms and decorrido_ms > orcamento_ms:
+            logging.warning(f"      - [ORÇAMENTO] Etapa '{nome}' do NPJ {npj} levou {decorrido_ms} ms (orçamento: {orcamento_ms} ms).")
+            with _trava_estouros:
+                _estouros_de_etapas[nome] += 1
+
+def registrar_resumo_de_estouros():
+    """Registra e zera a contagem de etapas que estouraram o orçamento desde o último resumo."""
+    with _trava_estouros:
+        resumo = dict(_estouros_de_etapas)
+        _estouros_de_etapas.clear()
+    if resumo:
+        logging.warning(f"Etapas acima do orçamento neste lote: {resumo}")
+
+def expandir_secao(titulo, nome_secao: str, npj: str):
+    """Abre um accordion fechado e aguarda o ícone trocar de estado (sem pausa fixa)."""
+    if 'mi--keyboard-arrow-down' not in (titulo.locator('i').get_attribute('class') or ''):
+        return
+    logging.info(f"      - Seção '{nome_secao}' está fechada, clicando para expandir.")
+    with medir_etapa('expandir_secao', npj):
+        titulo.click()
+        try:
+            titulo.locator('i.mi--keyboard-arrow-down').wait_for(state='detached', timeout=ORCAMENTO_ETAPAS_MS['expandir_secao'])
+        except TimeoutError:
+            pass # O estouro é registrado por medir_etapa; a espera pela tabela decide se a seção abriu.
+
 def extrair_numero_processo(page: Page) -> Optional[str]:
     """Extrai o número do processo da página de detalhes."""
     try:
@@ -35,8 +155,11 @@ def extrair_polo(page: Page) -> Optional[str]:
         logging.warning(f"      - Erro ao tentar extrair o Polo: {e}")
     return None
 
-def extrair_andamentos(page: Page, data_notificacao_recente: str, is_migracao: bool) -> List[Dict[str, str]]:
-    """Clica no menu 'Andamentos' (seja aba ou accordion), filtra por data e extrai os dados."""
+def extrair_andamentos(page: Page, data_notificacao_recente: str, is_migracao: bool, npj: str) -> List[Dict[str, str]]:
+    """
+    Clica no menu 'Andamentos' (seja aba ou accordion), filtra por data e extrai os dados.
+    Publicações já detalhadas em visitas anteriores ao NPJ vêm do cache, sem reabrir o modal.
+    """
     andamentos = []
     try:
         logging.info("      - Procurando pela seção 'Andamentos'...")
@@ -45,11 +168,7 @@ def extrair_andamentos(page: Page, data_notificacao_recente: str, is_migracao: b
         
         if secao_andamentos_accordion.count() > 0:
             logging.info("      - Layout de Accordion detectado para Andamentos.")
-            andamentos_title = secao_andamentos_accordion.locator(".accordion__title").first
-            if 'mi--keyboard-arrow-down' in (andamentos_title.locator('i').get_attribute('class') or ''):
-                logging.info("      - Seção 'Andamentos' está fechada, clicando para expandir.")
-                andamentos_title.click()
-                page.wait_for_timeout(1000)
+            expandir_secao(secao_andamentos_accordion.locator(".accordion__title").first, 'Andamentos', npj)
         else:
             logging.info("      - Layout de Abas detectado para Andamentos.")
             page.locator('li:has-text("Andamentos")').click(timeout=10000)
@@ -66,65 +185,71 @@ def extrair_andamentos(page: Page, data_notificacao_recente: str, is_migracao: b
             logging.info("      - Nenhuma linha de andamento encontrada na tabela após espera.")
             return []
 
-        data_base = datetime.strptime(data_notificacao_recente, '%d/%m/%Y').date()
-        
-        dias_a_buscar = 7 if is_migracao else 3
-        datas_permitidas = { data_base - timedelta(days=i) for i in range(dias_a_buscar) }
+        datas_permitidas = calcular_datas_permitidas(data_notificacao_recente, is_migracao)
         
         if is_migracao:
-            logging.info(f"      - [MIGRAÇÃO] Filtrando andamentos para os últimos {dias_a_buscar} dias.")
+            logging.info(f"      - [MIGRAÇÃO] Filtrando andamentos para os últimos {len(datas_permitidas)} dias.")
         
         logging.info(f"      - Filtrando andamentos para as datas: {[d.strftime('%d/%m/%Y') for d in sorted(list(datas_permitidas))]}")
 
-        linhas = page.locator(primeira_linha_selector).all()
-        logging.info(f"      - Encontradas {len(linhas)} linhas de andamento para verificação.")
+        linhas_locator = page.locator(primeira_linha_selector)
+        linhas = linhas_locator.evaluate_all(JS_LINHAS_ANDAMENTOS)
+        cache = database.buscar_andamentos_em_cache(npj)
+        publicacoes_novas = []
+        ocorrencias_no_dia = Counter() # Posição de cada (data, descrição) no dia: separa publicações idênticas no cache.
+        linhas_na_janela = filtrar_linhas_por_data(linhas, datas_permitidas)
+        logging.info(f"      - Encontradas {len(linhas)} linhas de andamento; {len(linhas_na_janela)} dentro do período.")
 
-        for linha in linhas:
+        for indice, linha in linhas_na_janela:
             try:
-                data_andamento_str = (linha.locator('td').nth(4).inner_text(timeout=2000)).strip()
-                data_andamento = datetime.strptime(data_andamento_str, '%d/%m/%Y').date()
-
-                if data_andamento not in datas_permitidas:
-                    continue 
-
-                logging.info(f"      - Processando andamento de {data_andamento_str} (data válida).")
-                descricao = (linha.locator('td').nth(1).inner_text()).strip()
+                data_andamento_str = linha['data']
+                descricao = linha['descricao']
                 detalhes = descricao
+                chave_cache = (data_andamento_str, descricao, ocorrencias_no_dia[(data_andamento_str, descricao)])
+                ocorrencias_no_dia[(data_andamento_str, descricao)] += 1
+                logging.info(f"      - Processando andamento de {data_andamento_str} (data válida).")
 
-                if "PUBLICACAO DJ/DO" in descricao.upper():
-                    botao_detalhar = linha.locator('a[bb-tooltip="Detalhar publicação"]')
-                    
-                    if botao_detalhar.count() > 0:
-                        logging.info("         - Andamento de publicação encontrado. Abrindo modal de detalhes...")
-                        botao_detalhar.click()
+                # Só as linhas de publicação dentro da janela voltam a ser tocadas pelo Playwright (abertura do modal).
+                if "PUBLICACAO DJ/DO" in descricao.upper() and linha['tem_publicacao'] and chave_cache in cache:
+                    logging.info("         - Publicação já detalhada em visita anterior; usando o texto do cache.")
+                    detalhes = cache[chave_cache]
+                elif "PUBLICACAO DJ/DO" in descricao.upper() and linha['tem_publicacao']:
+                    logging.info("         - Andamento de publicação encontrado. Abrindo modal de detalhes...")
+                    with medir_etapa('modal_publicacao', npj):
+                        linhas_locator.nth(indice).locator('a[bb-tooltip="Detalhar publicação"]').click()
                         modal_selector = 'div.modal__data'
                         page.wait_for_selector(modal_selector, state='visible', timeout=10000)
-                        
+
+                        texto_completo_selector = page.locator(f'{modal_selector} texto-grande-detalhar')
                         leia_mais_btn = page.locator(f'{modal_selector} button:has-text("Leia mais")')
                         if leia_mais_btn.count() > 0:
                             logging.info("         - Botão 'Leia mais' encontrado. Expandindo texto...")
                             leia_mais_btn.click(timeout=5000)
-                            page.wait_for_timeout(500)
-
-                        texto_completo_selector = page.locator(f'{modal_selector} texto-grande-detalhar')
+                        texto_completo_selector.wait_for(state='attached', timeout=5000)
                         detalhes = texto_completo_selector.get_attribute('conteudo-texto') or ""
-                        
+
                         page.keyboard.press("Escape")
                         page.wait_for_selector(modal_selector, state='hidden', timeout=5000)
-                        logging.info("         - Modal de publicação fechado com sucesso.")
+                    logging.info("         - Modal de publicação fechado com sucesso.")
+                    publicacoes_novas.append({"data": data_andamento_str, "descricao": descricao, "ordem": chave_cache[2], "detalhes": detalhes})
                 
                 andamentos.append({"data": data_andamento_str, "descricao": descricao, "detalhes": detalhes})
-            except (Error, IndexError, ValueError) as e:
+            except Error as e:
                 logging.warning(f"      - Erro ao processar uma linha de andamento: {e}")
                 continue
         logging.info(f"      - {len(andamentos)} andamento(s) capturado(s) dentro do período de datas.")
+        database.salvar_andamentos_em_cache(npj, publicacoes_novas)
     except Error as e:
         logging.warning(f"      - Erro inesperado ao extrair andamentos: {e}")
         raise
     return andamentos
 
-def baixar_documentos(page: Page, data_notificacao_recente: str, npj: str, is_migracao: bool) -> List[Dict[str, str]]:
-    """Expande as seções de documentos (seja qual for o layout), filtra pela data e baixa os arquivos."""
+def baixar_documentos(page: Page, data_notificacao_recente: str, npj: str, is_migracao: bool, documentos_diretos: Optional[list] = None) -> List[Dict[str, str]]:
+    """
+    Expande as seções de documentos (seja qual for o layout), filtra pela data e baixa os arquivos.
+    Se 'documentos_diretos' for informado, os documentos com URL própria são apenas adicionados a ela
+    ({nome, url}) para download direto, e só os demais são baixados pelo clique.
+    """
     documentos_baixados = []
     try:
         logging.info("      - Procurando e expandindo seções de documentos...")
@@ -137,44 +262,27 @@ def baixar_documentos(page: Page, data_notificacao_recente: str, npj: str, is_mi
         if page.locator(seletor_layout_novo).count() > 0:
             logging.info("      - Layout Novo (aninhado) de documentos detectado.")
             secao_container = page.locator(seletor_layout_novo)
-            titulo_principal = secao_container.locator('.accordion__title').first
-            if 'mi--keyboard-arrow-down' in (titulo_principal.locator('i').get_attribute('class') or ''):
-                  logging.info("      - Seção principal 'DOCUMENTOS' está fechada, clicando para expandir.")
-                  titulo_principal.click()
-                  page.wait_for_timeout(1000)
+            expandir_secao(secao_container.locator('.accordion__title').first, 'DOCUMENTOS', npj)
 
             sub_secao = secao_container.locator(seletor_layout_antigo)
             if sub_secao.count() > 0:
-                titulo_sub_secao = sub_secao.locator('.accordion__title').first
-                if 'mi--keyboard-arrow-down' in (titulo_sub_secao.locator('i').get_attribute('class') or ''):
-                    logging.info("      - Sub-seção 'Documentos' está fechada, clicando para expandir.")
-                    titulo_sub_secao.click()
-                    page.wait_for_timeout(1000)
+                expandir_secao(sub_secao.locator('.accordion__title').first, 'Documentos (sub-seção)', npj)
 
         elif page.locator(seletor_layout_antigo).count() > 0:
             logging.info("      - Layout Antigo (simples) de documentos detectado.")
             secao_container = page.locator(seletor_layout_antigo)
-            titulo_secao = secao_container.locator('.accordion__title').first
-            if 'mi--keyboard-arrow-down' in (titulo_secao.locator('i').get_attribute('class') or ''):
-                logging.info("      - Seção 'Documentos' está fechada, clicando para expandir.")
-                titulo_secao.click()
-                page.wait_for_timeout(1000)
+            expandir_secao(secao_container.locator('.accordion__title').first, 'Documentos', npj)
         
         if not secao_container:
             logging.info("      - Nenhuma seção de documentos encontrada para este NPJ. Pulando a etapa de download.")
             return []
 
-        nome_pasta_npj = re.sub(r'[\\/*?:"<>|]', '_', npj)
-        diretorio_download_npj = Path(__file__).resolve().parent / "documentos" / nome_pasta_npj
-        diretorio_download_npj.mkdir(parents=True, exist_ok=True)
-        
-        data_base = datetime.strptime(data_notificacao_recente, '%d/%m/%Y').date()
+        diretorio_download_npj = diretorio_documentos_npj(npj)
         
-        dias_a_buscar = 7 if is_migracao else 3
-        datas_permitidas = {data_base - timedelta(days=i) for i in range(dias_a_buscar)}
+        datas_permitidas = calcular_datas_permitidas(data_notificacao_recente, is_migracao)
 
         if is_migracao:
-            logging.info(f"      - [MIGRAÇÃO] Filtrando documentos para os últimos {dias_a_buscar} dias.")
+            logging.info(f"      - [MIGRAÇÃO] Filtrando documentos para os últimos {len(datas_permitidas)} dias.")
         
         logging.info(f"      - Filtrando documentos para as datas: {[d.strftime('%d/%m/%Y') for d in sorted(list(datas_permitidas))]}")
 
@@ -182,78 +290,72 @@ def baixar_documentos(page: Page, data_notificacao_recente: str, npj: str, is_mi
         tabela_documentos = secao_container.locator(tabela_selector)
         tabela_documentos.wait_for(state='visible', timeout=45000)
         
-        linhas_documentos = tabela_documentos.locator('tbody tr').all()
-        logging.info(f"      - Encontrados {len(linhas_documentos)} documentos para verificação.")
+        linhas_locator = tabela_documentos.locator('tbody tr')
+        linhas = linhas_locator.evaluate_all(JS_LINHAS_DOCUMENTOS)
+        linhas_na_janela = filtrar_linhas_por_data(linhas, datas_permitidas)
+        logging.info(f"      - Encontrados {len(linhas)} documentos; {len(linhas_na_janela)} dentro do período.")
 
-        for linha in linhas_documentos:
-            try:
-                data_doc_str = (linha.locator('td').nth(4).inner_text(timeout=2000)).strip()
-                data_doc = datetime.strptime(data_doc_str, '%d/%m/%Y').date()
-
-                if data_doc not in datas_permitidas:
-                    continue
-
-                link_locator = linha.locator('td').nth(1).locator('a')
-                if link_locator.count() > 0:
-                    nome_arquivo = (link_locator.inner_text()).strip()
-                    logging.info(f"         - Documento encontrado na data permitida '{data_doc_str}': {nome_arquivo}")
-                    
-                    try:
-                        with page.expect_download(timeout=15000) as download_info:
-                            link_locator.click()
-                        
-                        download = download_info.value
-                        caminho_salvo = diretorio_download_npj / download.suggested_filename
-                        download.save_as(caminho_salvo)
-                        
-                        documentos_baixados.append({"nome": nome_arquivo, "caminho": str(caminho_salvo)})
-                        logging.info(f"         - Download concluído: {caminho_salvo}")
-
-                    except Error:
-                        if "GED indisponível" in page.content():
-                            logging.error(f"         - ERRO DE PORTAL: GED indisponível para o arquivo '{nome_arquivo}'.")
-                            page.go_back(wait_until="networkidle")
-                            raise ValueError("GED indisponível")
-                        else:
-                            logging.warning(f"         - Timeout ou outra falha no download do arquivo '{nome_arquivo}'.")
-            
-            except (Error, IndexError, ValueError) as e:
-                if "GED indisponível" in str(e):
-                    raise e
-                logging.warning(f"      - Erro ao processar uma linha de documento: {e}")
+        for indice, linha in linhas_na_janela:
+            if not linha['tem_link']:
+                continue
+            nome_arquivo = linha['nome']
+            logging.info(f"         - Documento encontrado na data permitida '{linha['data']}': {nome_arquivo}")
+            caminho_existente = documento_ja_armazenado(npj, nome_arquivo, linha['data'])
+            if caminho_existente:
+                logging.info(f"         - Documento já baixado anteriormente; reaproveitando {caminho_existente}")
+                documentos_baixados.append({"nome": nome_arquivo, "caminho": caminho_existente})
+                continue
+            if documentos_diretos is not None and linha['url']:
+                documentos_diretos.append({"nome": nome_arquivo, "url": linha['url'], "data": linha['data']})
                 continue
+            
+            try:
+                with page.expect_download(timeout=15000) as download_info:
+                    linhas_locator.nth(indice).locator('td').nth(1).locator('a').click()
+                
+                download = download_info.value
+                caminho_salvo = diretorio_download_npj / download.suggested_filename
+                # O caminho pode ser um hard link para um blob do armazém: 'save_as' reescreveria o blob no lugar.
+                caminho_salvo.unlink(missing_ok=True)
+                download.save_as(caminho_salvo)
+                caminho_salvo = armazenar(caminho_salvo, npj, nome_arquivo, linha['data'])
+                
+                documentos_baixados.append({"nome": nome_arquivo, "caminho": str(caminho_salvo)})
+                logging.info(f"         - Download concluído: {caminho_salvo}")
+
+            except Error:
+                if "GED indisponível" in page.content():
+                    logging.error(f"         - ERRO DE PORTAL: GED indisponível para o arquivo '{nome_arquivo}'.")
+                    page.go_back(wait_until="domcontentloaded")
+                    raise ValueError("GED indisponível")
+                else:
+                    logging.warning(f"         - Timeout ou outra falha no download do arquivo '{nome_arquivo}'.")
                 
     except Error as e:
         logging.warning(f"      - Ocorreu um erro geral ao processar documentos: {e}")
         raise
     
-    # Adiciona a espera pelo loader antes de finalizar a função
+    # Espera o loader apenas se ele estiver ativo, e só até o orçamento da etapa
     finally:
-        logging.info("      - Verificando se o loader da página está ativo antes de prosseguir...")
-        try:
-            page.locator('plt-carregando div.loader.is-loading').wait_for(state='hidden', timeout=20000)
-            logging.info("      - Loader desapareceu. Prosseguindo...")
-        except TimeoutError:
-            logging.warning("      - O loader não desapareceu no tempo esperado, mas a execução continuará.")
+        loader = page.locator('plt-carregando div.loader.is-loading')
+        if loader.count() > 0:
+            with medir_etapa('loader', npj):
+                try:
+                    loader.wait_for(state='hidden', timeout=ORCAMENTO_ETAPAS_MS['loader'])
+                except TimeoutError:
+                    logging.warning("      - O loader não desapareceu dentro do orçamento; a execução continuará.")
 
     return documentos_baixados
 
 def navegar_para_detalhes_do_npj(page: Page, npj: str):
     """Navega diretamente para a página de detalhes do NPJ e garante que o conteúdo esteja sincronizado."""
     logging.info(f"    - Construindo URL de detalhe para o NPJ: {npj}")
-    
-    match = re.match(r"(\d+)/(\d+)-(\d+)", npj)
-    if not match:
-        raise ValueError(f"Formato de NPJ inválido: {npj}")
-    ano, numero, _ = match.groups()
-    id_processo_url = f"{ano}{numero.zfill(7)}"
-    
-    url_final = f"https://juridico.bb.com.br/paj/app/paj-cadastro/spas/processo/consulta/processo-consulta.app.html#/editar/{id_processo_url}/0/1"
+    url_final, npj_formatado = montar_url_detalhe(npj)
     
     logging.info(f"    - Navegando para a URL de detalhe...")
-    page.goto(url_final, wait_until="networkidle", timeout=60000)
+    # O chip do NPJ abaixo é o sinal de página pronta; não é preciso esperar a rede ficar ociosa.
+    page.goto(url_final, wait_until="domcontentloaded", timeout=60000)
     
-    npj_formatado = f"{ano}/{numero}-000"
     chip_npj_selector = f'div[bb-title="NPJ"] span.chip__desc:has-text("{npj_formatado}")'
     page.wait_for_selector(chip_npj_selector, timeout=30000)
     logging.info("      - Sincronização com a página do NPJ confirmada.")
@@ -261,90 +363,262 @@ def navegar_para_detalhes_do_npj(page: Page, npj: str):
     if page.locator('text=/processo n(ã|a)o localizado/i').count() > 0:
         raise Error(f"Processo {npj} não foi encontrado no portal (página de erro).")
 
-def processar_detalhes_de_lote(context: BrowserContext, lote: List[Dict[str, Any]]) -> Dict[str, int]:
-    """Processa um lote de tarefas (NPJ + data), navegando para a URL de cada um e extraindo os detalhes."""
-    stats = {"sucesso": 0, "falha": 0, "andamentos": 0, "documentos": 0}
-    
-    page = context.new_page()
+def andamentos_via_xhr(linhas: Optional[List[Dict[str, Any]]], data_notificacao_recente: str, is_migracao: bool) -> Optional[List[Dict[str, str]]]:
+    """
+    Filtra os andamentos lidos do JSON pela janela de datas. Retorna None (usar o DOM) se não houver
+    payload ou se alguma publicação da janela vier sem o texto completo.
+    """
+    if linhas is None:
+        return None
+    andamentos = []
+    for _, linha in filtrar_linhas_por_data(linhas, calcular_datas_permitidas(data_notificacao_recente, is_migracao)):
+        if linha['tem_publicacao'] and not linha['detalhes']:
+            logging.info("      - Publicação sem texto completo no JSON; usando a extração pelo DOM.")
+            return None
+        andamentos.append({"data": linha['data'], "descricao": linha['descricao'], "detalhes": linha['detalhes'] or linha['descricao']})
+    logging.info(f"      - {len(andamentos)} andamento(s) lido(s) da resposta XHR.")
+    return andamentos
 
-    for i, tarefa in enumerate(lote):
-        npj = tarefa.get('NPJ')
-        data_notificacao = tarefa.get('data_notificacao')
-        origem = tarefa.get('origem', 'onenotify')
-        data_hora_processamento = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
+def ha_documentos_na_janela_via_xhr(linhas: Optional[List[Dict[str, Any]]], data_notificacao_recente: str, is_migracao: bool) -> bool:
+    """Falso apenas quando o JSON de documentos foi capturado e nenhum documento está na janela de datas."""
+    if linhas is None:
+        return True
+    return bool(filtrar_linhas_por_data(linhas, calcular_datas_permitidas(data_notificacao_recente, is_migracao)))
+
+def _novas_stats() -> Dict[str, int]:
+    return {"sucesso": 0, "falha": 0, "andamentos": 0, "documentos": 0}
+
+def _finalizar_apos_downloads(gerenciador: GerenciadorDownloads, npj: str, data_notificacao: str, numero_processo, andamentos,
+                              documentos_clicados: List[Dict[str, str]], data_hora_processamento: str, status_final: str, polo, resultados: list):
+    """Grava a tarefa quando os downloads diretos dela terminam (executado em uma thread de download)."""
+    if any(resultado['status'] == 'ged_indisponivel' for _, resultado in resultados):
+        detalhes_erro = "Erro de automação ou portal (portal): GED indisponível"
+        logging.error(f"  - ERRO CONHECIDO ao processar NPJ {npj}: {detalhes_erro}")
+        database.marcar_tarefa_como_erro(npj, data_notificacao, detalhes_erro, data_hora_processamento, tipo_erro='portal')
+        gerenciador.contabilizar(falha=1)
+        return
+
+    documentos = documentos_clicados + [
+        {"nome": documento['nome'], "caminho": resultado['caminho']}
+        for documento, resultado in resultados if resultado['status'] == 'ok'
+    ]
+    proximo_responsavel = database.atualizar_notificacoes_processadas(
+        npj, data_notificacao, numero_processo, andamentos, documentos,
+        data_hora_processamento, status=status_final, polo=polo
+    )
+    logging.info(f"SUCESSO: Tarefa {npj} finalizada como '{status_final}' após os downloads e atribuída a {proximo_responsavel or 'Ninguém'}.")
+    gerenciador.contabilizar(sucesso=1, documentos=len(documentos))
+    database.renovar_lease()
+
+def _processar_tarefa(context: BrowserContext, page: Page, tarefa: Dict[str, Any], posicao: int, total: int, stats: Dict[str, int],
+                      gerenciador: Optional[GerenciadorDownloads] = None) -> Page:
+    """
+    Processa uma tarefa (NPJ + data) na página informada. Retorna a página a ser usada na próxima tarefa.
+    Com downloads diretos, a gravação da tarefa fica a cargo do gerenciador de downloads.
+    """
+    npj = tarefa.get('NPJ')
+    data_notificacao = tarefa.get('data_notificacao')
+    origem = tarefa.get('origem', 'onenotify')
+    data_hora_processamento = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
+    
+    if not data_notificacao:
+        logging.error(f"  - [{posicao}/{total}] ERRO DE DADOS: O grupo para o NPJ {npj} foi recebido sem uma data válida. Pulando este item.")
+        motivo = "Dados inconsistentes: Data da notificação não encontrada."
+        database.marcar_tarefa_como_erro(npj, data_notificacao, motivo, data_hora_processamento, tipo_erro='permanente')
+        stats["falha"] += 1
+        return page
+
+    logging.info(f"\n[{posicao}/{total}] Processando Tarefa: {npj} (Data: {data_notificacao}, Origem: {origem})")
+    
+    captura = CapturaXHR(page) if CAPTURA_XHR['ativa'] else None
+    try:
+        with medir_etapa('navegacao', npj):
+            navegar_para_detalhes_do_npj(page, npj)
         
-        if not data_notificacao:
-            logging.error(f"  - [{i+1}/{len(lote)}] ERRO DE DADOS: O grupo para o NPJ {npj} foi recebido sem uma data válida. Pulando este item.")
-            motivo = "Dados inconsistentes: Data da notificação não encontrada."
-            database.marcar_tarefa_como_erro(npj, data_notificacao, motivo, data_hora_processamento, tipo_erro='permanente')
-            stats["falha"] += 1
-            continue
-
-        logging.info(f"\n[{i+1}/{len(lote)}] Processando Tarefa: {npj} (Data: {data_notificacao}, Origem: {origem})")
+        # Com a captura de XHR ativa, cada dado vem do JSON e só recorre ao DOM quando o payload falta.
+        numero_processo, polo = processo_do_json(captura.json('processo')) if captura else (None, None)
+        numero_processo = numero_processo or extrair_numero_processo(page)
+        polo = polo or extrair_polo(page) # Extrai a nova informação
         
-        try:
-            navegar_para_detalhes_do_npj(page, npj)
-            
-            numero_processo = extrair_numero_processo(page)
-            polo = extrair_polo(page) # Extrai a nova informação
-            
-            is_migracao = (origem == 'migracao')
-            
-            documentos = baixar_documentos(page, data_notificacao, npj, is_migracao)
-            andamentos = extrair_andamentos(page, data_notificacao, is_migracao)
-            
-            stats["documentos"] += len(documentos)
-            stats["andamentos"] += len(andamentos)
-
-            proximo_responsavel = database.get_next_user(polo_da_tarefa=polo)
-            
-            status_final = 'Migrado' if is_migracao else 'Processado'
-            
-            database.atualizar_notificacoes_processadas(
-                npj, data_notificacao, numero_processo, andamentos, documentos, 
-                data_hora_processamento, proximo_responsavel, status=status_final,
-                polo=polo # Passa a nova informação para o banco
+        is_migracao = (origem == 'migracao')
+        documentos_diretos = [] if gerenciador else None
+        
+        if captura and not ha_documentos_na_janela_via_xhr(documentos_do_json(captura.json('documentos')), data_notificacao, is_migracao):
+            logging.info("      - Nenhum documento na janela de datas segundo a resposta XHR. Pulando a etapa de download.")
+            documentos = []
+        else:
+            with medir_etapa('documentos', npj):
+                documentos = baixar_documentos(page, data_notificacao, npj, is_migracao, documentos_diretos)
+        andamentos = andamentos_via_xhr(andamentos_do_json(captura.json('andamentos')), data_notificacao, is_migracao) if captura else None
+        if andamentos is None:
+            with medir_etapa('andamentos', npj):
+                andamentos = extrair_andamentos(page, data_notificacao, is_migracao, npj)
+        
+        stats["andamentos"] += len(andamentos)
+        status_final = 'Migrado' if is_migracao else 'Processado'
+
+        if documentos_diretos:
+            # A aba segue para o próximo NPJ; a tarefa é gravada quando o último arquivo terminar.
+            logging.info(f"      - {len(documentos_diretos)} documento(s) enviado(s) para download direto. A tarefa será finalizada ao término.")
+            gerenciador.enviar(
+                npj, data_notificacao, diretorio_documentos_npj(npj), documentos_diretos,
+                lambda resultados: _finalizar_apos_downloads(
+                    gerenciador, npj, data_notificacao, numero_processo, andamentos, documentos,
+                    data_hora_processamento, status_final, polo, resultados
+                )
             )
-            logging.info(f"SUCESSO: Tarefa {npj} finalizada como '{status_final}' e atribuída a {proximo_responsavel or 'Ninguém'}.")
-            stats["sucesso"] += 1
-
-        except TimeoutError as e:
-            detalhes_erro = f"Timeout: A página demorou muito para responder. Causa provável: sessão expirada ou instabilidade do portal. Detalhe: {e}"
-            logging.critical(f"    - Timeout detectado ao processar NPJ {npj}. {detalhes_erro}")
-            database.marcar_tarefa_como_erro(npj, data_notificacao, detalhes_erro, data_hora_processamento, tipo_erro='portal')
-            stats["falha"] += 1
-            if not page.is_closed():
-                page.close()
-            raise SessionExpiredError("Timeout durante a navegação, indicando possível sessão expirada.") from e
-
-        except (ValueError, Error) as e:
-            erro_str = str(e).lower()
-            tipo_erro = 'portal'
-            
-            if "processo nao localizado" in erro_str or "formato de npj inválido" in erro_str:
-                tipo_erro = 'permanente'
-            elif "ged indisponível" in erro_str:
-                tipo_erro = 'portal'
-
-            detalhes_erro = f"Erro de automação ou portal ({tipo_erro}): {e}"
-            logging.error(f"  - ERRO CONHECIDO ao processar NPJ {npj}: {detalhes_erro}", exc_info=False)
-            database.marcar_tarefa_como_erro(npj, data_notificacao, detalhes_erro, data_hora_processamento, tipo_erro=tipo_erro)
-            stats["falha"] += 1
-
-        except SessionExpiredError:
-            raise
-
-        except Exception as e:
-            detalhes_erro = f"Erro inesperado no sistema: {e}"
-            logging.critical(f"Ocorreu um erro inesperado ao processar NPJ {npj}.\n{detalhes_erro}", exc_info=True)
-            database.marcar_tarefa_como_erro(npj, data_notificacao, detalhes_erro, data_hora_processamento, tipo_erro='portal')
-            stats["falha"] += 1
-            if not page.is_closed():
-                page.close()
-            page = context.new_page()
-            
-    if not page.is_closed():
-        page.close()
+            return page
+
+        stats["documentos"] += len(documentos)
         
+        # O responsável é escolhido pelo round-robin na mesma transação que grava a tarefa
+        proximo_responsavel = database.atualizar_notificacoes_processadas(
+            npj, data_notificacao, numero_processo, andamentos, documentos, 
+            data_hora_processamento, status=status_final,
+            polo=polo # Passa a nova informação para o banco
+        )
+        logging.info(f"SUCESSO: Tarefa {npj} finalizada como '{status_final}' e atribuída a {proximo_responsavel or 'Ninguém'}.")
+        stats["sucesso"] += 1
+        database.renovar_lease()
+
+    except TimeoutError as e:
+        detalhes_erro = f"Timeout: A página demorou muito para responder. Causa provável: sessão expirada ou instabilidade do portal. Detalhe: {e}"
+        logging.critical(f"    - Timeout detectado ao processar NPJ {npj}. {detalhes_erro}")
+        database.marcar_tarefa_como_erro(npj, data_notificacao, detalhes_erro, data_hora_processamento, tipo_erro='portal')
+        stats["falha"] += 1
+        if not page.is_closed():
+            page.close()
+        raise SessionExpiredError("Timeout durante a navegação, indicando possível sessão expirada.") from e
+
+    except (ValueError, Error) as e:
+        tipo_erro = classificar_erro(e)
+        detalhes_erro = f"Erro de automação ou portal ({tipo_erro}): {e}"
+        logging.error(f"  - ERRO CONHECIDO ao processar NPJ {npj}: {detalhes_erro}", exc_info=False)
+        database.marcar_tarefa_como_erro(npj, data_notificacao, detalhes_erro, data_hora_processamento, tipo_erro=tipo_erro)
+        stats["falha"] += 1
+
+    except SessionExpiredError:
+        raise
+
+    except Exception as e:
+        detalhes_erro = f"Erro inesperado no sistema: {e}"
+        logging.critical(f"Ocorreu um erro inesperado ao processar NPJ {npj}.\n{detalhes_erro}", exc_info=True)
+        database.marcar_tarefa_como_erro(npj, data_notificacao, detalhes_erro, data_hora_processamento, tipo_erro='portal')
+        stats["falha"] += 1
+        if not page.is_closed():
+            page.close()
+        page = context.new_page()
+
+    finally:
+        if captura:
+            captura.encerrar()
+
+    return page
+
+def _consumir_fila(context: BrowserContext, fila: queue.Queue, parar: threading.Event, total: int, stats: Dict[str, int],
+                   gerenciador: Optional[GerenciadorDownloads]):
+    """Processa tarefas da fila do lote em uma aba própria até a fila esvaziar ou outra aba sinalizar sessão expirada."""
+    page = context.new_page()
+    try:
+        while not parar.is_set():
+            try:
+                posicao, tarefa = fila.get_nowait()
+            except queue.Empty:
+                break
+            try:
+                page = _processar_tarefa(context, page, tarefa, posicao, total, stats, gerenciador)
+            except SessionExpiredError:
+                parar.set()
+                raise
+    finally:
+        if not page.is_closed():
+            page.close()
+
+def _consumir_fila_em_thread(estado_sessao: dict, fila: queue.Queue, parar: threading.Event, total: int, stats: Dict[str, int],
+                             gerenciador: Optional[GerenciadorDownloads], erros: list):
+    """
+    Aba paralela: a API síncrona do Playwright não pode ser compartilhada entre threads, então cada
+    thread abre sua própria conexão CDP com o Chrome já logado e um contexto com a mesma sessão.
+    """
+    try:
+        with sync_playwright() as playwright:
+            browser = playwright.chromium.connect_over_cdp(CDP_ENDPOINT)
+            context = browser.new_context(storage_state=estado_sessao)
+            instalar_politica_de_recursos(context)
+            try:
+                _consumir_fila(context, fila, parar, total, stats, gerenciador)
+            finally:
+                context.close()
+    except SessionExpiredError as e:
+        erros.append(e)
+    except Exception as e:
+        # Falha isolada da aba: as tarefas restantes continuam sendo consumidas pelas demais abas.
+        logging.error(f"Aba paralela encerrada por falha inesperada: {e}", exc_info=True)
+    finally:
+        fechar_conexao()
+
+def processar_detalhes_de_lote(context: BrowserContext, lote: List[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    Processa um lote de tarefas (NPJ + data), navegando para a URL de cada um e extraindo os detalhes.
+    Com PAGINAS_PARALELAS > 1, as tarefas do lote são distribuídas entre várias abas do mesmo navegador logado.
+    """
+    total = len(lote)
+    fila = queue.Queue()
+    for posicao, tarefa in enumerate(lote, start=1):
+        fila.put((posicao, tarefa))
+
+    parar = threading.Event()
+    num_abas = max(1, min(PAGINAS_PARALELAS, total))
+    stats_por_aba = [_novas_stats() for _ in range(num_abas)]
+    erros: list = []
+    threads = []
+    estado_sessao = context.storage_state() if num_abas > 1 or DOWNLOADS_DIRETOS else None
+    gerenciador = GerenciadorDownloads(estado_sessao) if DOWNLOADS_DIRETOS else None
+
+    try:
+        if num_abas == 1:
+            contexto_lote = context
+        else:
+            logging.info(f"Distribuindo {total} tarefa(s) entre {num_abas} abas paralelas.")
+            # Contextos próprios (com os cookies da sessão) isolam downloads e falhas de cada aba.
+            for n in range(1, num_abas):
+                thread = threading.Thread(
+                    target=_consumir_fila_em_thread, name=f"Aba-{n + 1}",
+                    args=(estado_sessao, fila, parar, total, stats_por_aba[n], gerenciador, erros)
+                )
+                thread.start()
+                threads.append(thread)
+            contexto_lote = context.browser.new_context(storage_state=estado_sessao)
+            instalar_politica_de_recursos(contexto_lote)
+
+        try:
+            _consumir_fila(contexto_lote, fila, parar, total, stats_por_aba[0], gerenciador)
+        except SessionExpiredError as e:
+            erros.append(e)
+        finally:
+            if contexto_lote is not context:
+                contexto_lote.close()
+    finally:
+        for thread in threads:
+            thread.join()
+        if gerenciador:
+            # As tarefas com downloads diretos só são gravadas quando os arquivos terminam.
+            gerenciador.encerrar()
+            stats_por_aba.append(gerenciador.stats)
+
+    # Tarefas que nenhuma aba chegou a iniciar (ex: sessão expirada) voltam à fila imediatamente.
+    nao_iniciadas = []
+    while not fila.empty():
+        nao_iniciadas.append(fila.get_nowait()[1]['id'])
+    database.liberar_tarefas(nao_iniciadas)
+    registrar_resumo_de_estouros()
+
+    if erros:
+        raise erros[0]
+
+    stats = _novas_stats()
+    for stats_aba in stats_por_aba:
+        for chave, valor in stats_aba.items():
+            stats[chave] += valor
     logging.info("Processamento do lote concluído.")
     return stats
@@ -0,0 +1,439 @@
+import asyncio
+import logging
+import threading
+import time
+from collections import Counter
+from datetime import datetime
+from typing import List, Dict, Any, Optional
+from playwright.async_api import async_playwright, Page, BrowserContext, Error, TimeoutError
+import database
+from armazem_documentos import armazenar, documento_ja_armazenado
+from autologin import CDP_ENDPOINT
+from captura_xhr import CapturaXHR, andamentos_do_json, documentos_do_json, processo_do_json
+from config import (
+    CAPTURA_XHR, DOWNLOAD_TENTATIVAS, DOWNLOAD_TIMEOUT_MS, DOWNLOADS_DIRETOS, DOWNLOADS_PARALELOS, ORCAMENTO_ETAPAS_MS, PAGINAS_PARALELAS
+)
+from downloads import gravar_arquivo, nome_arquivo_da_resposta, registrar_resultado, resposta_indica_ged_indisponivel
+from politica_recursos import instalar_politica_de_recursos_async
+from processamento_detalhado import (
+    JS_LINHAS_ANDAMENTOS, JS_LINHAS_DOCUMENTOS, andamentos_via_xhr, calcular_datas_permitidas, classificar_erro,
+    diretorio_documentos_npj, filtrar_linhas_por_data, ha_documentos_na_janela_via_xhr, medir_etapa, montar_url_detalhe,
+    registrar_resumo_de_estouros
+)
+from session import SessionExpiredError
+
+# --- Modo assíncrono da FASE 3 (main.py --async) ---
+# Espelha as funções de 'processamento_detalhado' sobre a playwright.async_api: enquanto uma aba
+# espera pelo portal, as demais navegam, os downloads são salvos em segundo plano e as gravações
+# no SQLite rodam em threads auxiliares (asyncio.to_thread), sem bloquear o laço de eventos.
+
+async def expandir_secao(titulo, npj: str):
+    """Abre um accordion fechado e aguarda o ícone trocar de estado (sem pausa fixa)."""
+    if 'mi--keyboard-arrow-down' not in (await titulo.locator('i').get_attribute('class') or ''):
+        return
+    with medir_etapa('expandir_secao', npj):
+        await titulo.click()
+        try:
+            await titulo.locator('i.mi--keyboard-arrow-down').wait_for(state='detached', timeout=ORCAMENTO_ETAPAS_MS['expandir_secao'])
+        except TimeoutError:
+            pass # O estouro é registrado por medir_etapa; a espera pela tabela decide se a seção abriu.
+
+async def extrair_numero_processo(page: Page) -> Optional[str]:
+    """Extrai o número do processo da página de detalhes."""
+    try:
+        selector_processo = 'div.chip[bb-title="Processo"] span.chip__desc'
+        await page.wait_for_selector(selector_processo, timeout=10000)
+
+        if await page.locator(selector_processo).count() > 0:
+            numero_processo = (await page.locator(selector_processo).inner_text()).strip()
+            logging.info(f"      - Número do Processo encontrado: {numero_processo}")
+            return numero_processo
+
+    except Error as e:
+        logging.warning(f"      - Não foi possível extrair o número do processo: {e}")
+    return None
+
+async def extrair_polo(page: Page) -> Optional[str]:
+    """Extrai o polo (Ativo/Passivo) do cabeçalho da página."""
+    try:
+        selector_polo = 'div[bb-title="Polo"] span.chip__desc'
+        if await page.locator(selector_polo).count() > 0:
+            polo = (await page.locator(selector_polo).inner_text()).strip()
+            logging.info(f"      - Polo do BB encontrado: {polo}")
+            return polo
+        logging.warning("      - Não foi possível encontrar o elemento do Polo na página.")
+    except Error as e:
+        logging.warning(f"      - Erro ao tentar extrair o Polo: {e}")
+    return None
+
+async def extrair_andamentos(page: Page, data_notificacao_recente: str, is_migracao: bool, npj: str) -> List[Dict[str, str]]:
+    """
+    Clica no menu 'Andamentos' (seja aba ou accordion), filtra por data e extrai os dados.
+    Publicações já detalhadas em visitas anteriores ao NPJ vêm do cache, sem reabrir o modal.
+    """
+    andamentos = []
+    try:
+        secao_andamentos_accordion = page.locator('div.accordion__item[bb-item-title="ANDAMENTOS"]')
+
+        if await secao_andamentos_accordion.count() > 0:
+            await expandir_secao(secao_andamentos_accordion.locator(".accordion__title").first, npj)
+        else:
+            await page.locator('li:has-text("Andamentos")').click(timeout=10000)
+
+        await page.wait_for_selector('lista-andamentos-processo', state='visible', timeout=15000)
+
+        primeira_linha_selector = 'tr[ng-repeat-start="item in grupoMes.itens"]'
+        try:
+            await page.wait_for_selector(primeira_linha_selector, timeout=10000)
+        except TimeoutError:
+            logging.info("      - Nenhuma linha de andamento encontrada na tabela após espera.")
+            return []
+
+        datas_permitidas = calcular_datas_permitidas(data_notificacao_recente, is_migracao)
+
+        linhas_locator = page.locator(primeira_linha_selector)
+        linhas = await linhas_locator.evaluate_all(JS_LINHAS_ANDAMENTOS)
+        cache = await asyncio.to_thread(database.buscar_andamentos_em_cache, npj)
+        publicacoes_novas = []
+        ocorrencias_no_dia = Counter()
+
+        for indice, linha in filtrar_linhas_por_data(linhas, datas_permitidas):
+            try:
+                descricao = linha['descricao']
+                detalhes = descricao
+                chave_cache = (linha['data'], descricao, ocorrencias_no_dia[(linha['data'], descricao)])
+                ocorrencias_no_dia[(linha['data'], descricao)] += 1
+
+                if "PUBLICACAO DJ/DO" in descricao.upper() and linha['tem_publicacao'] and chave_cache in cache:
+                    detalhes = cache[chave_cache]
+                elif "PUBLICACAO DJ/DO" in descricao.upper() and linha['tem_publicacao']:
+                    with medir_etapa('modal_publicacao', npj):
+                        await linhas_locator.nth(indice).locator('a[bb-tooltip="Detalhar publicação"]').click()
+                        modal_selector = 'div.modal__data'
+                        await page.wait_for_selector(modal_selector, state='visible', timeout=10000)
+
+                        texto_completo_selector = page.locator(f'{modal_selector} texto-grande-detalhar')
+                        leia_mais_btn = page.locator(f'{modal_selector} button:has-text("Leia mais")')
+                        if await leia_mais_btn.count() > 0:
+                            await leia_mais_btn.click(timeout=5000)
+                        await texto_completo_selector.wait_for(state='attached', timeout=5000)
+                        detalhes = await texto_completo_selector.get_attribute('conteudo-texto') or ""
+
+                        await page.keyboard.press("Escape")
+                        await page.wait_for_selector(modal_selector, state='hidden', timeout=5000)
+                    publicacoes_novas.append({"data": linha['data'], "descricao": descricao, "ordem": chave_cache[2], "detalhes": detalhes})
+
+                andamentos.append({"data": linha['data'], "descricao": descricao, "detalhes": detalhes})
+            except Error as e:
+                logging.warning(f"      - Erro ao processar uma linha de andamento: {e}")
+                continue
+        logging.info(f"      - {len(andamentos)} andamento(s) capturado(s) dentro do período de datas.")
+        await asyncio.to_thread(database.salvar_andamentos_em_cache, npj, publicacoes_novas)
+    except Error as e:
+        logging.warning(f"      - Erro inesperado ao extrair andamentos: {e}")
+        raise
+    return andamentos
+
+async def _baixar_direto(page: Page, documento: Dict[str, str], diretorio, npj: str, data_notificacao: str, limite: asyncio.Semaphore) -> str:
+    """Baixa um documento pela APIRequestContext do contexto (cookies da sessão), com tentativas. Retorna o caminho salvo."""
+    inicio = time.monotonic()
+    resultado = {"status": "falha", "caminho": None, "tamanho_bytes": None, "status_http": None, "tentativas": 0, "erro": None}
+    async with limite:
+        for tentativa in range(1, DOWNLOAD_TENTATIVAS + 1):
+            resultado["tentativas"] = tentativa
+            try:
+                resposta = await page.context.request.get(documento['url'], timeout=DOWNLOAD_TIMEOUT_MS)
+                corpo = await resposta.body()
+                resultado["status_http"] = resposta.status
+                if resposta.ok and resposta_indica_ged_indisponivel(resposta.status, resposta.headers, corpo):
+                    resultado.update(status="ged_indisponivel", erro="GED indisponível")
+                elif resposta.ok:
+                    nome = nome_arquivo_da_resposta(resposta.headers, documento['nome'])
+                    caminho = await asyncio.to_thread(gravar_arquivo, diretorio, nome, corpo)
+                    caminho = await asyncio.to_thread(armazenar, caminho, npj, documento['nome'], documento['data'])
+                    resultado.update(status="ok", caminho=str(caminho), tamanho_bytes=len(corpo), erro=None)
+                    break
+                else:
+                    resultado["erro"] = f"HTTP {resposta.status}"
+            except Error as e:
+                resultado["erro"] = str(e)
+            if tentativa < DOWNLOAD_TENTATIVAS:
+                await asyncio.sleep(2 * tentativa)
+    resultado["duracao_ms"] = int((time.monotonic() - inicio) * 1000)
+    await asyncio.to_thread(registrar_resultado, npj, data_notificacao, documento, resultado)
+
+    if resultado["status"] == "ged_indisponivel":
+        raise ValueError("GED indisponível")
+    if resultado["status"] != "ok":
+        raise RuntimeError(resultado["erro"])
+    return resultado["caminho"]
+
+async def _salvar_e_armazenar(download, caminho_salvo, npj: str, nome: str, data_documento: str) -> str:
+    """Salva um download do navegador e o registra no armazém de documentos. Retorna o caminho final."""
+    # O caminho pode ser um hard link para um blob do armazém: 'save_as' reescreveria o blob no lugar.
+    caminho_salvo.unlink(missing_ok=True)
+    await download.save_as(caminho_salvo)
+    return str(await asyncio.to_thread(armazenar, caminho_salvo, npj, nome, data_documento))
+
+async def baixar_documentos(page: Page, data_notificacao_recente: str, npj: str, is_migracao: bool,
+                            limite_downloads: Optional[asyncio.Semaphore] = None) -> List[Dict[str, str]]:
+    """
+    Expande as seções de documentos, filtra pela data e baixa os arquivos.
+    Cada arquivo é salvo em segundo plano enquanto a página segue para o próximo download; com
+    'limite_downloads', os documentos com URL própria são baixados diretamente pela API HTTP.
+    """
+    documentos_baixados = []
+    salvamentos = []
+    documentos_reaproveitados = [] # já estavam no armazém; não têm salvamento pendente
+    try:
+        seletor_layout_novo = 'div.accordion__item[bb-item-title="DOCUMENTOS"]'
+        seletor_layout_antigo = 'div.accordion__item[bb-item-title="Documentos"]'
+
+        secao_container = None
+
+        if await page.locator(seletor_layout_novo).count() > 0:
+            secao_container = page.locator(seletor_layout_novo)
+            await expandir_secao(secao_container.locator('.accordion__title').first, npj)
+
+            sub_secao = secao_container.locator(seletor_layout_antigo)
+            if await sub_secao.count() > 0:
+                await expandir_secao(sub_secao.locator('.accordion__title').first, npj)
+
+        elif await page.locator(seletor_layout_antigo).count() > 0:
+            secao_container = page.locator(seletor_layout_antigo)
+            await expandir_secao(secao_container.locator('.accordion__title').first, npj)
+
+        if not secao_container:
+            logging.info("      - Nenhuma seção de documentos encontrada para este NPJ. Pulando a etapa de download.")
+            return []
+
+        diretorio_download_npj = diretorio_documentos_npj(npj)
+        datas_permitidas = calcular_datas_permitidas(data_notificacao_recente, is_migracao)
+
+        tabela_documentos = secao_container.locator('table[ng-table="vm.tabelaDocumento"]')
+        await tabela_documentos.wait_for(state='visible', timeout=45000)
+
+        linhas_locator = tabela_documentos.locator('tbody tr')
+        linhas = await linhas_locator.evaluate_all(JS_LINHAS_DOCUMENTOS)
+
+        for indice, linha in filtrar_linhas_por_data(linhas, datas_permitidas):
+            if not linha['tem_link']:
+                continue
+            nome_arquivo = linha['nome']
+
+            caminho_existente = await asyncio.to_thread(documento_ja_armazenado, npj, nome_arquivo, linha['data'])
+            if caminho_existente:
+                documentos_reaproveitados.append({"nome": nome_arquivo, "caminho": caminho_existente})
+                continue
+
+            if limite_downloads is not None and linha['url']:
+                documento = {"nome": nome_arquivo, "url": linha['url'], "data": linha['data']}
+                salvamentos.append(asyncio.create_task(
+                    _baixar_direto(page, documento, diretorio_download_npj, npj, data_notificacao_recente, limite_downloads)
+                ))
+                documentos_baixados.append(documento)
+                continue
+
+            try:
+                async with page.expect_download(timeout=15000) as download_info:
+                    await linhas_locator.nth(indice).locator('td').nth(1).locator('a').click()
+
+                download = await download_info.value
+                caminho_salvo = diretorio_download_npj / download.suggested_filename
+                salvamentos.append(asyncio.create_task(_salvar_e_armazenar(download, caminho_salvo, npj, nome_arquivo, linha['data'])))
+                documentos_baixados.append({"nome": nome_arquivo, "caminho": str(caminho_salvo)})
+
+            except Error:
+                if "GED indisponível" in await page.content():
+                    logging.error(f"         - ERRO DE PORTAL: GED indisponível para o arquivo '{nome_arquivo}'.")
+                    await page.go_back(wait_until="domcontentloaded")
+                    raise ValueError("GED indisponível")
+                else:
+                    logging.warning(f"         - Timeout ou outra falha no download do arquivo '{nome_arquivo}'.")
+
+        # Só considera baixados os arquivos cujo salvamento em disco terminou sem erro.
+        resultados = await asyncio.gather(*salvamentos, return_exceptions=True)
+        for documento, resultado in zip(list(documentos_baixados), resultados):
+            if isinstance(resultado, ValueError) and "GED indisponível" in str(resultado):
+                logging.error(f"         - ERRO DE PORTAL: GED indisponível para o arquivo '{documento['nome']}'.")
+                raise resultado
+            if isinstance(resultado, Exception):
+                logging.warning(f"         - Falha ao salvar o arquivo '{documento['nome']}': {resultado}")
+                documentos_baixados.remove(documento)
+            elif isinstance(resultado, str):
+                documento['caminho'] = resultado
+                documento.pop('url', None)
+                documento.pop('data', None)
+        documentos_baixados.extend(documentos_reaproveitados)
+        logging.info(f"      - {len(documentos_baixados)} documento(s) baixado(s) para o NPJ {npj}.")
+
+    except Error as e:
+        logging.warning(f"      - Ocorreu um erro geral ao processar documentos: {e}")
+        raise
+
+    finally:
+        for salvamento in salvamentos:
+            if not salvamento.done():
+                salvamento.cancel()
+        loader = page.locator('plt-carregando div.loader.is-loading')
+        if await loader.count() > 0:
+            with medir_etapa('loader', npj):
+                try:
+                    await loader.wait_for(state='hidden', timeout=ORCAMENTO_ETAPAS_MS['loader'])
+                except TimeoutError:
+                    logging.warning("      - O loader não desapareceu dentro do orçamento; a execução continuará.")
+
+    return documentos_baixados
+
+async def navegar_para_detalhes_do_npj(page: Page, npj: str):
+    """Navega diretamente para a página de detalhes do NPJ e garante que o conteúdo esteja sincronizado."""
+    url_final, npj_formatado = montar_url_detalhe(npj)
+    await page.goto(url_final, wait_until="domcontentloaded", timeout=60000)
+
+    chip_npj_selector = f'div[bb-title="NPJ"] span.chip__desc:has-text("{npj_formatado}")'
+    await page.wait_for_selector(chip_npj_selector, timeout=30000)
+
+    if await page.locator('text=/processo n(ã|a)o localizado/i').count() > 0:
+        raise Error(f"Processo {npj} não foi encontrado no portal (página de erro).")
+
+async def _processar_tarefa(context: BrowserContext, tarefa: Dict[str, Any], posicao: int, total: int, stats: Dict[str, int],
+                            limite_downloads: Optional[asyncio.Semaphore]):
+    """Processa uma tarefa (NPJ + data) em uma aba própria, aberta e fechada para ela."""
+    npj = tarefa.get('NPJ')
+    data_notificacao = tarefa.get('data_notificacao')
+    origem = tarefa.get('origem', 'onenotify')
+    data_hora_processamento = datetime.now().strftime('%d/%m/%Y %H:%M:%S')
+
+    if not data_notificacao:
+        logging.error(f"  - [{posicao}/{total}] ERRO DE DADOS: O grupo para o NPJ {npj} foi recebido sem uma data válida. Pulando este item.")
+        motivo = "Dados inconsistentes: Data da notificação não encontrada."
+        await asyncio.to_thread(database.marcar_tarefa_como_erro, npj, data_notificacao, motivo, data_hora_processamento, tipo_erro='permanente')
+        stats["falha"] += 1
+        return
+
+    logging.info(f"[{posicao}/{total}] Processando Tarefa: {npj} (Data: {data_notificacao}, Origem: {origem})")
+    page = await context.new_page()
+    captura = CapturaXHR(page) if CAPTURA_XHR['ativa'] else None
+    try:
+        with medir_etapa('navegacao', npj):
+            await navegar_para_detalhes_do_npj(page, npj)
+
+        numero_processo, polo = processo_do_json(await captura.json_async('processo')) if captura else (None, None)
+        numero_processo = numero_processo or await extrair_numero_processo(page)
+        polo = polo or await extrair_polo(page)
+
+        is_migracao = (origem == 'migracao')
+
+        if captura and not ha_documentos_na_janela_via_xhr(documentos_do_json(await captura.json_async('documentos')), data_notificacao, is_migracao):
+            documentos = []
+        else:
+            with medir_etapa('documentos', npj):
+                documentos = await baixar_documentos(page, data_notificacao, npj, is_migracao, limite_downloads)
+        andamentos = andamentos_via_xhr(andamentos_do_json(await captura.json_async('andamentos')), data_notificacao, is_migracao) if captura else None
+        if andamentos is None:
+            with medir_etapa('andamentos', npj):
+                andamentos = await extrair_andamentos(page, data_notificacao, is_migracao, npj)
+
+        stats["documentos"] += len(documentos)
+        stats["andamentos"] += len(andamentos)
+
+        status_final = 'Migrado' if is_migracao else 'Processado'
+
+        proximo_responsavel = await asyncio.to_thread(
+            database.atualizar_notificacoes_processadas,
+            npj, data_notificacao, numero_processo, andamentos, documentos,
+            data_hora_processamento, status=status_final, polo=polo
+        )
+        logging.info(f"SUCESSO: Tarefa {npj} finalizada como '{status_final}' e atribuída a {proximo_responsavel or 'Ninguém'}.")
+        stats["sucesso"] += 1
+        await asyncio.to_thread(database.renovar_lease)
+
+    except TimeoutError as e:
+        detalhes_erro = f"Timeout: A página demorou muito para responder. Causa provável: sessão expirada ou instabilidade do portal. Detalhe: {e}"
+        logging.critical(f"    - Timeout detectado ao processar NPJ {npj}. {detalhes_erro}")
+        await asyncio.to_thread(database.marcar_tarefa_como_erro, npj, data_notificacao, detalhes_erro, data_hora_processamento, tipo_erro='portal')
+        stats["falha"] += 1
+        raise SessionExpiredError("Timeout durante a navegação, indicando possível sessão expirada.") from e
+
+    except (ValueError, Error) as e:
+        tipo_erro = classificar_erro(e)
+        detalhes_erro = f"Erro de automação ou portal ({tipo_erro}): {e}"
+        logging.error(f"  - ERRO CONHECIDO ao processar NPJ {npj}: {detalhes_erro}", exc_info=False)
+        await asyncio.to_thread(database.marcar_tarefa_como_erro, npj, data_notificacao, detalhes_erro, data_hora_processamento, tipo_erro=tipo_erro)
+        stats["falha"] += 1
+
+    except Exception as e:
+        detalhes_erro = f"Erro inesperado no sistema: {e}"
+        logging.critical(f"Ocorreu um erro inesperado ao processar NPJ {npj}.\n{detalhes_erro}", exc_info=True)
+        await asyncio.to_thread(database.marcar_tarefa_como_erro, npj, data_notificacao, detalhes_erro, data_hora_processamento, tipo_erro='portal')
+        stats["falha"] += 1
+
+    finally:
+        if captura:
+            captura.encerrar()
+        if not page.is_closed():
+            await page.close()
+
+async def _processar_lote(estado_sessao: dict, lote: List[Dict[str, Any]], stats: Dict[str, int], nao_iniciadas: List[int]):
+    """Processa o lote com no máximo PAGINAS_PARALELAS abas simultâneas no Chrome já logado."""
+    limite = asyncio.Semaphore(max(1, PAGINAS_PARALELAS))
+    limite_downloads = asyncio.Semaphore(max(1, DOWNLOADS_PARALELOS)) if DOWNLOADS_DIRETOS else None
+    parar = asyncio.Event()
+    total = len(lote)
+
+    async with async_playwright() as playwright:
+        browser = await playwright.chromium.connect_over_cdp(CDP_ENDPOINT)
+        context = await browser.new_context(storage_state=estado_sessao)
+        await instalar_politica_de_recursos_async(context)
+
+        async def executar(posicao: int, tarefa: Dict[str, Any]):
+            async with limite:
+                if parar.is_set():
+                    nao_iniciadas.append(tarefa['id'])
+                    return
+                try:
+                    await _processar_tarefa(context, tarefa, posicao, total, stats, limite_downloads)
+                except SessionExpiredError:
+                    parar.set()
+                    raise
+
+        try:
+            resultados = await asyncio.gather(
+                *(executar(posicao, tarefa) for posicao, tarefa in enumerate(lote, start=1)),
+                return_exceptions=True
+            )
+        finally:
+            await context.close()
+
+    for resultado in resultados:
+        if isinstance(resultado, BaseException):
+            raise resultado
+
+def processar_detalhes_de_lote_async(context, lote: List[Dict[str, Any]]) -> Dict[str, int]:
+    """
+    Equivalente a 'processar_detalhes_de_lote' no modo --async. O laço asyncio roda em uma thread
+    própria, pois a API síncrona do Playwright já ocupa o laço de eventos da thread principal.
+    """
+    stats = {"sucesso": 0, "falha": 0, "andamentos": 0, "documentos": 0}
+    nao_iniciadas: List[int] = []
+    erros: list = []
+    estado_sessao = context.storage_state()
+
+    def executar_laco():
+        try:
+            asyncio.run(_processar_lote(estado_sessao, lote, stats, nao_iniciadas))
+        except BaseException as e:
+            erros.append(e)
+
+    logging.info(f"Processando {len(lote)} tarefa(s) no modo assíncrono com até {PAGINAS_PARALELAS} abas simultâneas.")
+    thread = threading.Thread(target=executar_laco, name="Fase3-Async")
+    thread.start()
+    thread.join()
+
+    database.liberar_tarefas(nao_iniciadas)
+    registrar_resumo_de_estouros()
+    if erros:
+        raise erros[0]
+
+    logging.info("Processamento do lote concluído.")
+    return stats
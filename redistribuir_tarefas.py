@@ -11,7 +11,7 @@ logging.basicConfig(level=logging.INFO, format=LOG_FORMAT)
 
 def redistribuir_responsaveis():
     """
-    Realiza a redistribuição de todas as notificações existentes no banco de dados
+    Realiza a redistribuição de todas as tarefas existentes no banco de dados
     com base nas novas regras de perfil de usuário (Geral vs. Polo Ativo).
     """
     conn = None
@@ -43,16 +43,16 @@ def redistribuir_responsaveis():
         # Pool de usuários para notificações de Polo Ativo (todos os usuários)
         pool_polo_ativo = usuarios_gerais + usuarios_polo_ativo
         
-        # 2. Buscar todas as notificações já processadas (que possuem um responsável)
-        logging.info("Buscando todas as notificações já processadas para redistribuir...")
-        cursor.execute("SELECT id, polo FROM notificacoes WHERE responsavel IS NOT NULL AND responsavel != ''")
-        notificacoes = cursor.fetchall()
+        # 2. Buscar todas as tarefas já processadas (que possuem um responsável)
+        logging.info("Buscando todas as tarefas já processadas para redistribuir...")
+        cursor.execute("SELECT id, polo FROM tarefas WHERE responsavel IS NOT NULL AND responsavel != ''")
+        tarefas = cursor.fetchall()
 
-        if not notificacoes:
-            logging.info("Nenhuma notificação para redistribuir. Encerrando.")
+        if not tarefas:
+            logging.info("Nenhuma tarefa para redistribuir. Encerrando.")
             return
 
-        logging.info(f"Total de {len(notificacoes)} notificações a serem redistribuídas.")
+        logging.info(f"Total de {len(tarefas)} tarefas a serem redistribuídas.")
 
         # 3. Preparar iteradores cíclicos para as listas de usuários (round-robin)
         ciclo_geral = cycle(usuarios_gerais)
@@ -61,24 +61,24 @@ def redistribuir_responsaveis():
         updates_gerais = []
         updates_polo_ativo = []
 
-        # 4. Separar notificações e preparar os updates
-        for notificacao in notificacoes:
-            if notificacao['polo'] == 'Ativo':
+        # 4. Separar tarefas e preparar os updates
+        for tarefa in tarefas:
+            if tarefa['polo'] == 'Ativo':
                 novo_responsavel = next(ciclo_polo_ativo)
-                updates_polo_ativo.append((novo_responsavel, notificacao['id']))
+                updates_polo_ativo.append((novo_responsavel, tarefa['id']))
             else: # Passivo, Nulo ou qualquer outro valor
                 novo_responsavel = next(ciclo_geral)
-                updates_gerais.append((novo_responsavel, notificacao['id']))
+                updates_gerais.append((novo_responsavel, tarefa['id']))
 
         # 5. Executar as atualizações no banco de dados
         logging.info("Iniciando a atualização no banco de dados...")
         if updates_polo_ativo:
-            logging.info(f"Redistribuindo {len(updates_polo_ativo)} notificações de 'Polo Ativo'...")
-            cursor.executemany("UPDATE notificacoes SET responsavel = ? WHERE id = ?", updates_polo_ativo)
+            logging.info(f"Redistribuindo {len(updates_polo_ativo)} tarefas de 'Polo Ativo'...")
+            cursor.executemany("UPDATE tarefas SET responsavel = ? WHERE id = ?", updates_polo_ativo)
         
         if updates_gerais:
-            logging.info(f"Redistribuindo {len(updates_gerais)} notificações de outros polos (Passivo, Nulo, etc)...")
-            cursor.executemany("UPDATE notificacoes SET responsavel = ? WHERE id = ?", updates_gerais)
+            logging.info(f"Redistribuindo {len(updates_gerais)} tarefas de outros polos (Passivo, Nulo, etc)...")
+            cursor.executemany("UPDATE tarefas SET responsavel = ? WHERE id = ?", updates_gerais)
 
         conn.commit()
         logging.info(f"Redistribuição concluída com sucesso! {cursor.rowcount} registros atualizados no total.")